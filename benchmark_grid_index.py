@@ -0,0 +1,122 @@
+import argparse
+import time
+
+import numpy as np
+from pyquaternion import Quaternion
+
+from src.datasets.dataset import Dataset
+from src.utils.bev_grid_index import BevGridIndex
+from src.utils.geometry_utils import points_in_box
+
+
+def __create_dataset(dataset: str,
+                     dataroot: str,
+                     version: str,
+                     split: str) -> Dataset:
+    if dataset == 'nuscenes':
+        from src.datasets.nuscenes.nuscenes_dataset import NuscenesDataset
+        return NuscenesDataset(version=version, dataroot=dataroot)
+    elif dataset == 'once':
+        from src.datasets.once.once_dataset import OnceDataset
+        return OnceDataset(split=split, dataset_root=dataroot)
+    elif dataset == 'waymo':
+        from src.datasets.waymo.waymo_dataset import WaymoDataset
+        return WaymoDataset(dataset_root=dataroot)
+    else:
+        raise Exception(f"Unknown dataset {dataset}")
+
+
+def __load_frame(args) -> np.ndarray:
+    if args.dataset == 'synthetic':
+        # Sweep of a 100m range lidar: points are denser close to the sensor.
+        rng = np.random.default_rng(args.seed)
+        distances = rng.uniform(1, 100, args.points_count) ** 1.5 / 10
+        angles = rng.uniform(-np.pi, np.pi, args.points_count)
+        return np.vstack((distances * np.cos(angles),
+                          distances * np.sin(angles),
+                          rng.uniform(-2, 3, args.points_count),
+                          rng.random(args.points_count))).astype(np.float32)
+
+    dataset = __create_dataset(dataset=args.dataset,
+                               dataroot=args.dataroot,
+                               version=args.version,
+                               split=args.split)
+    scene_id = dataset.scenes[0]
+    frame_id, _ = next(iter(dataset.get_scene_iterator(scene_id=scene_id)))
+    return np.asarray(dataset.get_frame_point_cloud(scene_id=scene_id, frame_id=frame_id))
+
+
+def __create_boxes(frame_point_cloud: np.ndarray,
+                   boxes_count: int,
+                   seed: int) -> list:
+    # Boxes are placed on random points, so every box covers some of the sweep.
+    rng = np.random.default_rng(seed)
+    centers = frame_point_cloud[:3, rng.integers(0, frame_point_cloud.shape[1], boxes_count)].T
+    return [(center_xyz.astype(np.float64), np.array([4.5, 2.0, 1.8]), rng.uniform(-np.pi, np.pi))
+            for center_xyz in centers]
+
+
+def __measure(function, repeats: int) -> float:
+    timings = list()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='box query time of the BEV grid index versus full sweeps')
+    parser.add_argument('--dataset', type=str, choices=['synthetic', 'nuscenes', 'once', 'waymo'],
+                        default='synthetic', help='Dataset to take the first frame from.')
+    parser.add_argument('--version', type=str, default='v1.0-mini', help='NuScenes version.')
+    parser.add_argument("--split", type=str, choices=['train', 'test', 'val', 'raw_small', 'raw_medium', 'raw_large'],
+                        default="train", help="Once dataset split type.")
+    parser.add_argument('--dataroot', type=str, default='./temp/nuscenes', help='Data root location.')
+    parser.add_argument('--points_count', type=int, default=150000, help='Count of points of a synthetic frame.')
+    parser.add_argument('--boxes_counts', type=int, nargs='+', default=[1, 10, 25, 50, 100, 200],
+                        help='Counts of boxes queried per frame.')
+    parser.add_argument('--cell_size', type=float, default=2.0, help='Size of a grid cell in meters.')
+    parser.add_argument('--repeats', type=int, default=5, help='Count of measurements.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of synthetic frames and boxes.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    frame_point_cloud = __load_frame(args)
+    points_xyz = frame_point_cloud[:3, :]
+
+    build_seconds = __measure(lambda: BevGridIndex(points_xyz=points_xyz, cell_size=args.cell_size), args.repeats)
+    grid_index = BevGridIndex(points_xyz=points_xyz, cell_size=args.cell_size)
+    print(f"Frame of {points_xyz.shape[1]} points, index of {grid_index.nbytes / 2 ** 10:.0f} KiB "
+          f"built in {build_seconds * 1e3:.2f}ms")
+
+    for boxes_count in args.boxes_counts:
+        boxes = __create_boxes(frame_point_cloud=frame_point_cloud, boxes_count=boxes_count, seed=args.seed)
+
+        def query_sweeps():
+            for center_xyz, dimensions_lwh, heading_angle in boxes:
+                points_in_box(center_xyz=center_xyz,
+                              dimensions_lwh=dimensions_lwh,
+                              heading_angle=heading_angle,
+                              points=points_xyz)
+
+        def query_grid():
+            for center_xyz, dimensions_lwh, heading_angle in boxes:
+                grid_index.get_points_in_box(points_xyz=points_xyz,
+                                             center_xyz=center_xyz,
+                                             dimensions_lwh=dimensions_lwh,
+                                             rotation=Quaternion(angle=heading_angle, axis=[0, 0, 1]))
+
+        sweeps_seconds = __measure(query_sweeps, args.repeats)
+        grid_seconds = __measure(query_grid, args.repeats)
+
+        print(f"{boxes_count} boxes: full sweeps {sweeps_seconds * 1e3:.2f}ms, "
+              f"grid {grid_seconds * 1e3:.2f}ms ({(grid_seconds + build_seconds) * 1e3:.2f}ms with build), "
+              f"per box {sweeps_seconds / boxes_count * 1e6:.0f}us vs {grid_seconds / boxes_count * 1e6:.0f}us")
+
+
+if __name__ == '__main__':
+    main()
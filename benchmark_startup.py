@@ -0,0 +1,71 @@
+import argparse
+import importlib
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+from src.accumulation.accumulation_strategy_registry import get_accumulation_strategy_names
+
+
+def __measure_help(repeats: int) -> list:
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'patch_scene.py')
+
+    timings = list()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, script_path, '--help'], check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def __no_op_task(strategy: str) -> float:
+    # Spawned workers import patch_scene exactly like pool workers of a real run do.
+    start = time.perf_counter()
+    patch_scene = importlib.import_module('patch_scene')
+    patch_scene.get_accumulation_strategy(strategy)
+    return time.perf_counter() - start
+
+
+def __measure_no_op_run(strategy: str,
+                        num_workers: int,
+                        repeats: int) -> list:
+    context = multiprocessing.get_context('spawn')
+
+    timings = list()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with context.Pool(num_workers) as p:
+            p.map(__no_op_task, [strategy] * num_workers)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def __report(title: str, timings: list):
+    timings = sorted(timings)
+    median = timings[len(timings) // 2]
+    print(f"{title}: median {median:.3f}s, min {timings[0]:.3f}s, max {timings[-1]:.3f}s")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='patch_scene.py startup benchmark')
+    parser.add_argument('--strategy', type=str, default='default', choices=get_accumulation_strategy_names(),
+                        help='Accumulation strategy constructed by workers in the no-op run.')
+    parser.add_argument('--num_workers', type=int, default=4, help='Count of spawned workers in the no-op run.')
+    parser.add_argument('--repeats', type=int, default=5, help='Count of measurements.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    __report('patch_scene.py --help', __measure_help(repeats=args.repeats))
+    __report(f"No-op run with {args.num_workers} spawned workers, strategy '{args.strategy}'",
+             __measure_no_op_run(strategy=args.strategy,
+                                 num_workers=args.num_workers,
+                                 repeats=args.repeats))
+
+
+if __name__ == '__main__':
+    main()
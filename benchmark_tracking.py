@@ -0,0 +1,136 @@
+import argparse
+import time
+
+import numpy as np
+
+from src.tracking.association import ASSOCIATION_MATCHERS
+from src.tracking.online_tracker import OnlineTracker
+
+CATEGORIES = np.array(['Car', 'Truck', 'Bus', 'Pedestrian', 'Cyclist'])
+
+
+def __create_sequence(frames_count: int,
+                      objects_count: int,
+                      lifetime: int,
+                      seed: int) -> list:
+    # Objects drive through the scene and are replaced once their lifetime ends,
+    # so long sequences create many more instances than there are objects in a frame.
+    rng = np.random.default_rng(seed)
+    categories = CATEGORIES[rng.integers(0, len(CATEGORIES), objects_count)]
+    positions = rng.uniform(-60, 60, (objects_count, 3)) * np.array([1, 1, 0])
+    velocities = rng.uniform(-1, 1, (objects_count, 3)) * np.array([1, 1, 0])
+    ages = rng.integers(0, lifetime, objects_count)
+
+    frames = list()
+    for _ in range(frames_count):
+        replaced = ages >= lifetime
+        positions[replaced] = rng.uniform(-60, 60, (np.count_nonzero(replaced), 3)) * np.array([1, 1, 0])
+        categories[replaced] = CATEGORIES[rng.integers(0, len(CATEGORIES), np.count_nonzero(replaced))]
+        ages[replaced] = 0
+
+        positions += velocities
+        ages += 1
+
+        boxes_3d = np.hstack((positions, np.tile([4.5, 2.0, 1.8], (objects_count, 1)), np.zeros((objects_count, 1))))
+        frames.append((categories.copy(), boxes_3d))
+
+    return frames
+
+
+def __track_with_scan(frames: list) -> int:
+    # Matching of track_once.py before the association engine:
+    # every detection is compared with every instance ever created.
+    instances = list()
+    previous_frame_no = 0
+
+    categories, boxes_3d = frames[0]
+    for category, box_3d in zip(categories, boxes_3d):
+        instances.append((category, [0], [box_3d]))
+
+    for frame_no, (next_categories, next_boxes_3d) in enumerate(frames[1:], start=1):
+        for next_category, next_box_3d in zip(next_categories, next_boxes_3d):
+            next_center = [next_box_3d[0], next_box_3d[1], next_box_3d[2]]
+            matched_instance = None
+            min_distance = max(next_box_3d[3:6]) * 2
+
+            for instance in instances:
+                category, frame_nos, instance_boxes_3d = instance
+                if previous_frame_no in frame_nos and category == next_category:
+                    current_box_3d = instance_boxes_3d[-1]
+                    distance = np.linalg.norm(np.array([current_box_3d[0], current_box_3d[1], current_box_3d[2]]) -
+                                              np.array(next_center))
+                    if distance < min_distance:
+                        min_distance = distance
+                        matched_instance = instance
+
+            if matched_instance is not None:
+                matched_instance[1].append(frame_no)
+                matched_instance[2].append(next_box_3d)
+            else:
+                instances.append((next_category, [frame_no], [next_box_3d]))
+
+        previous_frame_no = frame_no
+
+    return len(instances)
+
+
+def __track_online(frames: list,
+                   matcher: str,
+                   max_age: int,
+                   predict_motion: bool) -> OnlineTracker:
+    tracker = OnlineTracker(matcher=matcher, max_age=max_age, predict_motion=predict_motion)
+    for categories, boxes_3d in frames:
+        tracker.update(categories=categories, boxes_3d=boxes_3d)
+    return tracker
+
+
+def __measure(function) -> tuple:
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='association time and throughput of the ONCE tracker on long synthetic sequences')
+    parser.add_argument('--frames_counts', type=int, nargs='+', default=[100, 500, 1000],
+                        help='Lengths of sequences.')
+    parser.add_argument('--objects_count', type=int, default=40, help='Count of objects in a frame.')
+    parser.add_argument('--lifetime', type=int, default=50, help='Count of frames an object stays in the scene.')
+    parser.add_argument('--matchers', type=str, nargs='+', choices=ASSOCIATION_MATCHERS, default=['greedy'],
+                        help='Matchers of the association engine, hungarian requires scipy.')
+    parser.add_argument('--max_age', type=int, default=0,
+                        help='Count of consecutive frames a track can be missed before it is dropped.')
+    parser.add_argument('--predict_motion', action='store_true',
+                        help='Predict tracks with constant velocity before matching.')
+    parser.add_argument('--skip_scan', action='store_true', help='Do not measure the scan over all instances.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the sequences.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    for frames_count in args.frames_counts:
+        frames = __create_sequence(frames_count=frames_count,
+                                   objects_count=args.objects_count,
+                                   lifetime=args.lifetime,
+                                   seed=args.seed)
+
+        timings = list()
+        if not args.skip_scan:
+            tracks_count, seconds = __measure(lambda: __track_with_scan(frames))
+            timings.append(f"scan {seconds * 1e3:.0f}ms ({tracks_count} tracks, "
+                           f"{seconds / frames_count * 1e3:.2f}ms per frame)")
+
+        for matcher in args.matchers:
+            tracker, seconds = __measure(lambda: __track_online(frames, matcher=matcher, max_age=args.max_age,
+                                                                    predict_motion=args.predict_motion))
+            timings.append(f"{matcher} {seconds * 1e3:.0f}ms ({tracker.tracks_count} tracks, "
+                           f"{seconds / frames_count * 1e3:.2f}ms per frame, {tracker.fps:.0f} frames/s, "
+                           f"{tracker.active_tracks_count} active tracks at the end)")
+
+        print(f"{frames_count} frames of {args.objects_count} objects: " + ", ".join(timings))
+
+
+if __name__ == '__main__':
+    main()
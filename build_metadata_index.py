@@ -0,0 +1,64 @@
+import argparse
+import time
+
+from src.datasets.dataset import Dataset
+from src.datasets.metadata_index import build_metadata_index
+
+
+def __create_dataset(dataset: str,
+                     dataroot: str,
+                     version: str,
+                     split: str,
+                     track_once_instances: bool) -> Dataset:
+    if dataset == 'nuscenes':
+        from src.datasets.nuscenes.nuscenes_dataset import NuscenesDataset
+        return NuscenesDataset(version=version, dataroot=dataroot)
+    elif dataset == 'once':
+        from src.datasets.once.once_dataset import OnceDataset
+        return OnceDataset(split=split, dataset_root=dataroot, track_instances=track_once_instances)
+    elif dataset == 'waymo':
+        from src.datasets.waymo.waymo_dataset import WaymoDataset
+        return WaymoDataset(dataset_root=dataroot)
+    else:
+        raise Exception(f"Unknown dataset {dataset}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='builds SQLite index of scenes, frames, instances and boxes')
+    parser.add_argument('--dataset', type=str, choices=['nuscenes', 'once', 'waymo'], default='nuscenes',
+                        help='Dataset.')
+    parser.add_argument('--version', type=str, default='v1.0-mini', help='NuScenes version.')
+    parser.add_argument("--split", type=str, choices=['train', 'test', 'val', 'raw_small', 'raw_medium', 'raw_large'],
+                        default="train", help="Once dataset split type.")
+    parser.add_argument('--dataroot', type=str, default='./temp/nuscenes', help='Data root location.')
+    parser.add_argument('--track_once_instances', action='store_true',
+                        help='Track ONCE instances from the JSON annotations instead of the track_once.py pickles, '
+                             'patch_scene.py should be run with the same flag.')
+    parser.add_argument('--output', type=str, required=True, help='Path of the index, e.g. ./temp/nuscenes.sqlite.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    dataset = __create_dataset(dataset=args.dataset,
+                               dataroot=args.dataroot,
+                               version=args.version,
+                               split=args.split,
+                               track_once_instances=args.track_once_instances)
+
+    metadata = {'dataset': args.dataset, 'version': args.version, 'split': args.split}
+    if args.dataset == 'once':
+        # Instance ids differ between tracking on the fly and the pickles.
+        metadata['track_instances'] = args.track_once_instances
+
+    start = time.perf_counter()
+    build_metadata_index(dataset=dataset,
+                         path=args.output,
+                         metadata=metadata)
+
+    print(f"Indexed {len(dataset.scenes)} scenes in {time.perf_counter() - start:.1f}s to: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import sys
+
+import numpy as np
+from pyquaternion import Quaternion
+
+from src.accumulation.default_accumulator_strategy import DefaultAccumulatorStrategy
+from src.accumulation.point_cloud_accumulator import PointCloudAccumulator
+from src.datasets.dataset import Dataset
+from src.datasets.frame_patcher import assemble_patched_frame
+from src.utils.bev_grid_index import BevGridIndex
+from src.utils.dataset_helper import group_instances_across_frames, list_instances_per_frame
+from src.utils.dtype_policy import POINT_CLOUD_DTYPES, as_point_cloud_dtype
+from src.utils.geometry_utils import extract_box_point_clouds, transform_matrix
+from src.utils.rigid_transform import apply_rigid_transform
+
+
+def __create_dataset(dataset: str,
+                     dataroot: str,
+                     version: str,
+                     split: str,
+                     point_cloud_dtype: np.dtype) -> Dataset:
+    if dataset == 'nuscenes':
+        from src.datasets.nuscenes.nuscenes_dataset import NuscenesDataset
+        return NuscenesDataset(version=version, dataroot=dataroot, point_cloud_dtype=point_cloud_dtype)
+    elif dataset == 'once':
+        from src.datasets.once.once_dataset import OnceDataset
+        return OnceDataset(split=split, dataset_root=dataroot, point_cloud_dtype=point_cloud_dtype)
+    elif dataset == 'waymo':
+        from src.datasets.waymo.waymo_dataset import WaymoDataset
+        return WaymoDataset(dataset_root=dataroot, point_cloud_dtype=point_cloud_dtype)
+    else:
+        raise Exception(f"Unknown dataset {dataset}")
+
+
+def __create_synthetic_scene(frames_count: int,
+                             instances_count: int,
+                             points_count: int,
+                             seed: int) -> tuple:
+    # Instances drive straight through a sweep of a 100m range lidar,
+    # every instance keeps the same points in its box coordinates.
+    rng = np.random.default_rng(seed)
+    instance_points = {f"instance_{i}": np.vstack((rng.uniform(-2.2, 2.2, (1, 500)),
+                                                   rng.uniform(-0.9, 0.9, (1, 500)),
+                                                   rng.uniform(-0.8, 0.8, (1, 500)),
+                                                   rng.random((1, 500))))
+                       for i in range(instances_count)}
+    starts = rng.uniform(-90, 90, (instances_count, 2))
+    headings = rng.uniform(-np.pi, np.pi, instances_count)
+
+    frames = list()
+    for frame_no in range(frames_count):
+        angles = rng.uniform(-np.pi, np.pi, points_count)
+        distances = rng.uniform(1, 100, points_count)
+        point_clouds = [np.vstack((distances * np.cos(angles),
+                                   distances * np.sin(angles),
+                                   rng.uniform(-2, -1.5, points_count),
+                                   rng.random(points_count)))]
+
+        boxes = dict()
+        for i, (instance_id, points) in enumerate(instance_points.items()):
+            center_xyz = np.array([*(starts[i] + frame_no * 0.5 * np.array([np.cos(headings[i]),
+                                                                              np.sin(headings[i])])), 0.0])
+            rotation = Quaternion(angle=headings[i], axis=[0, 0, 1])
+            boxes[instance_id] = (center_xyz, np.array([4.5, 2.0, 1.8]), rotation)
+            point_clouds.append(apply_rigid_transform(point_cloud=np.copy(points),
+                                                      transformation_matrix=transform_matrix(center_xyz, rotation)))
+
+        frames.append((np.concatenate(point_clouds, axis=1), boxes))
+
+    return frames
+
+
+def __patch_synthetic_scene(frames: list,
+                            point_cloud_dtype: np.dtype) -> list:
+    # Same steps as the patching of a scene: extraction, accumulation and insertion back to every frame.
+    frames = [(as_point_cloud_dtype(frame_point_cloud, dtype=point_cloud_dtype), boxes)
+              for frame_point_cloud, boxes in frames]
+
+    accumulation_strategy = DefaultAccumulatorStrategy()
+    accumulated_point_clouds = dict()
+    for frame_point_cloud, boxes in frames:
+        for instance_id, point_cloud in extract_box_point_clouds(frame_point_cloud=frame_point_cloud,
+                                                                 boxes=boxes).items():
+            accumulated_point_cloud = accumulated_point_clouds.get(instance_id, np.zeros((4, 0), point_cloud_dtype))
+            accumulated_point_clouds[instance_id] = accumulation_strategy.on_merge(
+                initial_point_cloud=accumulated_point_cloud,
+                next_point_cloud=point_cloud,
+                frame_no=1)
+
+    patched_frames = list()
+    for frame_point_cloud, boxes in frames:
+        grid_index = BevGridIndex(points_xyz=frame_point_cloud)
+        removal_mask = np.zeros(frame_point_cloud.shape[1], dtype=bool)
+        inserted_point_clouds = list()
+
+        for instance_id, (center_xyz, dimensions_lwh, rotation) in boxes.items():
+            indices, _ = grid_index.get_points_in_box(points_xyz=frame_point_cloud,
+                                                      center_xyz=center_xyz,
+                                                      dimensions_lwh=dimensions_lwh,
+                                                      rotation=rotation)
+            removal_mask[indices] = True
+            inserted_point_clouds.append(
+                apply_rigid_transform(point_cloud=np.copy(accumulated_point_clouds[instance_id]),
+                                      transformation_matrix=transform_matrix(center_xyz, rotation)))
+
+        patched_frame, _ = assemble_patched_frame(frame_point_cloud=frame_point_cloud,
+                                                  origin_indices=np.arange(frame_point_cloud.shape[1]),
+                                                  removal_mask=removal_mask,
+                                                  inserted_point_clouds=inserted_point_clouds)
+        patched_frames.append(patched_frame)
+
+    return patched_frames
+
+
+def __patch_dataset_scene(dataset: Dataset,
+                          frames_count: int) -> list:
+    scene_id = dataset.scenes[0]
+    instances_per_frame = list_instances_per_frame(scene_id=scene_id, dataset=dataset)
+    instances_per_frame = dict(list(instances_per_frame.items())[:frames_count])
+    grouped_instances = group_instances_across_frames(scene_id=scene_id,
+                                                      dataset=dataset,
+                                                      instances_per_frame=instances_per_frame)
+
+    point_cloud_accumulator = PointCloudAccumulator(step=1,
+                                                    grouped_instances=grouped_instances,
+                                                    dataset=dataset,
+                                                    point_cloud_dtype=dataset.point_cloud_dtype)
+    accumulated_point_clouds = {instance_id: point_cloud_accumulator.merge(
+        scene_id=scene_id,
+        instance_id=instance_id,
+        accumulation_strategy=DefaultAccumulatorStrategy()) for instance_id in grouped_instances}
+
+    patched_frames = list()
+    for frame_id, instances in instances_per_frame.items():
+        patcher = dataset.load_frame_patcher(scene_id=scene_id, frame_id=frame_id)
+        patcher.patch_instances({instance_id: np.copy(accumulated_point_clouds[instance_id])
+                                 for instance_id in instances})
+        patched_frames.append(patcher.frame)
+
+    return patched_frames
+
+
+def __compare(reference_frames: list,
+              frames: list) -> tuple:
+    max_error = 0.0
+    mismatched_frames_count = 0
+    for reference_frame, frame in zip(reference_frames, frames):
+        if reference_frame.shape != frame.shape:
+            mismatched_frames_count += 1
+            continue
+
+        if frame.shape[1] > 0:
+            max_error = max(max_error, float(np.abs(frame[:3, :].astype(np.float64) - reference_frame[:3, :]).max()))
+
+    return max_error, mismatched_frames_count
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='precision of patched frames processed in a narrower dtype '
+                                                 'compared with float64')
+    parser.add_argument('--dataset', type=str, choices=['synthetic', 'nuscenes', 'once', 'waymo'],
+                        default='synthetic', help='Dataset to patch the first scene of.')
+    parser.add_argument('--version', type=str, default='v1.0-mini', help='NuScenes version.')
+    parser.add_argument("--split", type=str, choices=['train', 'test', 'val', 'raw_small', 'raw_medium', 'raw_large'],
+                        default="train", help="Once dataset split type.")
+    parser.add_argument('--dataroot', type=str, default='./temp/nuscenes', help='Data root location.')
+    parser.add_argument('--point_cloud_dtype', type=str, choices=list(POINT_CLOUD_DTYPES), default='float32',
+                        help='Dtype to check against float64.')
+    parser.add_argument('--frames_count', type=int, default=20, help='Count of patched frames.')
+    parser.add_argument('--instances_count', type=int, default=20, help='Count of instances of a synthetic scene.')
+    parser.add_argument('--points_count', type=int, default=100000, help='Count of points of a synthetic frame.')
+    parser.add_argument('--tolerance', type=float, default=1e-3, help='Max coordinate error in meters.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic scene.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    point_cloud_dtype = POINT_CLOUD_DTYPES[args.point_cloud_dtype]
+
+    if args.dataset == 'synthetic':
+        frames = __create_synthetic_scene(frames_count=args.frames_count,
+                                          instances_count=args.instances_count,
+                                          points_count=args.points_count,
+                                          seed=args.seed)
+        reference_frames = __patch_synthetic_scene(frames=frames, point_cloud_dtype=np.dtype(np.float64))
+        patched_frames = __patch_synthetic_scene(frames=frames, point_cloud_dtype=point_cloud_dtype)
+    else:
+        reference_frames, patched_frames = [
+            __patch_dataset_scene(dataset=__create_dataset(dataset=args.dataset,
+                                                           dataroot=args.dataroot,
+                                                           version=args.version,
+                                                           split=args.split,
+                                                           point_cloud_dtype=dtype),
+                                  frames_count=args.frames_count)
+            for dtype in [np.dtype(np.float64), point_cloud_dtype]]
+
+    max_error, mismatched_frames_count = __compare(reference_frames=reference_frames, frames=patched_frames)
+
+    print(f"{len(patched_frames)} patched frames in {args.point_cloud_dtype}: "
+          f"max coordinate error {max_error * 1000:.4f}mm, "
+          f"{patched_frames[0].nbytes / 2 ** 20:.1f} MiB vs {reference_frames[0].nbytes / 2 ** 20:.1f} MiB "
+          f"per frame in float64, {mismatched_frames_count} frames with different points")
+
+    if max_error > args.tolerance or mismatched_frames_count > 0:
+        print(f"Precision check failed, tolerance is {args.tolerance * 1000:.2f}mm")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,21 @@
+import argparse
+import multiprocessing
 import os
-import sys
+from functools import partial
 from typing import Optional
 
 import numpy as np
 import open3d as o3d
 from pyquaternion import Quaternion
 
+from src.utils.offscreen_renderer import OffscreenRenderer
+
 
 def __generate_screenshots(points: np.ndarray,
                            bboxes: list = [],
                            camera_position: Optional[str] = None,
                            point_size: float = 2,
-                           screenshot_file_name: str = 'Awesome visualisation'):
+                           image_path: str = './Awesome visualisation.jpg'):
     n = points.shape[0]
 
     vector3d = o3d.utility.Vector3dVector(points[:, 0:3])
@@ -48,55 +52,97 @@ def __generate_screenshots(points: np.ndarray,
     vis.poll_events()
     vis.update_renderer()
 
-    image_path = f"./{screenshot_file_name}.jpg"
     vis.capture_screen_image(image_path)
     print(f"Screenshot is saved to: {image_path}")
     vis.destroy_window()
 
 
-def __get_bboxes(frame_id: str,
-                 scene_descriptor: list[dict],
-                 score_filtering: Optional = 0.17,
-                 mode: str = 'nuscenes'):
+def __index_bboxes(scene_descriptor: list,
+                   score_filtering: Optional[float] = 0.17,
+                   mode: str = 'nuscenes') -> dict:
+    # Boxes of every frame are looked up in O(1) instead of scanning the descriptor per frame.
+    bboxes_lookup = dict()
     for frame_descriptor in scene_descriptor:
-        if frame_descriptor['frame_id'] != frame_id:
-            continue
-
         if mode.lower() == 'nuscenes':
             bboxes = frame_descriptor['boxes_lidar']
         else:
             raise Exception(f"Unknown mode {mode}")
 
         if score_filtering is not None:
-            score_mask = frame_descriptor['score'] > score_filtering
-            return bboxes[score_mask]
-        else:
-            return bboxes
+            bboxes = bboxes[frame_descriptor['score'] > score_filtering]
+
+        bboxes_lookup.setdefault(frame_descriptor['frame_id'], bboxes)
+    return bboxes_lookup
+
+
+def __load_frame(path: str) -> np.ndarray:
+    lidar_point_clouds = np.fromfile(path, dtype=np.float32)
+    return lidar_point_clouds.reshape((-1, 5))[:, :4]
+
+
+def __render_frames(frames: list,
+                    camera_position: Optional[str],
+                    point_size: float):
+    # A single window renders the whole chunk of the sequence.
+    with OffscreenRenderer(camera_position=camera_position, point_size=point_size) as renderer:
+        for frame_path, bboxes, image_path in frames:
+            renderer.render(points=__load_frame(frame_path),
+                            boxes_3d=bboxes,
+                            image_path=image_path)
+            print(f"Screenshot is saved to: {image_path}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='screenshots of every frame of a sequence')
+    parser.add_argument('scene', type=str, help='Folder with .bin frames of the sequence.')
+    parser.add_argument('gt_path', type=str, help='Descriptor of the sequence with boxes of every frame.')
+    parser.add_argument('camera_position', type=str, help='Camera position obtained by pressing P in o3d window.')
+    parser.add_argument('--output_dir', type=str, default='.', help='Folder to save screenshots to.')
+    parser.add_argument('--point_size', type=float, default=2.5, help='Size of a single point.')
+    parser.add_argument('--batch', action='store_true',
+                        help='Render the sequence with one offscreen window per worker instead of a window per frame.')
+    parser.add_argument('--num_workers', type=int, default=1,
+                        help='Count of renderer processes the sequence is split across in batch mode.')
+    return parser.parse_args()
 
 
 def main():
-    scene = sys.argv[1]
-    gt_path = sys.argv[2]
-    camera_position = sys.argv[3]
-    scene_descriptor = np.load(gt_path, allow_pickle=True)
+    args = parse_arguments()
+    scene_descriptor = np.load(args.gt_path, allow_pickle=True)
+    bboxes_lookup = __index_bboxes(scene_descriptor=scene_descriptor)
 
-    for frame in sorted(os.listdir(scene)):
+    frames = list()
+    for frame in sorted(os.listdir(args.scene)):
         if not frame.endswith(".bin"):
             continue
 
         frame_id = os.path.basename(frame).replace(".bin", "")
-        print("Processing frame:", frame_id)
-
-        gt_boxes = __get_bboxes(frame_id=frame_id,
-                                scene_descriptor=scene_descriptor)
-
-        lidar_point_clouds = np.fromfile(os.path.join(scene, frame), dtype=np.float32)
-        lidar_point_clouds = lidar_point_clouds.reshape((-1, 5))[:, :4]
-        __generate_screenshots(points=lidar_point_clouds,
-                               bboxes=gt_boxes,
-                               camera_position=camera_position,
-                               point_size=2.5,
-                               screenshot_file_name=frame_id)
+        frames.append((os.path.join(args.scene, frame),
+                       bboxes_lookup.get(frame_id, np.zeros((0, 7))),
+                       os.path.join(args.output_dir, f"{frame_id}.jpg")))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    if not args.batch:
+        for frame_path, bboxes, image_path in frames:
+            print("Processing frame:", frame_path)
+            __generate_screenshots(points=__load_frame(frame_path),
+                                   bboxes=bboxes,
+                                   camera_position=args.camera_position,
+                                   point_size=args.point_size,
+                                   image_path=image_path)
+        return
+
+    # Every worker renders a contiguous chunk of the sequence with its own window.
+    chunks = [chunk for chunk in np.array_split(np.arange(len(frames)), max(args.num_workers, 1)) if len(chunk) > 0]
+    render_chunk = partial(__render_frames, camera_position=args.camera_position, point_size=args.point_size)
+
+    if len(chunks) <= 1:
+        render_chunk(frames)
+        return
+
+    with multiprocessing.Pool(len(chunks)) as p:
+        p.map(render_chunk, [[frames[i] for i in chunk] for chunk in chunks])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,54 @@
+import argparse
+import glob
+import json
+import os
+import sys
+
+from src.utils.sharding import merge_shard_summaries
+
+
+def __load_summaries(paths: list) -> list:
+    summary_files = list()
+    for path in paths:
+        if os.path.isdir(path):
+            summary_files.extend(sorted(glob.glob(os.path.join(path, 'shard_*.json'))))
+        else:
+            summary_files.append(path)
+
+    summaries = list()
+    for summary_file in summary_files:
+        with open(summary_file, 'r') as file:
+            summaries.append(json.load(file))
+    return summaries
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='merge and verify shard summaries')
+    parser.add_argument('summaries', type=str, nargs='+',
+                        help='Shard summary files or directories with them.')
+    parser.add_argument('--output', type=str, default=None, help='Path to save the merged summary.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    summaries = __load_summaries(args.summaries)
+
+    try:
+        merged_summary = merge_shard_summaries(summaries)
+    except ValueError as e:
+        print(f"Verification failed: {e}")
+        sys.exit(1)
+
+    print(f"Verified {merged_summary['num_shards']} shards: {merged_summary['scenes_count']} scenes, "
+          f"{merged_summary['frames_count']} frames, every frame is written by exactly one shard.")
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(merged_summary, file, indent=2)
+        print(f"Merged summary is saved to: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import multiprocessing
+from functools import partial
+
+from tqdm import tqdm
+
+from src.datasets.dataset import Dataset
+from src.utils.packed_archive import PackedArchiveCollection
+
+
+def __create_dataset(dataset: str,
+                     dataroot: str,
+                     version: str,
+                     split: str) -> Dataset:
+    if dataset == 'nuscenes':
+        from src.datasets.nuscenes.nuscenes_dataset import NuscenesDataset
+        return NuscenesDataset(version=version, dataroot=dataroot)
+    elif dataset == 'once':
+        from src.datasets.once.once_dataset import OnceDataset
+        return OnceDataset(split=split, dataset_root=dataroot)
+    elif dataset == 'waymo':
+        from src.datasets.waymo.waymo_dataset import WaymoDataset
+        return WaymoDataset(dataset_root=dataroot)
+    else:
+        raise Exception(f"Unknown dataset {dataset}")
+
+
+def __pack_scene(scene_id: str,
+                 dataset: Dataset,
+                 output_root: str,
+                 force_overwrite: bool) -> int:
+    archives = PackedArchiveCollection(output_root)
+
+    packed_frames_count = 0
+    try:
+        for frame_id, _ in dataset.get_scene_iterator(scene_id=scene_id):
+            if not force_overwrite and archives.has_frame(scene_id=scene_id, frame_id=frame_id):
+                continue
+
+            frame_point_cloud = dataset.get_frame_point_cloud(scene_id=scene_id, frame_id=frame_id)
+            archives.append_frame(scene_id=scene_id, frame_id=frame_id, point_cloud=frame_point_cloud)
+            packed_frames_count += 1
+    finally:
+        # The index is saved once per scene.
+        archives.close()
+
+    return packed_frames_count
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='packs frames of every scene into a single archive')
+    parser.add_argument('--dataset', type=str, choices=['nuscenes', 'once', 'waymo'], default='nuscenes',
+                        help='Dataset.')
+    parser.add_argument('--version', type=str, default='v1.0-mini', help='NuScenes version.')
+    parser.add_argument("--split", type=str, choices=['train', 'test', 'val', 'raw_small', 'raw_medium', 'raw_large'],
+                        default="train", help="Once dataset split type.")
+    parser.add_argument('--dataroot', type=str, default='./temp/nuscenes', help='Data root location.')
+    parser.add_argument('--output_root', type=str, required=True, help='Folder to save scene archives to.')
+    parser.add_argument('--num_workers', type=int, default=multiprocessing.cpu_count(),
+                        help='Count of parallel workers.')
+    parser.add_argument('--force_overwrite', action='store_true', help='Repack frames that are already packed.')
+    return parser.parse_args()
+
+
+def main():
+    multiprocessing.set_start_method('spawn', force=True)
+    args = parse_arguments()
+
+    dataset = __create_dataset(dataset=args.dataset,
+                               dataroot=args.dataroot,
+                               version=args.version,
+                               split=args.split)
+
+    pack_scene = partial(
+        __pack_scene,
+        dataset=dataset,
+        output_root=args.output_root,
+        force_overwrite=args.force_overwrite
+    )
+
+    scenes = dataset.scenes
+    with multiprocessing.Pool(args.num_workers) as p:
+        packed_frames_count = sum(tqdm(p.imap_unordered(pack_scene, scenes), total=len(scenes)))
+
+    print(f"Packed {packed_frames_count} frames of {len(scenes)} scenes to: {args.output_root}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,141 +3,230 @@ import logging
 import multiprocessing
 import os
 import sys
-import time
 from functools import partial
 from logging.handlers import QueueHandler, QueueListener
 from multiprocessing import Manager, Pool
+from typing import Optional
 
 import numpy as np
-import torch
 from tqdm import tqdm
 
+# Heavy modules (torch, open3d, GeDi, dataset devkits) are imported on first use:
+# every spawned worker imports this module again.
 sys.path.append(os.path.join(os.path.dirname(__file__), './gedi'))
 from src.accumulation.accumulation_strategy import AccumulationStrategy
-from src.accumulation.default_accumulator_strategy import DefaultAccumulatorStrategy
-from src.accumulation.gedi_accumulator_strategy import GediAccumulatorStrategy
-from src.accumulation.greedy_grid_accumulator_strategy import GreedyGridAccumulatorStrategy
+from src.accumulation.accumulation_strategy_registry import get_accumulation_strategy, \
+    get_accumulation_strategy_names
 from src.accumulation.point_cloud_accumulator import PointCloudAccumulator
+from src.accumulation.spillable_cloud_store import SpillableCloudStore
 
+from src.datasets.compact_frame import CompactFrameFormat
 from src.datasets.dataset import Dataset
-from src.datasets.nuscenes.nuscenes_dataset import NuscenesDataset
-from src.datasets.once.once_dataset import OnceDataset
-from src.datasets.waymo.waymo_dataset import WaymoDataset
-from src.utils.dataset_helper import group_instances_across_frames, can_skip_frame, can_skip_scene
+from src.utils.dataset_helper import group_instances_across_frames, list_instances_per_frame, can_skip_scene, \
+    get_skippable_frame_ids
+from src.utils.dtype_policy import POINT_CLOUD_DTYPES, get_point_cloud_dtype
+from src.utils.frame_grid_cache import FrameGridCache
+from src.utils.frame_prefetcher import FramePrefetcher
 from src.utils.logging_utils import create_root_handler
+from src.utils.memory_budget import MemoryBudget, SceneMemoryReporter
+from src.utils.sharding import shard_scenes_by_hash, shard_scenes_by_cost, create_shard_summary, \
+    get_shard_summary_path, write_shard_summary
+from src.utils.resource_slots import ResourceSlots, CUDA_DEVICE_POOL, CPU_MEMORY_POOL, create_device_tokens
 
 
 def __patch_scene(scene_id: str,
-                  accumulation_strategy: AccumulationStrategy,
+                  accumulation_strategy_name: str,
                   dataset: Dataset,
                   force_overwrite: bool,
-                  gedi_counter):
-    # O(frames)
+                  resource_slots: ResourceSlots,
+                  memory_budget: MemoryBudget,
+                  spill_threshold_bytes: Optional[int],
+                  scratch_dir: Optional[str],
+                  prefetch_frames: int,
+                  grid_cache_frames: Optional[int],
+                  grid_cell_size: float) -> tuple:
+    # O(frames * instances)
+    instances_per_frame = list_instances_per_frame(scene_id=scene_id, dataset=dataset)
+    # Only frames with instances are patched, they are reported back for the shard summary.
+    expected_frame_ids = [frame_id for frame_id, instances in instances_per_frame.items() if len(instances) > 0]
+
+    # O(frames) with a single listing of the output folder.
+    skippable_frame_ids = get_skippable_frame_ids(dataset=dataset,
+                                                  scene_id=scene_id,
+                                                  force_overwrite=force_overwrite)
+
     if can_skip_scene(dataset=dataset,
                       scene_id=scene_id,
-                      force_overwrite=force_overwrite):
+                      force_overwrite=force_overwrite,
+                      skippable_frame_ids=skippable_frame_ids):
         logging.info(f"[Scene {scene_id}] Skipping scene.")
-        return True
-
-    if isinstance(accumulation_strategy, GediAccumulatorStrategy):
-        gpu_id = -1
-        while gpu_id == -1:
-            for i in range(torch.cuda.device_count()):
-                if gedi_counter[i] < 4:
-                    gpu_id = i
-                    gedi_counter[i] += 1
-                    break
-            if gpu_id == -1:
-                time.sleep(1)  # wait for a GPU to be available
-
-        torch.cuda.set_device(gpu_id)
-        logging.info(f"Running GediAccumulatorStrategy on GPU {gpu_id}")
-
+        return scene_id, expected_frame_ids
+
+    accumulation_strategy = get_accumulation_strategy(accumulation_strategy_name)
+
+    # Blocks until the scene fits into the memory budget
+    # and the slots declared by the strategy are released by other workers.
+    with memory_budget.admit(scene_id) as memory_reporter, \
+            resource_slots.acquire(accumulation_strategy.resource_requirements) as resources:
+        accumulation_strategy.on_resources_acquired(resources)
+        try:
+            __patch_scene_frames(scene_id=scene_id,
+                                 accumulation_strategy=accumulation_strategy,
+                                 dataset=dataset,
+                                 instances_per_frame=instances_per_frame,
+                                 skippable_frame_ids=skippable_frame_ids,
+                                 memory_reporter=memory_reporter,
+                                 spill_threshold_bytes=spill_threshold_bytes,
+                                 scratch_dir=scratch_dir,
+                                 prefetch_frames=prefetch_frames,
+                                 grid_cache_frames=grid_cache_frames,
+                                 grid_cell_size=grid_cell_size)
+        finally:
+            # Frames written before a failure are kept as well.
+            dataset.flush_serialised_frames(scene_id=scene_id)
+
+    logging.info(f"[Scene {scene_id}] Peak accumulated memory is {memory_reporter.peak_bytes / 2 ** 20:.1f}MiB.")
+
+    # Return frames expected to be patched when finished processing.
+    return scene_id, expected_frame_ids
+
+
+def __patch_scene_frames(scene_id: str,
+                         accumulation_strategy: AccumulationStrategy,
+                         dataset: Dataset,
+                         instances_per_frame: dict,
+                         skippable_frame_ids: set,
+                         memory_reporter: SceneMemoryReporter,
+                         spill_threshold_bytes: Optional[int],
+                         scratch_dir: Optional[str],
+                         prefetch_frames: int,
+                         grid_cache_frames: Optional[int],
+                         grid_cell_size: float):
     logging.info(f"[Scene {scene_id}] Starting...")
 
-    # O(frames * instances)
-    grouped_instances = group_instances_across_frames(scene_id=scene_id, dataset=dataset)
-
-    point_cloud_accumulator = PointCloudAccumulator(step=1,
-                                                    grouped_instances=grouped_instances,
-                                                    dataset=dataset)
-
-    instance_accumulated_clouds_lookup = dict()
-
-    current_instance_index = 0
-    overall_instances_to_process_count = len(grouped_instances)
-
-    # O(instances * frames * N * d)
-    for instance in grouped_instances.keys():
-        logging.info(f"[Scene {scene_id}] Merging {instance}")
-
-        assert instance not in instance_accumulated_clouds_lookup
-
-        # O(frames * N * d)
-        accumulated_point_cloud = point_cloud_accumulator.merge(scene_id=scene_id,
-                                                                instance_id=instance,
-                                                                accumulation_strategy=accumulation_strategy)
-
-        instance_accumulated_clouds_lookup[instance] = accumulated_point_cloud
-
-        current_instance_index += 1
-        logging.info(
-            f"[Scene {scene_id}] Merged {int((current_instance_index / overall_instances_to_process_count) * 100)}% "
-            f"of instances.")
+    grouped_instances = group_instances_across_frames(scene_id=scene_id,
+                                                      dataset=dataset,
+                                                      instances_per_frame=instances_per_frame)
 
     frames_to_instances_lookup: dict = dict()
     # O(instances * frames)
-    for instance, frames in grouped_instances.items():
-        for frame_id in frames:
-            if can_skip_frame(dataset=dataset,
-                              scene_id=scene_id,
-                              frame_id=frame_id,
-                              force_overwrite=force_overwrite):
-                logging.warning(f"[Scene {scene_id}] Skipping frame {frame_id}...")
-                continue
-
-            if frame_id not in frames_to_instances_lookup:
-                frames_to_instances_lookup[frame_id] = set()
-            frames_to_instances_lookup[frame_id].add(instance)
-
-    current_frame_index = 0
-    overall_frames_to_patch_count = len(frames_to_instances_lookup)
-    logging.info(f"[Scene {scene_id}] Found {overall_frames_to_patch_count} frames to patch.")
-
-    # O(instances * frames)
-    for frame_id, instances in frames_to_instances_lookup.items():
-        logging.info(f"[Scene {scene_id}] Patching frame {frame_id}...")
+    for frame_id, instances in instances_per_frame.items():
+        if len(instances) == 0:
+            continue
 
-        patcher = dataset.load_frame_patcher(scene_id=scene_id,
-                                             frame_id=frame_id)
+        if frame_id in skippable_frame_ids:
+            logging.warning(f"[Scene {scene_id}] Skipping frame {frame_id}...")
+            continue
 
-        for instance in instances:
-            # Make sure you copy instance_accumulated_clouds_lookup[instance]
-            # to do not carry the rotation and translation in between frames.
-            patcher.patch_instance(instance_id=instance,
-                                   point_cloud=np.copy(instance_accumulated_clouds_lookup[instance]))
+        frames_to_instances_lookup[frame_id] = set(instances)
 
-        saved_path = dataset.serialise_frame_point_clouds(scene_id=scene_id,
-                                                          frame_id=frame_id,
-                                                          frame_point_cloud=patcher.frame)
+    # Patching goes in frame order, so the store knows when every instance is needed next.
+    access_schedule = [instance for instances in frames_to_instances_lookup.values() for instance in instances]
+    instances_to_merge = list(dict.fromkeys(access_schedule))
 
-        current_frame_index += 1
+    # Grid indices of frames are shared by accumulation and patching of the scene,
+    # the cache holds every frame with instances unless it is capped.
+    frames_with_instances_count = sum(1 for instances in instances_per_frame.values() if len(instances) > 0)
+    grid_cache_capacity = frames_with_instances_count if grid_cache_frames is None \
+        else min(grid_cache_frames, frames_with_instances_count)
+    grid_cache = FrameGridCache(capacity=grid_cache_capacity, cell_size=grid_cell_size) \
+        if grid_cache_capacity > 0 else None
 
-        if saved_path is not None:
-            logging.info(f"[Scene {scene_id}] {int((current_frame_index / overall_frames_to_patch_count) * 100)}%, "
-                         f"saved to {saved_path}")
-        else:
-            logging.error(f"[Scene {scene_id}] There was an error saving the point cloud for frame {frame_id}")
+    # Frames of skipped instances are not extracted, see PointCloudAccumulator.
+    point_cloud_accumulator = PointCloudAccumulator(step=1,
+                                                    grouped_instances={instance: grouped_instances[instance]
+                                                                       for instance in instances_to_merge},
+                                                    dataset=dataset,
+                                                    prefetch_frames=prefetch_frames,
+                                                    grid_cache=grid_cache,
+                                                    point_cloud_dtype=dataset.point_cloud_dtype)
+
+    with SpillableCloudStore(access_schedule=access_schedule,
+                             memory_threshold_bytes=spill_threshold_bytes,
+                             scratch_root=scratch_dir,
+                             prefix=f"scene_{scene_id}_") as instance_accumulated_clouds_store:
+        current_instance_index = 0
+        overall_instances_to_process_count = len(instances_to_merge)
+
+        # O(instances * frames * N * d)
+        for instance in instances_to_merge:
+            logging.info(f"[Scene {scene_id}] Merging {instance}")
+
+            # Clouds extracted ahead for other instances cannot be spilled,
+            # so they take only what the store leaves of the spill threshold.
+            max_extracted_bytes = None
+            if spill_threshold_bytes is not None:
+                max_extracted_bytes = max(0, spill_threshold_bytes - instance_accumulated_clouds_store.in_memory_bytes)
+
+            # O(frames * N * d)
+            accumulated_point_cloud = point_cloud_accumulator.merge(scene_id=scene_id,
+                                                                    instance_id=instance,
+                                                                    accumulation_strategy=accumulation_strategy,
+                                                                    max_extracted_bytes=max_extracted_bytes)
+
+            instance_accumulated_clouds_store.put(instance, accumulated_point_cloud)
+            memory_reporter.report(instance_accumulated_clouds_store.in_memory_bytes +
+                                   point_cloud_accumulator.extracted_bytes +
+                                   (grid_cache.nbytes if grid_cache is not None else 0))
+
+            current_instance_index += 1
+            logging.info(
+                f"[Scene {scene_id}] Merged {int((current_instance_index / overall_instances_to_process_count) * 100)}% "
+                f"of instances.")
+
+        if instance_accumulated_clouds_store.spilled_count > 0:
+            logging.info(f"[Scene {scene_id}] Spilled {instance_accumulated_clouds_store.spilled_count} "
+                         f"accumulated clouds to disk.")
+
+        current_frame_index = 0
+        overall_frames_to_patch_count = len(frames_to_instances_lookup)
+        logging.info(f"[Scene {scene_id}] Found {overall_frames_to_patch_count} frames to patch.")
+
+        frames_prefetcher = FramePrefetcher(dataset=dataset,
+                                            frames=[(scene_id, frame_id) for frame_id in frames_to_instances_lookup],
+                                            lookahead=prefetch_frames)
+
+        # O(instances * frames)
+        for _, frame_id, frame_point_cloud in frames_prefetcher:
+            instances = frames_to_instances_lookup[frame_id]
+            logging.info(f"[Scene {scene_id}] Patching frame {frame_id}...")
+
+            grid_index = None
+            if grid_cache is not None:
+                grid_index = grid_cache.get_grid_index(scene_id=scene_id,
+                                                       frame_id=frame_id,
+                                                       frame_point_cloud=frame_point_cloud)
+
+            patcher = dataset.load_frame_patcher(scene_id=scene_id,
+                                                 frame_id=frame_id,
+                                                 frame_point_cloud=frame_point_cloud,
+                                                 grid_index=grid_index)
+
+            # Make sure you copy the accumulated clouds to do not carry
+            # the rotation and translation in between frames.
+            # All instances are patched at once, so the frame is assembled a single time.
+            patcher.patch_instances({instance: np.copy(instance_accumulated_clouds_store.get(instance))
+                                     for instance in instances})
+
+            # The frame is not searched again.
+            if grid_cache is not None:
+                grid_cache.discard(scene_id=scene_id, frame_id=frame_id)
+
+            saved_path = dataset.serialise_frame_point_clouds(scene_id=scene_id,
+                                                              frame_id=frame_id,
+                                                              frame_point_cloud=patcher.frame,
+                                                              frame_delta=patcher.delta)
+
+            current_frame_index += 1
+
+            if saved_path is not None:
+                logging.info(f"[Scene {scene_id}] {int((current_frame_index / overall_frames_to_patch_count) * 100)}%, "
+                             f"saved to {saved_path}")
+            else:
+                logging.error(f"[Scene {scene_id}] There was an error saving the point cloud for frame {frame_id}")
 
     logging.info(f"[Scene {scene_id}] Wrapping up.")
 
-    # If the strategy is GediAccumulatorStrategy, decrease the counter
-    if isinstance(accumulation_strategy, GediAccumulatorStrategy):
-        gedi_counter[gpu_id] -= 1
-
-    # Return OK status when finished processing.
-    return True
-
 
 def __on_process_init(log_queue,
                       enable_logging: bool):
@@ -149,15 +238,29 @@ def __on_process_init(log_queue,
 
 
 def __process_dataset(dataset: Dataset,
-                      accumulation_strategy: AccumulationStrategy,
+                      scenes: list,
+                      accumulation_strategy_name: str,
                       num_workers: int,
                       force_overwrite: bool,
-                      enable_logging: bool):
+                      enable_logging: bool,
+                      gpu_slots_per_device: int,
+                      memory_slots: int,
+                      memory_budget_bytes: Optional[int],
+                      default_scene_peak_bytes: Optional[int],
+                      spill_threshold_bytes: Optional[int],
+                      scratch_dir: Optional[str],
+                      prefetch_frames: int,
+                      grid_cache_frames: Optional[int],
+                      grid_cell_size: float) -> dict:
+    """Patches the scenes in a pool of workers.
+
+    Returns pairs of scene id to the ids of frames expected to be patched,
+    listed by the workers along with the patching.
+    """
     assert num_workers > 0, "num_workers should be positive"
 
-    print(f"Processing dataset from: {dataset.dataroot}")
+    print(f"Processing {len(scenes)} scenes of dataset from: {dataset.dataroot}")
 
-    scenes = dataset.scenes
     scenes_count = len(scenes)
 
     with Manager() as manager:
@@ -165,30 +268,131 @@ def __process_dataset(dataset: Dataset,
         queue_listener = QueueListener(log_queue, create_root_handler())
         queue_listener.start()
 
-        gedi_counter = manager.dict()
-        for i in range(torch.cuda.device_count()):
-            gedi_counter[i] = 0
+        resource_slots = ResourceSlots(manager=manager, pools={
+            CUDA_DEVICE_POOL: create_device_tokens(devices_count=__count_cuda_devices(accumulation_strategy_name),
+                                                   slots_per_device=gpu_slots_per_device),
+            CPU_MEMORY_POOL: list(range(memory_slots)),
+        })
+        memory_budget = MemoryBudget(manager=manager,
+                                     budget_bytes=memory_budget_bytes,
+                                     default_peak_bytes=default_scene_peak_bytes)
 
         patch_scene = partial(
             __patch_scene,
-            accumulation_strategy=accumulation_strategy,
+            accumulation_strategy_name=accumulation_strategy_name,
             dataset=dataset,
             force_overwrite=force_overwrite,
-            gedi_counter=gedi_counter
+            resource_slots=resource_slots,
+            memory_budget=memory_budget,
+            spill_threshold_bytes=spill_threshold_bytes,
+            scratch_dir=scratch_dir,
+            prefetch_frames=prefetch_frames,
+            grid_cache_frames=grid_cache_frames,
+            grid_cell_size=grid_cell_size
         )
 
         with Pool(num_workers, __on_process_init, [log_queue, enable_logging]) as p:
-            list(tqdm(p.imap_unordered(patch_scene, scenes), total=scenes_count))
+            expected_frames_per_scene = dict(tqdm(p.imap_unordered(patch_scene, scenes), total=scenes_count))
 
         # Close the queue and the handler_process.
         queue_listener.stop()
 
+    # Scenes finish in any order, the summary lists them in order of the shard.
+    return {scene_id: expected_frames_per_scene[scene_id] for scene_id in scenes}
+
+
+def __select_shard_scenes(dataset: Dataset,
+                          shard_index: int,
+                          num_shards: int,
+                          sharding_strategy: str) -> list:
+    if sharding_strategy == 'hash':
+        return shard_scenes_by_hash(scene_ids=dataset.scenes,
+                                    shard_index=shard_index,
+                                    num_shards=num_shards)
+    elif sharding_strategy == 'cost':
+        # Count of frames is a good enough proxy of the processing time of a scene,
+        # it is resolved without loading instances of the frames on every node.
+        scene_costs = {scene_id: dataset.get_frames_count(scene_id=scene_id)
+                       for scene_id in dataset.scenes}
+        return shard_scenes_by_cost(scene_costs=scene_costs,
+                                    shard_index=shard_index,
+                                    num_shards=num_shards)
+    else:
+        raise Exception(f"Unknown sharding strategy {sharding_strategy}")
+
+
+def __write_shard_summary(dataset: Dataset,
+                          dataset_name: str,
+                          scenes: list,
+                          expected_frames_per_scene: dict,
+                          shard_index: int,
+                          num_shards: int,
+                          sharding_strategy: str,
+                          summary_dir: str):
+    # Expected frames are listed by the workers, the output is listed after processing
+    # to record the frames that were actually written.
+    serialised_frames_per_scene = {scene_id: dataset.get_serialised_frame_ids(scene_id=scene_id)
+                                   for scene_id in scenes}
+
+    summary = create_shard_summary(dataset_name=dataset_name,
+                                   all_scene_ids=dataset.scenes,
+                                   shard_index=shard_index,
+                                   num_shards=num_shards,
+                                   sharding_strategy=sharding_strategy,
+                                   expected_frames_per_scene=expected_frames_per_scene,
+                                   serialised_frames_per_scene=serialised_frames_per_scene)
+
+    summary_path = get_shard_summary_path(summary_dir=summary_dir,
+                                          shard_index=shard_index,
+                                          num_shards=num_shards)
+    write_shard_summary(path=summary_path, summary=summary)
+    print(f"Shard summary is saved to: {summary_path}")
+
+
+def __count_cuda_devices(accumulation_strategy_name: str) -> int:
+    # Strategies are cheap to construct, torch is imported only if the strategy needs GPUs.
+    requirements = get_accumulation_strategy(accumulation_strategy_name).resource_requirements
+    if CUDA_DEVICE_POOL not in requirements:
+        return 0
+
+    import torch
+    return torch.cuda.device_count()
+
+
+def __create_dataset(args) -> Dataset:
+    dataset_type = args.dataset
+
+    compact_output = None
+    if args.compact_output_step is not None:
+        compact_output = CompactFrameFormat(quantisation_step=args.compact_output_step,
+                                            compress=args.compress_output)
+
+    common_kwargs = dict(use_mmap=args.mmap_frames,
+                         packed_root=args.packed_root,
+                         packed_output_root=args.packed_output_root,
+                         delta_output=args.delta_output,
+                         compact_output=compact_output,
+                         point_cloud_dtype=get_point_cloud_dtype(args.point_cloud_dtype))
+
+    if dataset_type == 'nuscenes':
+        from src.datasets.nuscenes.nuscenes_dataset import NuscenesDataset, IndexedNuscenesDataset
+        dataset_class, indexed_dataset_class = NuscenesDataset, IndexedNuscenesDataset
+        dataset_kwargs = dict(version=args.version, dataroot=args.dataroot, snapshot_path=args.nuscenes_snapshot)
+    elif dataset_type == 'once':
+        from src.datasets.once.once_dataset import OnceDataset, IndexedOnceDataset
+        dataset_class, indexed_dataset_class = OnceDataset, IndexedOnceDataset
+        dataset_kwargs = dict(split=args.split, dataset_root=args.dataroot, track_instances=args.track_once_instances)
+    elif dataset_type == 'waymo':
+        from src.datasets.waymo.waymo_dataset import WaymoDataset, IndexedWaymoDataset
+        dataset_class, indexed_dataset_class = WaymoDataset, IndexedWaymoDataset
+        dataset_kwargs = dict(dataset_root=args.dataroot)
+    else:
+        raise Exception(f"Unknown dataset {dataset_type}")
 
-accumulator_strategies = {
-    'default': DefaultAccumulatorStrategy(),
-    'gedi': GediAccumulatorStrategy(),
-    'greedy_grid': GreedyGridAccumulatorStrategy(),
-}
+    if args.metadata_index is not None:
+        return indexed_dataset_class(metadata_index_path=args.metadata_index, **dataset_kwargs, **common_kwargs)
+
+    return dataset_class(**dataset_kwargs, **common_kwargs)
 
 
 def parse_arguments():
@@ -199,12 +403,66 @@ def parse_arguments():
     parser.add_argument("--split", type=str, choices=['train', 'test', 'val', 'raw_small', 'raw_medium', 'raw_large'],
                         default="train", help="Once dataset split type.")
     parser.add_argument('--dataroot', type=str, default='./temp/nuscenes', help='Data root location.')
-    parser.add_argument('--strategy', type=str, default='default', choices=accumulator_strategies.keys(),
+    parser.add_argument('--strategy', type=str, default='default', choices=get_accumulation_strategy_names(),
                         help='Accumulation strategy.')
     parser.add_argument('--enable_logging', action='store_true', help='Save additional logs to file.')
     parser.add_argument('--num_workers', type=int, default=multiprocessing.cpu_count(),
                         help='Count of parallel workers.')
     parser.add_argument('--force_overwrite', action='store_true', help='Overwrite saved files.')
+    parser.add_argument('--mmap_frames', action='store_true',
+                        help='Memory-map frame point clouds, pages are shared between workers via the page cache.')
+    parser.add_argument('--packed_root', type=str, default=None,
+                        help='Read frames from packed scene archives in this folder, see pack_scenes.py.')
+    parser.add_argument('--packed_output_root', type=str, default=None,
+                        help='Write patched frames as packed scene archives to this folder.')
+    parser.add_argument('--metadata_index', type=str, default=None,
+                        help='Serve scenes, instances and boxes from the index built by build_metadata_index.py.')
+    parser.add_argument('--nuscenes_snapshot', type=str, default=None,
+                        help='Load NuScenes tables from this snapshot, it is built from the JSON tables if missing.')
+    parser.add_argument('--track_once_instances', action='store_true',
+                        help='Track ONCE instances from the JSON annotations instead of the track_once.py pickles.')
+    parser.add_argument('--delta_output', action='store_true',
+                        help='Write removed point indices and inserted points instead of full patched frames.')
+    parser.add_argument('--compact_output_step', type=float, default=None,
+                        help='Write patched frames with coordinates quantised to this step in meters, e.g. 0.01. '
+                             'Steps below 0.01 store coordinates of lidar frames as int32.')
+    parser.add_argument('--compress_output', action='store_true',
+                        help='Compress quantised patched frames, used with --compact_output_step.')
+    parser.add_argument('--point_cloud_dtype', type=str, choices=list(POINT_CLOUD_DTYPES), default='float32',
+                        help='Dtype of frames, accumulated clouds and patched frames in memory.')
+    parser.add_argument('--gpu_slots_per_device', type=int, default=4,
+                        help='Count of scenes allowed to use a single GPU at once.')
+    parser.add_argument('--memory_slots', type=int, default=None,
+                        help='Count of scenes allowed to run memory-hungry strategies at once. '
+                             'Defaults to the count of workers.')
+    parser.add_argument('--memory_budget_gb', type=float, default=None,
+                        help='Memory budget for accumulated clouds and grid indices of all running scenes. '
+                             'New scenes are delayed while the projected usage exceeds the budget.')
+    parser.add_argument('--default_scene_memory_gb', type=float, default=None,
+                        help='Expected peak of accumulated clouds of a scene until the first scene finishes. '
+                             'Scenes are admitted one at a time until then if not set.')
+    parser.add_argument('--spill_threshold_gb', type=float, default=None,
+                        help='Max size of accumulated clouds kept in memory per scene, '
+                             'the rest is spilled to memory-mapped files.')
+    parser.add_argument('--scratch_dir', type=str, default=None,
+                        help='Directory for spilled clouds, system temp directory by default.')
+    parser.add_argument('--prefetch_frames', type=int, default=2,
+                        help='Count of frames read ahead by every worker while the current frame is processed, '
+                             '0 disables read-ahead.')
+    parser.add_argument('--grid_cache_frames', type=int, default=None,
+                        help='Max count of frames of a scene whose grid indices are kept for extraction and patching, '
+                             'all frames of the scene by default, 0 disables grid indices. '
+                             'An index takes about 0.4MiB per 100k points.')
+    parser.add_argument('--grid_cell_size', type=float, default=2.0,
+                        help='Size of a cell of the grid indices in meters.')
+    parser.add_argument('--shard_index', '--shard-index', type=int, default=0,
+                        help='Index of the shard of scenes processed by this node.')
+    parser.add_argument('--num_shards', '--num-shards', type=int, default=1,
+                        help='Overall count of shards, i.e. nodes processing the dataset.')
+    parser.add_argument('--sharding_strategy', type=str, choices=['hash', 'cost'], default='hash',
+                        help='Split scenes by stable hash of scene ids or balance count of frames between shards.')
+    parser.add_argument('--shard_summary_dir', type=str, default='./temp/shards',
+                        help='Directory to save shard summaries, see merge_shard_summaries.py.')
     return parser.parse_args()
 
 
@@ -212,24 +470,39 @@ def main():
     multiprocessing.set_start_method('spawn', force=True)
     args = parse_arguments()
 
-    dataset_type = args.dataset
-
-    if dataset_type == 'nuscenes':
-        dataset = NuscenesDataset(version=args.version, dataroot=args.dataroot)
-    elif dataset_type == 'once':
-        dataset = OnceDataset(split=args.split, dataset_root=args.dataroot)
-    elif dataset_type == 'waymo':
-        dataset = WaymoDataset(dataset_root=args.dataroot)
-    else:
-        raise Exception(f"Unknown dataset {dataset_type}")
-
-    accumulator_strategy = accumulator_strategies[args.strategy]
-
-    __process_dataset(dataset=dataset,
-                      accumulation_strategy=accumulator_strategy,
-                      num_workers=args.num_workers,
-                      force_overwrite=args.force_overwrite,
-                      enable_logging=args.enable_logging)
+    dataset = __create_dataset(args)
+
+    scenes = __select_shard_scenes(dataset=dataset,
+                                   shard_index=args.shard_index,
+                                   num_shards=args.num_shards,
+                                   sharding_strategy=args.sharding_strategy)
+
+    expected_frames_per_scene = __process_dataset(
+        dataset=dataset,
+        scenes=scenes,
+        accumulation_strategy_name=args.strategy,
+        num_workers=args.num_workers,
+        force_overwrite=args.force_overwrite,
+        enable_logging=args.enable_logging,
+        gpu_slots_per_device=args.gpu_slots_per_device,
+        memory_slots=args.memory_slots if args.memory_slots is not None else args.num_workers,
+        memory_budget_bytes=int(args.memory_budget_gb * 2 ** 30) if args.memory_budget_gb is not None else None,
+        default_scene_peak_bytes=int(args.default_scene_memory_gb * 2 ** 30) if args.default_scene_memory_gb is not None else None,
+        spill_threshold_bytes=int(args.spill_threshold_gb * 2 ** 30) if args.spill_threshold_gb is not None else None,
+        scratch_dir=args.scratch_dir,
+        prefetch_frames=args.prefetch_frames,
+        grid_cache_frames=args.grid_cache_frames,
+        grid_cell_size=args.grid_cell_size
+    )
+
+    __write_shard_summary(dataset=dataset,
+                          dataset_name=args.dataset,
+                          scenes=scenes,
+                          expected_frames_per_scene=expected_frames_per_scene,
+                          shard_index=args.shard_index,
+                          num_shards=args.num_shards,
+                          sharding_strategy=args.sharding_strategy,
+                          summary_dir=args.shard_summary_dir)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,129 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from src.datasets.compact_frame import CompactFrameFormat, load_compact_point_cloud
+from src.datasets.dataset import Dataset
+
+
+def __create_dataset(dataset: str,
+                     dataroot: str,
+                     version: str,
+                     split: str) -> Dataset:
+    if dataset == 'nuscenes':
+        from src.datasets.nuscenes.nuscenes_dataset import NuscenesDataset
+        return NuscenesDataset(version=version, dataroot=dataroot)
+    elif dataset == 'once':
+        from src.datasets.once.once_dataset import OnceDataset
+        return OnceDataset(split=split, dataset_root=dataroot)
+    elif dataset == 'waymo':
+        from src.datasets.waymo.waymo_dataset import WaymoDataset
+        return WaymoDataset(dataset_root=dataroot)
+    else:
+        raise Exception(f"Unknown dataset {dataset}")
+
+
+def __get_raw_frame_bytes(dataset: str,
+                          frame_point_cloud: np.ndarray) -> int:
+    dimensions, points_count = frame_point_cloud.shape
+
+    # Patched nuScenes frames are written with an additional zero dimension.
+    if dataset == 'nuscenes':
+        dimensions += 1
+
+    return dimensions * points_count * np.dtype(np.float32).itemsize
+
+
+def __collect_frames(dataset: Dataset,
+                     frames_count: int) -> list:
+    frames = list()
+    for scene_id in dataset.scenes:
+        for frame_id, _ in dataset.get_scene_iterator(scene_id=scene_id):
+            frames.append(np.asarray(dataset.get_frame_point_cloud(scene_id=scene_id, frame_id=frame_id)))
+            if len(frames) >= frames_count:
+                return frames
+    return frames
+
+
+def __report_format(dataset: str,
+                    frames: list,
+                    compact_format: CompactFrameFormat,
+                    output_dir: str):
+    raw_bytes = 0
+    compact_bytes = 0
+    points_count = 0
+    max_error = 0.0
+    max_features_error = np.zeros(0)
+    int16_frames_count = 0
+    decode_seconds = 0.0
+
+    path = os.path.join(output_dir, 'frame.compact.npz')
+    for frame_point_cloud in frames:
+        compact_format.serialise(path=path, point_cloud=frame_point_cloud)
+
+        start = time.perf_counter()
+        decoded_point_cloud = load_compact_point_cloud(path)
+        decode_seconds += time.perf_counter() - start
+
+        raw_bytes += __get_raw_frame_bytes(dataset=dataset, frame_point_cloud=frame_point_cloud)
+        compact_bytes += os.path.getsize(path)
+        points_count += frame_point_cloud.shape[1]
+
+        with np.load(path) as compact_frame:
+            int16_frames_count += int(compact_frame['xyz'].dtype == np.int16)
+
+        if frame_point_cloud.shape[1] > 0:
+            max_error = max(max_error, float(np.abs(decoded_point_cloud[:3, :] - frame_point_cloud[:3, :]).max()))
+
+            features_error = np.abs(decoded_point_cloud[3:, :] - frame_point_cloud[3:, :]).max(axis=1)
+            max_features_error = features_error if len(max_features_error) == 0 \
+                else np.maximum(max_features_error, features_error)
+
+    features_errors = ", ".join(f"{error:.4f}" for error in max_features_error)
+    print(f"step {compact_format.quantisation_step}m, compress {compact_format.compress}: "
+          f"ratio {raw_bytes / compact_bytes:.2f}x ({raw_bytes / 2 ** 20:.1f} MiB -> {compact_bytes / 2 ** 20:.1f} MiB), "
+          f"decode {points_count / decode_seconds / 1e6:.1f} Mpoints/s, "
+          f"{compact_bytes / decode_seconds / 2 ** 20:.1f} MiB/s, "
+          f"max coordinate error {max_error * 1000:.2f}mm, "
+          f"max feature errors [{features_errors}], "
+          f"int16 coordinates in {int16_frames_count} of {len(frames)} frames")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='compression ratio and decode throughput of the compact frame format')
+    parser.add_argument('--dataset', type=str, choices=['nuscenes', 'once', 'waymo'], default='nuscenes',
+                        help='Dataset.')
+    parser.add_argument('--version', type=str, default='v1.0-mini', help='NuScenes version.')
+    parser.add_argument("--split", type=str, choices=['train', 'test', 'val', 'raw_small', 'raw_medium', 'raw_large'],
+                        default="train", help="Once dataset split type.")
+    parser.add_argument('--dataroot', type=str, default='./temp/nuscenes', help='Data root location.')
+    parser.add_argument('--frames_count', type=int, default=50, help='Count of frames to encode.')
+    parser.add_argument('--steps', type=float, nargs='+', default=[0.01, 0.001],
+                        help='Quantisation steps in meters to report.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    dataset = __create_dataset(dataset=args.dataset,
+                               dataroot=args.dataroot,
+                               version=args.version,
+                               split=args.split)
+    frames = __collect_frames(dataset=dataset, frames_count=args.frames_count)
+    print(f"Encoding {len(frames)} frames of {args.dataset}")
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        for step in args.steps:
+            for compress in [False, True]:
+                __report_format(dataset=args.dataset,
+                                frames=frames,
+                                compact_format=CompactFrameFormat(quantisation_step=step, compress=compress),
+                                output_dir=output_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,25 @@ class AccumulationStrategy(ABC):
     """Provides a strategy to merge cloud points.
     """
 
+    @property
+    def resource_requirements(self) -> dict:
+        """Returns resource slots the strategy needs while processing a scene.
+
+        See src.utils.resource_slots for the available pools.
+
+        :return: dict[str, int]
+            Pairs of a pool name to the count of required slots.
+        """
+        return dict()
+
+    def on_resources_acquired(self, resources: dict):
+        """Called in a worker once the required resource slots are acquired.
+
+        :param resources: dict[str, list]
+            Pairs of a pool name to the list of acquired tokens.
+        """
+        pass
+
     @abstractmethod
     def on_merge(self,
                  initial_point_cloud: np.ndarray,
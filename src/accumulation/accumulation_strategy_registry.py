@@ -0,0 +1,51 @@
+import importlib
+
+from src.accumulation.accumulation_strategy import AccumulationStrategy
+
+# Pairs of a strategy name to the module and the class implementing it.
+# Modules are imported on first use: some strategies pull in torch, open3d and GeDi.
+__STRATEGIES = {
+    'default': ('src.accumulation.default_accumulator_strategy', 'DefaultAccumulatorStrategy'),
+    'gedi': ('src.accumulation.gedi_accumulator_strategy', 'GediAccumulatorStrategy'),
+    'greedy_grid': ('src.accumulation.greedy_grid_accumulator_strategy', 'GreedyGridAccumulatorStrategy'),
+    'no_op': ('src.accumulation.no_op_accumulator_strategy', 'NoOpAccumulatorStrategy'),
+}
+
+# Strategies constructed in the current process.
+__constructed_strategies = dict()
+
+
+def get_accumulation_strategy_names() -> list:
+    return list(__STRATEGIES.keys())
+
+
+def create_accumulation_strategy(name: str) -> AccumulationStrategy:
+    """Imports the module of the strategy and constructs a new instance.
+
+    :param name: str
+        Name of the strategy, see get_accumulation_strategy_names.
+    :return: 'AccumulationStrategy'
+        A new strategy.
+    """
+    if name not in __STRATEGIES:
+        raise Exception(f"Unknown accumulation strategy {name}")
+
+    module_name, class_name = __STRATEGIES[name]
+    strategy_class = getattr(importlib.import_module(module_name), class_name)
+    return strategy_class()
+
+
+def get_accumulation_strategy(name: str) -> AccumulationStrategy:
+    """Returns the strategy constructed once per process.
+
+    Workers should call it instead of receiving a pickled strategy,
+    so every worker constructs the strategy only when it is actually used.
+
+    :param name: str
+        Name of the strategy, see get_accumulation_strategy_names.
+    :return: 'AccumulationStrategy'
+        A strategy shared within the process.
+    """
+    if name not in __constructed_strategies:
+        __constructed_strategies[name] = create_accumulation_strategy(name)
+    return __constructed_strategies[name]
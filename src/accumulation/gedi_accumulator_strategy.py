@@ -1,9 +1,8 @@
+import logging
+
 import numpy as np
-import open3d as o3d
 from src.accumulation.accumulation_strategy import AccumulationStrategy
-from src.utils.gedi_registration import run_point_cloud_registration_o3d
-from src.utils.o3d_helper import convert_to_o3d_pointcloud, convert_to_numpy_array
-from gedi import GeDi
+from src.utils.resource_slots import CUDA_DEVICE_POOL
 
 
 class GediAccumulatorStrategy(AccumulationStrategy):
@@ -11,25 +10,47 @@ class GediAccumulatorStrategy(AccumulationStrategy):
 
     The strategy assumes that the point clouds are already aligned
     and no further transformation is required.
+
+    torch, open3d and GeDi are imported and the GeDi model is loaded
+    on first use, so constructing the strategy is cheap.
+
+    The strategy is shared by all scenes of a worker and a scene may acquire
+    a different GPU than the previous one, so a model is kept per device.
     """
 
     def __init__(self):
-        config = {'dim': 32,  # descriptor output dimension - keep it 32 always
-                  'samples_per_batch': 500,  # batches to process the data on GPU
-                  'samples_per_patch_lrf': 2000,  # num. of point to process with LRF
-                  # int(4000* scale_f),
-                  # num. of points to sample for pointnet++
-                  'samples_per_patch_out': 512,
-                  'r_lrf': 1.5,  # LRF radius
-                  'fchkpt_gedi_net': 'data/chkpts/3dmatch/chkpt.tar'}  # path to checkpoint
-
-        self.__gedi = GeDi(config)
+        self.__config = {'dim': 32,  # descriptor output dimension - keep it 32 always
+                         'samples_per_batch': 500,  # batches to process the data on GPU
+                         'samples_per_patch_lrf': 2000,  # num. of point to process with LRF
+                         # int(4000* scale_f),
+                         # num. of points to sample for pointnet++
+                         'samples_per_patch_out': 512,
+                         'r_lrf': 1.5,  # LRF radius
+                         'fchkpt_gedi_net': 'data/chkpts/3dmatch/chkpt.tar'}  # path to checkpoint
+
+        self.__gedi_per_device = dict()
+        self.__device = None
         self.reference_point_cloud = np.zeros((3, 3), dtype=float)
 
+    @property
+    def resource_requirements(self) -> dict:
+        return {CUDA_DEVICE_POOL: 1}
+
+    def on_resources_acquired(self, resources: dict):
+        import torch
+
+        gpu_id = resources[CUDA_DEVICE_POOL][0]
+        torch.cuda.set_device(gpu_id)
+        self.__device = gpu_id
+        logging.info(f"Running GediAccumulatorStrategy on GPU {gpu_id}")
+
     def on_merge(self,
                  initial_point_cloud: np.ndarray,
                  next_point_cloud: np.ndarray,
                  frame_no: int) -> np.ndarray:
+        from src.utils.gedi_registration import run_point_cloud_registration_o3d
+        from src.utils.o3d_helper import convert_to_o3d_pointcloud, convert_to_numpy_array
+
         size_init = initial_point_cloud.shape[1]
         size_next = next_point_cloud.shape[1]
 
@@ -49,7 +70,7 @@ class GediAccumulatorStrategy(AccumulationStrategy):
 
             result_point_cloud_o3d = run_point_cloud_registration_o3d(
                 next_point_cloud_o3d, reference_point_cloud_o3d, size_init, size_next,
-                self.__gedi)
+                self.__get_gedi())
 
             result_point_cloud = convert_to_numpy_array(result_point_cloud_o3d)
             return np.concatenate(
@@ -59,3 +80,10 @@ class GediAccumulatorStrategy(AccumulationStrategy):
             result_point_cloud = np.concatenate(
                 (initial_point_cloud, next_point_cloud), axis=1)
             return result_point_cloud
+
+    def __get_gedi(self):
+        # The model is created on the current device, which is set once the slot is acquired.
+        if self.__device not in self.__gedi_per_device:
+            from gedi import GeDi
+            self.__gedi_per_device[self.__device] = GeDi(self.__config)
+        return self.__gedi_per_device[self.__device]
@@ -1,7 +1,7 @@
 import numpy as np
 
 from src.accumulation.accumulation_strategy import AccumulationStrategy
-from src.utils.greedy_grid.register import register
+from src.utils.resource_slots import CPU_MEMORY_POOL
 
 
 class GreedyGridAccumulatorStrategy(AccumulationStrategy):
@@ -12,10 +12,18 @@ class GreedyGridAccumulatorStrategy(AccumulationStrategy):
     Project webpage: https://github.com/DavidBoja/greedy-grid-search
     """
 
+    @property
+    def resource_requirements(self) -> dict:
+        # Grid search allocates large FFT buffers per registration.
+        return {CPU_MEMORY_POOL: 1}
+
     def on_merge(self,
                  initial_point_cloud: np.ndarray,
                  next_point_cloud: np.ndarray,
                  frame_no: int) -> np.ndarray:
+        # Greedy grid pulls in torch, import it only when the strategy is actually used.
+        from src.utils.greedy_grid.register import register
+
         if next_point_cloud.size == 0:
             return initial_point_cloud
         elif initial_point_cloud.size == 0:
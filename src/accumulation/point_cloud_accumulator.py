@@ -1,28 +1,84 @@
 import numpy as np
 
+from typing import Optional
+
 from src.accumulation.accumulation_strategy import AccumulationStrategy
 from src.datasets.dataset import Dataset
+from src.utils.dtype_policy import DEFAULT_POINT_CLOUD_DTYPE, as_point_cloud_dtype
+from src.utils.frame_grid_cache import FrameGridCache
+from src.utils.frame_prefetcher import FramePrefetcher
 
 
 class PointCloudAccumulator:
     """Accumulates point cloud of the instances across the entire scene.
+
+    When a frame is loaded, points of all instances that still read the frame
+    are extracted at once. Clouds of the other instances are kept until they are
+    merged, so every frame is loaded and searched once per scene rather than
+    once per instance.
+
+    Kept clouds are bounded by max_extracted_bytes of merge, up to the clouds of
+    a single frame: once the bound is reached, frames are extracted only for the
+    merged instance, and kept clouds over the bound are dropped and extracted
+    again when their frame is reloaded.
     """
 
     def __init__(self,
                  step: int,
                  grouped_instances: dict,
-                 dataset: Dataset):
+                 dataset: Dataset,
+                 prefetch_frames: int = 0,
+                 grid_cache: Optional[FrameGridCache] = None,
+                 point_cloud_dtype: np.dtype = DEFAULT_POINT_CLOUD_DTYPE):
+        """Creates an accumulator.
+
+        :param step: int
+            Step between accumulated frames.
+        :param grouped_instances: dict
+            Pairs of instance id to the ordered frames where the instance is present.
+            Should contain only instances that are going to be merged: extracted clouds
+            of an instance are kept until the instance is merged.
+        :param dataset: Dataset
+            Dataset to load frames from.
+        :param prefetch_frames: int
+            Count of frames loaded ahead while the strategy merges the current one, see FramePrefetcher.
+        :param grid_cache: Optional[FrameGridCache]
+            Cache of grid indices of frames, instances are looked up in the indices if given.
+        :param point_cloud_dtype: np.dtype
+            Dtype of the point clouds given to the strategy and of the accumulated point cloud.
+            Strategies may return wider types, e.g. after registration, results are converted back.
+        """
         assert step > 0, \
             f"Step should be greater than 0, but got {step}"
 
         self.__step = step
         self.__grouped_instances = grouped_instances
         self.__dataset = dataset
+        self.__prefetch_frames = prefetch_frames
+        self.__grid_cache = grid_cache
+        self.__point_cloud_dtype = np.dtype(point_cloud_dtype)
+
+        # Instances that have not read the frame yet, in order of grouped instances.
+        self.__frame_instances = dict()
+        for instance_id, instance_frames in grouped_instances.items():
+            for frame_id in instance_frames[::step]:
+                self.__frame_instances.setdefault(frame_id, dict())[instance_id] = None
+
+        # Extracted clouds of instances not merged yet, keyed on scene id and frame id.
+        self.__extracted_point_clouds = dict()
+        self.__extracted_bytes = 0
+
+    @property
+    def extracted_bytes(self) -> int:
+        """Bytes of the extracted clouds kept for instances not merged yet.
+        """
+        return self.__extracted_bytes
 
     def merge(self,
               scene_id: str,
               instance_id: str,
-              accumulation_strategy: AccumulationStrategy) -> np.ndarray:
+              accumulation_strategy: AccumulationStrategy,
+              max_extracted_bytes: Optional[int] = None) -> np.ndarray:
         """Accumulates the point cloud of the given object across the scene using accumulation strategy.
 
         Runtime complexity is O(frames * N * d).
@@ -33,9 +89,13 @@ class PointCloudAccumulator:
             ID of an instance.
         :param accumulation_strategy: 'AccumulationStrategy'
             A strategy to concatenate 2 point clouds.
+        :param max_extracted_bytes: Optional[int]
+            Max bytes of clouds kept for other instances, None keeps all of them.
         :return: np.ndarray[float]
             A point cloud accumulated across the entire scene.
         """
+        assert max_extracted_bytes is None or max_extracted_bytes >= 0, \
+            f"Max extracted bytes should not be negative, got {max_extracted_bytes}"
 
         assert instance_id in self.__grouped_instances, \
             f"Unknown instance_id {instance_id}"
@@ -45,28 +105,100 @@ class PointCloudAccumulator:
         assert len(instance_frames) > 0, \
             f"Instance has not been detected in any frames"
 
-        first_frame_id = instance_frames[0]
-        first_frame_point_cloud = self.__dataset.get_frame_point_cloud(scene_id=scene_id,
-                                                                       frame_id=first_frame_id)
-
-        current_point_cloud = self.__dataset.get_instance_point_cloud(scene_id=scene_id,
-                                                                      frame_id=first_frame_id,
-                                                                      instance_id=instance_id,
-                                                                      frame_point_cloud=first_frame_point_cloud)
-
-        for i in range(self.__step, len(instance_frames), self.__step):
-            frame_id = instance_frames[i]
-
-            frame_point_cloud = self.__dataset.get_frame_point_cloud(scene_id=scene_id,
-                                                                     frame_id=frame_id)
-
-            next_point_cloud = self.__dataset.get_instance_point_cloud(scene_id=scene_id,
-                                                                       frame_id=frame_id,
-                                                                       instance_id=instance_id,
-                                                                       frame_point_cloud=frame_point_cloud)
+        frame_indices = range(0, len(instance_frames), self.__step)
+
+        # Clouds kept last are dropped first, their frames are reloaded by the instances reading them.
+        while max_extracted_bytes is not None and self.__extracted_bytes > max_extracted_bytes:
+            _, instance_point_clouds = self.__extracted_point_clouds.popitem()
+            self.__extracted_bytes -= sum(point_cloud.nbytes for point_cloud in instance_point_clouds.values())
+
+        # Frames already extracted for an instance merged earlier are not loaded again.
+        frames_to_load = [(scene_id, instance_frames[i]) for i in frame_indices
+                          if (scene_id, instance_frames[i]) not in self.__extracted_point_clouds]
+        frames_prefetcher = FramePrefetcher(dataset=self.__dataset,
+                                            frames=frames_to_load,
+                                            lookahead=self.__prefetch_frames)
+        frames_iterator = iter(frames_prefetcher)
+
+        current_point_cloud = self.__get_instance_point_cloud(scene_id=scene_id,
+                                                              frame_id=instance_frames[frame_indices[0]],
+                                                              instance_id=instance_id,
+                                                              frames_iterator=frames_iterator,
+                                                              max_extracted_bytes=max_extracted_bytes)
+
+        for i in frame_indices[1:]:
+            next_point_cloud = self.__get_instance_point_cloud(scene_id=scene_id,
+                                                               frame_id=instance_frames[i],
+                                                               instance_id=instance_id,
+                                                               frames_iterator=frames_iterator,
+                                                               max_extracted_bytes=max_extracted_bytes)
 
             current_point_cloud = accumulation_strategy.on_merge(initial_point_cloud=current_point_cloud,
                                                                  next_point_cloud=next_point_cloud,
                                                                  frame_no=i)
+            current_point_cloud = as_point_cloud_dtype(current_point_cloud, dtype=self.__point_cloud_dtype)
 
         return current_point_cloud
+
+    def __get_instance_point_cloud(self,
+                                   scene_id: str,
+                                   frame_id: str,
+                                   instance_id: str,
+                                   frames_iterator,
+                                   max_extracted_bytes: Optional[int]) -> np.ndarray:
+        key = (scene_id, frame_id)
+        frame_instances = self.__frame_instances[frame_id]
+
+        if key not in self.__extracted_point_clouds:
+            _, loaded_frame_id, frame_point_cloud = next(frames_iterator)
+            assert loaded_frame_id == frame_id, \
+                f"Expected frame {frame_id}, but got {loaded_frame_id}"
+
+            # Over the bound only the merged instance is extracted, other instances reload the frame.
+            if max_extracted_bytes is not None and self.__extracted_bytes >= max_extracted_bytes:
+                del frame_instances[instance_id]
+                return self.__extract_instance_point_clouds(scene_id=scene_id,
+                                                            frame_id=frame_id,
+                                                            instance_ids=[instance_id],
+                                                            frame_point_cloud=frame_point_cloud)[instance_id]
+
+            instance_point_clouds = self.__extract_instance_point_clouds(scene_id=scene_id,
+                                                                         frame_id=frame_id,
+                                                                         instance_ids=list(frame_instances.keys()),
+                                                                         frame_point_cloud=frame_point_cloud)
+            self.__extracted_point_clouds[key] = instance_point_clouds
+            self.__extracted_bytes += sum(point_cloud.nbytes for point_cloud in instance_point_clouds.values())
+
+        del frame_instances[instance_id]
+
+        instance_point_clouds = self.__extracted_point_clouds[key]
+        instance_point_cloud = instance_point_clouds.pop(instance_id)
+        self.__extracted_bytes -= instance_point_cloud.nbytes
+
+        if len(instance_point_clouds) == 0:
+            del self.__extracted_point_clouds[key]
+
+        return instance_point_cloud
+
+    def __extract_instance_point_clouds(self,
+                                        scene_id: str,
+                                        frame_id: str,
+                                        instance_ids: list,
+                                        frame_point_cloud: np.ndarray) -> dict:
+        frame_point_cloud = as_point_cloud_dtype(frame_point_cloud, dtype=self.__point_cloud_dtype)
+
+        if self.__grid_cache is None:
+            return {instance_id: self.__dataset.get_instance_point_cloud(scene_id=scene_id,
+                                                                         frame_id=frame_id,
+                                                                         instance_id=instance_id,
+                                                                         frame_point_cloud=frame_point_cloud)
+                    for instance_id in instance_ids}
+
+        grid_index = self.__grid_cache.get_grid_index(scene_id=scene_id,
+                                                      frame_id=frame_id,
+                                                      frame_point_cloud=frame_point_cloud)
+        return self.__dataset.get_instance_point_clouds(scene_id=scene_id,
+                                                        frame_id=frame_id,
+                                                        instance_ids=instance_ids,
+                                                        frame_point_cloud=frame_point_cloud,
+                                                        grid_index=grid_index)
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import heapq
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from collections import deque
+from typing import Optional
+
+
+class SpillableCloudStore:
+    """Keeps accumulated instance clouds in memory and spills them to memory-mapped files.
+
+    Once in-memory clouds exceed the threshold, the store spills the clouds
+    that are needed last according to the access schedule, i.e. the order
+    in which the patching loop reads instances. Clouds that are needed at
+    the same time are spilled in least recently used order.
+
+    Spilled clouds are read back as read-only np.memmap views without copying.
+    They are never promoted back to memory, even when they are read repeatedly:
+    the page cache keeps hot spilled clouds in memory anyway.
+    The scratch directory is removed on close.
+    """
+
+    def __init__(self,
+                 access_schedule: list,
+                 memory_threshold_bytes: Optional[int] = None,
+                 scratch_root: Optional[str] = None,
+                 prefix: str = 'clouds_'):
+        """Creates a store.
+
+        :param access_schedule: list[str]
+            IDs of instances in the order they are going to be read,
+            an instance appears once per read.
+        :param memory_threshold_bytes: Optional[int]
+            Max bytes kept in memory, None disables spilling.
+        :param scratch_root: Optional[str]
+            Directory for spilled clouds, system temp directory by default.
+        :param prefix: str
+            Prefix of the scratch directory name.
+        """
+        assert memory_threshold_bytes is None or memory_threshold_bytes >= 0, \
+            f"Memory threshold should not be negative, got {memory_threshold_bytes}"
+
+        self.__memory_threshold_bytes = memory_threshold_bytes
+        self.__scratch_root = scratch_root
+        self.__prefix = prefix
+        self.__scratch_dir = None
+
+        self.__scheduled_reads = dict()
+        for position, instance_id in enumerate(access_schedule):
+            if instance_id not in self.__scheduled_reads:
+                self.__scheduled_reads[instance_id] = deque()
+            self.__scheduled_reads[instance_id].append(position)
+
+        self.__in_memory_clouds = dict()
+        self.__spilled_clouds = dict()
+        self.__in_memory_bytes = 0
+        self.__last_access = dict()
+        self.__access_counter = 0
+        # Spill candidates keyed on (-next read, last access). Entries are not removed
+        # on access, an entry is stale once the last access of its instance changed.
+        self.__spill_heap = list()
+
+    def __enter__(self) -> SpillableCloudStore:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __contains__(self, instance_id: str) -> bool:
+        return instance_id in self.__in_memory_clouds or instance_id in self.__spilled_clouds
+
+    def __len__(self) -> int:
+        return len(self.__in_memory_clouds) + len(self.__spilled_clouds)
+
+    @property
+    def in_memory_bytes(self) -> int:
+        return self.__in_memory_bytes
+
+    @property
+    def spilled_count(self) -> int:
+        return len(self.__spilled_clouds)
+
+    def put(self,
+            instance_id: str,
+            point_cloud: np.ndarray):
+        """Stores accumulated point cloud of the instance.
+
+        :param instance_id: str
+            ID of an instance.
+        :param point_cloud: np.ndarray[float]
+            Accumulated point cloud.
+        """
+        assert instance_id not in self, \
+            f"Instance {instance_id} is already stored"
+
+        self.__in_memory_clouds[instance_id] = point_cloud
+        self.__in_memory_bytes += point_cloud.nbytes
+        self.__touch(instance_id)
+
+        self.__spill_if_needed()
+
+    def get(self, instance_id: str) -> np.ndarray:
+        """Returns accumulated point cloud of the instance and advances its schedule.
+
+        The returned array should not be modified: spilled clouds are read-only views.
+
+        :param instance_id: str
+            ID of an instance.
+        :return: np.ndarray[float]
+            Accumulated point cloud.
+        """
+        scheduled_reads = self.__scheduled_reads.get(instance_id, None)
+        if scheduled_reads:
+            scheduled_reads.popleft()
+
+        self.__touch(instance_id)
+
+        if instance_id in self.__in_memory_clouds:
+            return self.__in_memory_clouds[instance_id]
+
+        path, dtype, shape = self.__spilled_clouds[instance_id]
+        return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+    def close(self):
+        """Drops all clouds and removes the scratch directory.
+        """
+        self.__in_memory_clouds.clear()
+        self.__spilled_clouds.clear()
+        self.__spill_heap.clear()
+        self.__in_memory_bytes = 0
+
+        if self.__scratch_dir is not None:
+            shutil.rmtree(self.__scratch_dir, ignore_errors=True)
+            self.__scratch_dir = None
+
+    def __touch(self, instance_id: str):
+        self.__access_counter += 1
+        self.__last_access[instance_id] = self.__access_counter
+
+        if instance_id in self.__in_memory_clouds:
+            heapq.heappush(self.__spill_heap, self.__spill_key(instance_id))
+
+            # Stale entries are dropped once they outnumber the live ones, O(1) amortised per access.
+            if len(self.__spill_heap) > 2 * len(self.__in_memory_clouds) + 64:
+                self.__spill_heap = [self.__spill_key(i) for i in self.__in_memory_clouds.keys()]
+                heapq.heapify(self.__spill_heap)
+
+    def __spill_key(self, instance_id: str) -> tuple:
+        # Latest next read first, then least recently used.
+        return -self.__next_read(instance_id), self.__last_access[instance_id], instance_id
+
+    def __next_read(self, instance_id: str) -> float:
+        scheduled_reads = self.__scheduled_reads.get(instance_id, None)
+        return scheduled_reads[0] if scheduled_reads else float('inf')
+
+    def __spill_if_needed(self):
+        if self.__memory_threshold_bytes is None or self.__in_memory_bytes <= self.__memory_threshold_bytes:
+            return
+
+        # O(log(n)) per spilled cloud instead of sorting all in-memory clouds on every put.
+        while self.__in_memory_bytes > self.__memory_threshold_bytes and len(self.__spill_heap) > 0:
+            _, last_access, instance_id = heapq.heappop(self.__spill_heap)
+            if instance_id not in self.__in_memory_clouds or self.__last_access[instance_id] != last_access:
+                continue
+
+            point_cloud = self.__in_memory_clouds[instance_id]
+
+            # np.memmap cannot map empty files, empty clouds cost nothing anyway.
+            if point_cloud.size == 0:
+                continue
+
+            self.__spill(instance_id, point_cloud)
+
+    def __spill(self,
+                instance_id: str,
+                point_cloud: np.ndarray):
+        if self.__scratch_dir is None:
+            self.__scratch_dir = tempfile.mkdtemp(prefix=self.__prefix, dir=self.__scratch_root)
+
+        path = os.path.join(self.__scratch_dir, f"{len(self.__spilled_clouds)}.bin")
+
+        spilled_point_cloud = np.memmap(path, dtype=point_cloud.dtype, mode='w+', shape=point_cloud.shape)
+        spilled_point_cloud[:] = point_cloud
+        spilled_point_cloud.flush()
+        del spilled_point_cloud
+
+        self.__spilled_clouds[instance_id] = (path, point_cloud.dtype, point_cloud.shape)
+        del self.__in_memory_clouds[instance_id]
+        self.__in_memory_bytes -= point_cloud.nbytes
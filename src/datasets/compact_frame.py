@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import os
+import numpy as np
+
+COMPACT_SUFFIX = '.compact.npz'
+
+
+class CompactFrameFormat(object):
+    """Quantised storage of patched frames.
+
+    Coordinates are stored as int16 steps relative to the centre of the frame,
+    frames wider than the int16 range at the given step fall back to int32.
+    int16 covers +-327m at the 0.01m step but only +-32m at the 0.001m step,
+    so lidar frames at millimetre steps are almost always stored as int32.
+
+    Every other dimension, e.g. intensity, is stored as uint8 with a per-frame
+    offset and a scale of range / 255, i.e. with an error of at most range / 510.
+    Integer-valued dimensions with a range of at most 255 are stored exactly.
+    """
+
+    def __init__(self,
+                 quantisation_step: float = 0.01,
+                 compress: bool = False):
+        """Creates the format.
+
+        :param quantisation_step: float
+            Coordinate step in meters, e.g. 0.01 for centimetres or 0.001 for millimetres.
+        :param compress: bool
+            Additionally compress arrays with np.savez_compressed.
+        """
+        assert quantisation_step > 0, \
+            f"Quantisation step should be positive, got {quantisation_step}"
+
+        self.__quantisation_step = quantisation_step
+        self.__compress = compress
+
+    @property
+    def quantisation_step(self) -> float:
+        return self.__quantisation_step
+
+    @property
+    def compress(self) -> bool:
+        return self.__compress
+
+    def serialise(self,
+                  path: str,
+                  point_cloud: np.ndarray):
+        """Serialises the frame into a .compact.npz file.
+
+        Runtime complexity is O(N*d).
+
+        :param path: str
+            Path to the file.
+        :param point_cloud: np.ndarray[float]
+            Point cloud of shape dxn, d >= 3.
+        """
+        if not path.endswith(COMPACT_SUFFIX):
+            raise Exception(f"Supports only {COMPACT_SUFFIX} files, got: {path}")
+
+        assert point_cloud.shape[0] >= 3, \
+            f"Expected at least 3 dimensions, got {point_cloud.shape[0]}"
+
+        xyz = point_cloud[:3, :].astype(np.float64)
+        features = point_cloud[3:, :].astype(np.float64)
+
+        if xyz.shape[1] > 0:
+            origin = (xyz.min(axis=1) + xyz.max(axis=1)) / 2
+        else:
+            origin = np.zeros(3)
+
+        steps = np.rint((xyz - origin[:, np.newaxis]) / self.__quantisation_step)
+        steps_dtype = np.int16 if steps.size == 0 or np.abs(steps).max() <= np.iinfo(np.int16).max else np.int32
+
+        if features.shape[1] > 0:
+            features_offset = features.min(axis=1)
+            features_range = features.max(axis=1) - features_offset
+        else:
+            features_offset = np.zeros(features.shape[0])
+            features_range = np.zeros(features.shape[0])
+
+        # Integer features that fit into uint8 are kept exactly, the others are spread over all uint8 values.
+        uint8_limit = np.iinfo(np.uint8).max
+        is_exact = np.all(features == np.rint(features), axis=1) & (features_range <= uint8_limit)
+        features_scale = np.where(is_exact | (features_range == 0), 1.0, features_range / uint8_limit)
+        quantised_features = np.rint((features - features_offset[:, np.newaxis]) / features_scale[:, np.newaxis])
+
+        save = np.savez_compressed if self.__compress else np.savez
+        save(path,
+             quantisation_step=np.array(self.__quantisation_step, dtype=np.float64),
+             origin=origin,
+             xyz=np.ascontiguousarray(steps.T, dtype=steps_dtype),
+             features_offset=features_offset,
+             features_scale=features_scale,
+             features=np.ascontiguousarray(quantised_features.T, dtype=np.uint8))
+
+
+def load_compact_point_cloud(path: str) -> np.ndarray:
+    """Loads a frame saved by CompactFrameFormat.
+
+    The format of the file is self-describing,
+    so frames are loaded the same way for every step and compression.
+    Runtime complexity is O(N*d).
+
+    :param path: str
+        Path to the file.
+    :return: np.ndarray[float]
+        Point cloud of shape dxn of float32 values.
+    """
+    if not path.endswith(COMPACT_SUFFIX):
+        raise Exception(f"Supports only {COMPACT_SUFFIX} files, got: {path}")
+
+    with np.load(path) as frame:
+        quantisation_step = float(frame['quantisation_step'])
+        origin = frame['origin']
+        xyz = frame['xyz']
+        features_offset = frame['features_offset']
+        features_scale = frame['features_scale']
+        features = frame['features']
+
+    points_count = xyz.shape[0]
+    features_count = features.shape[1]
+
+    point_cloud = np.empty((3 + features_count, points_count), dtype=np.float32)
+
+    np.multiply(xyz.T, np.float32(quantisation_step), out=point_cloud[:3, :])
+    point_cloud[:3, :] += origin.astype(np.float32)[:, np.newaxis]
+
+    np.multiply(features.T, features_scale.astype(np.float32)[:, np.newaxis], out=point_cloud[3:, :])
+    point_cloud[3:, :] += features_offset.astype(np.float32)[:, np.newaxis]
+
+    return point_cloud
+
+
+def get_compact_path(frame_path: str) -> str:
+    """Returns path of the compact file for the given patched frame path.
+
+    :param frame_path: str
+        Path of the patched frame, e.g. ending with .bin or .npy.
+    :return: str
+        The same path with .compact.npz extension.
+    """
+    root, _ = os.path.splitext(frame_path)
+    return root + COMPACT_SUFFIX
@@ -5,7 +5,9 @@ import numpy as np
 from abc import ABC, abstractmethod
 from typing import Optional, Iterable
 
+from src.datasets.frame_delta import FrameDelta
 from src.datasets.frame_patcher import FramePatcher
+from src.utils.bev_grid_index import BevGridIndex
 
 
 class Dataset(ABC):
@@ -40,6 +42,16 @@ class Dataset(ABC):
     def scenes(self) -> list:
         ...
 
+    @property
+    @abstractmethod
+    def point_cloud_dtype(self) -> np.dtype:
+        """Returns dtype of the point clouds returned by the dataset.
+
+        Frames are converted to the dtype on loading, instance point clouds
+        and patched frames keep the dtype of the frames they come from.
+        """
+        ...
+
     @abstractmethod
     def get_scene_iterator(self, scene_id: str) -> Dataset.SceneIterator:
         """Returns a scene iterator for the given scene_id.
@@ -57,7 +69,25 @@ class Dataset(ABC):
         ...
 
     @abstractmethod
-    def load_frame_patcher(self, scene_id: str, frame_id: str) -> FramePatcher:
+    def load_frame_patcher(self,
+                           scene_id: str,
+                           frame_id: str,
+                           frame_point_cloud: Optional[np.ndarray] = None,
+                           grid_index: Optional[BevGridIndex] = None) -> FramePatcher:
+        """Creates a patcher of the frame.
+
+        :param scene_id: str
+            Unique scene identifier.
+        :param frame_id: str
+            Unique frame identifier.
+        :param frame_point_cloud: Optional[np.ndarray]
+            Already loaded point cloud of the frame, e.g. by a prefetcher.
+            The frame is loaded with get_frame_point_cloud if None.
+        :param grid_index: Optional[BevGridIndex]
+            Index of the given frame point cloud, points of boxes are looked up in it.
+        :return:
+            An instance of FramePatcher.
+        """
         ...
 
     @abstractmethod
@@ -81,11 +111,84 @@ class Dataset(ABC):
         """
         ...
 
+    @abstractmethod
+    def get_serialised_frame_ids(self, scene_id: str) -> set:
+        """Returns frames of the scene that already have a serialised point cloud.
+
+        Output files of the whole scene are resolved with a single listing
+        of the output folder instead of a check per frame.
+
+        Runtime complexity is O(frames).
+
+        :param scene_id: str
+            Unique scene identifier.
+        :return: set[str]
+            IDs of the serialised frames.
+        """
+        ...
+
     @abstractmethod
     def serialise_frame_point_clouds(self,
                                      scene_id: str,
                                      frame_id: str,
-                                     frame_point_cloud: np.ndarray) -> Optional[str]:
+                                     frame_point_cloud: np.ndarray,
+                                     frame_delta: Optional[FrameDelta] = None) -> Optional[str]:
+        """Serialises the patched point cloud of the frame.
+
+        :param scene_id: str
+            Unique scene identifier.
+        :param frame_id: str
+            Unique frame identifier.
+        :param frame_point_cloud: np.ndarray[float]
+            Patched point cloud of shape dxn.
+        :param frame_delta: Optional[FrameDelta]
+            Difference between the original and the patched frames,
+            required when the dataset writes deltas instead of full frames.
+        :return: Optional[str]
+            Path to the serialised point cloud.
+        """
+        ...
+
+    def flush_serialised_frames(self, scene_id: str):
+        """Makes frames of the scene serialised so far visible to other processes.
+
+        Called once the scene is processed. Outputs that write every frame
+        to its own file do not need it.
+
+        :param scene_id: str
+            Unique scene identifier.
+        """
+        pass
+
+    def get_frames_count(self, scene_id: str) -> int:
+        """Returns count of frames in the scene, e.g. as a cost of processing the scene.
+
+        Frames of the scene iterator are counted by default, datasets override it
+        with a count that does not need instances of the frames.
+
+        :param scene_id: str
+            Unique scene identifier.
+        :return: int
+            Count of frames.
+        """
+        return sum(1 for _ in self.get_scene_iterator(scene_id=scene_id))
+
+    @abstractmethod
+    def get_patched_frame_point_cloud(self,
+                                      scene_id: str,
+                                      frame_id: str) -> np.ndarray:
+        """Loads the serialised patched point cloud of the frame.
+
+        Frames written as deltas are reconstructed from the original frame.
+        Runtime complexity is O(N*d).
+
+        :param scene_id: str
+            Unique scene identifier.
+        :param frame_id: str
+            Unique frame identifier.
+        :return: np.ndarray[float]
+            Patched point cloud of shape dxn.
+        """
         ...
 
     @abstractmethod
@@ -104,6 +207,26 @@ class Dataset(ABC):
         """
         ...
 
+    @abstractmethod
+    def get_instance_box(self,
+                         scene_id: str,
+                         frame_id: str,
+                         instance_id: str) -> tuple:
+        """Returns box of the instance in the frame.
+
+        Runtime complexity is O(1) for datasets with indexed metadata.
+
+        :param scene_id: str
+            Unique scene identifier.
+        :param frame_id: str
+            Unique frame identifier.
+        :param instance_id: str
+            Unique instance identifier.
+        :return: tuple[np.ndarray, np.ndarray, Quaternion]
+            Center, length-width-height and rotation of the box in lidar coordinates of the frame.
+        """
+        ...
+
     @abstractmethod
     def get_instance_point_cloud(self,
                                  scene_id: str,
@@ -116,3 +239,32 @@ class Dataset(ABC):
 
         """
         ...
+
+    @abstractmethod
+    def get_instance_point_clouds(self,
+                                  scene_id: str,
+                                  frame_id: str,
+                                  instance_ids: list,
+                                  frame_point_cloud: np.ndarray,
+                                  grid_index: Optional[BevGridIndex] = None) -> dict:
+        """Returns point clouds of the specified instances of the frame.
+
+        Same as get_instance_point_cloud for every instance,
+        but the frame is swept once for all of them, see extract_box_point_clouds.
+
+        Runtime complexity is O(N*log(N) + k*m).
+
+        :param scene_id: str
+            Unique scene identifier.
+        :param frame_id: str
+            Unique frame identifier.
+        :param instance_ids: list[str]
+            Unique instance identifiers.
+        :param frame_point_cloud: np.ndarray[float]
+            Point cloud of the frame.
+        :param grid_index: Optional[BevGridIndex]
+            Index of the frame, e.g. shared through FrameGridCache, built if not given.
+        :return: dict[str, np.ndarray[float]]
+            Pairs of instance id to its point cloud in the box coordinates.
+        """
+        ...
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import os
+import numpy as np
+
+DELTA_SUFFIX = '.delta.npz'
+
+
+class FrameDelta(object):
+    """Difference between an original frame and its patched version.
+
+    Patching removes points inside boxes and appends the instance clouds,
+    so the patched frame is the original frame without the removed points,
+    order preserved, followed by the inserted points.
+    """
+
+    def __init__(self,
+                 original_points_count: int,
+                 removed_indices: np.ndarray,
+                 inserted_point_cloud: np.ndarray):
+        """Creates a delta.
+
+        :param original_points_count: int
+            Count of points in the original frame.
+        :param removed_indices: np.ndarray[int]
+            Sorted indices of the removed points in the original frame.
+        :param inserted_point_cloud: np.ndarray[float]
+            Inserted points of shape dxm.
+        """
+        self.__original_points_count = original_points_count
+        self.__removed_indices = removed_indices
+        self.__inserted_point_cloud = inserted_point_cloud
+
+    @classmethod
+    def from_patched_frame(cls,
+                           original_points_count: int,
+                           origin_indices: np.ndarray,
+                           frame_point_cloud: np.ndarray) -> FrameDelta:
+        """Creates a delta from the patched frame.
+
+        Runtime complexity is O(N).
+
+        :param original_points_count: int
+            Count of points in the original frame.
+        :param origin_indices: np.ndarray[int]
+            Index of every point of the patched frame in the original frame, -1 for inserted points.
+        :param frame_point_cloud: np.ndarray[float]
+            Patched frame of shape dxn.
+        :return: 'FrameDelta'
+            Delta between the original and the patched frames.
+        """
+        is_original = origin_indices >= 0
+
+        kept_mask = np.ones(original_points_count, dtype=bool)
+        kept_mask[origin_indices[is_original]] = False
+
+        return FrameDelta(original_points_count=original_points_count,
+                          removed_indices=np.flatnonzero(kept_mask),
+                          inserted_point_cloud=frame_point_cloud[:, ~is_original])
+
+    @classmethod
+    def load(cls, path: str) -> FrameDelta:
+        """Loads a delta saved by serialise.
+        """
+        if not path.endswith(DELTA_SUFFIX):
+            raise Exception(f"Supports only {DELTA_SUFFIX} files, got: {path}")
+
+        with np.load(path) as delta:
+            return FrameDelta(original_points_count=int(delta['original_points_count']),
+                              removed_indices=delta['removed_indices'],
+                              inserted_point_cloud=delta['inserted_points'].T)
+
+    @property
+    def original_points_count(self) -> int:
+        return self.__original_points_count
+
+    @property
+    def removed_indices(self) -> np.ndarray:
+        return self.__removed_indices
+
+    @property
+    def inserted_point_cloud(self) -> np.ndarray:
+        return self.__inserted_point_cloud
+
+    def serialise(self, path: str):
+        """Serialises the delta into a .delta.npz file.
+
+        Inserted points are stored as float32 mxd values, like frame .bin files.
+        """
+        if not path.endswith(DELTA_SUFFIX):
+            raise Exception(f"Supports only {DELTA_SUFFIX} files, got: {path}")
+
+        # Every lidar sweep fits into uint32 indices.
+        np.savez(path,
+                 original_points_count=np.array(self.__original_points_count, dtype=np.int64),
+                 removed_indices=self.__removed_indices.astype(np.uint32),
+                 inserted_points=self.__inserted_point_cloud.T.astype(np.float32))
+
+    def apply(self, original_point_cloud: np.ndarray) -> np.ndarray:
+        """Reconstructs the patched frame.
+
+        The result is written into a single preallocated buffer.
+        Runtime complexity is O(N*d).
+
+        :param original_point_cloud: np.ndarray[float]
+            Original frame of shape dxn.
+        :return: np.ndarray[float]
+            Patched frame.
+        """
+        points_count = original_point_cloud.shape[1]
+
+        assert points_count == self.__original_points_count, \
+            f"Delta expects {self.__original_points_count} points, original frame has {points_count}"
+
+        kept_mask = np.ones(points_count, dtype=bool)
+        kept_mask[self.__removed_indices] = False
+        kept_count = points_count - len(self.__removed_indices)
+
+        dimensions = original_point_cloud.shape[0]
+        inserted_count = self.__inserted_point_cloud.shape[1]
+
+        patched_point_cloud = np.empty((dimensions, kept_count + inserted_count),
+                                       dtype=np.result_type(original_point_cloud, self.__inserted_point_cloud))
+        np.compress(kept_mask, original_point_cloud, axis=1, out=patched_point_cloud[:, :kept_count])
+        patched_point_cloud[:, kept_count:] = self.__inserted_point_cloud[:dimensions, :]
+        return patched_point_cloud
+
+
+def get_delta_path(frame_path: str) -> str:
+    """Returns path of the delta file for the given patched frame path.
+
+    :param frame_path: str
+        Path of the patched frame, e.g. ending with .bin or .npy.
+    :return: str
+        The same path with .delta.npz extension.
+    """
+    root, _ = os.path.splitext(frame_path)
+    return root + DELTA_SUFFIX
@@ -2,6 +2,8 @@ import numpy as np
 
 from abc import ABC, abstractmethod
 
+from src.datasets.frame_delta import FrameDelta
+
 
 class FramePatcher(ABC):
     """Patches a frame with new point cloud.
@@ -27,6 +29,18 @@ class FramePatcher(ABC):
         """
         ...
 
+    @property
+    @abstractmethod
+    def delta(self) -> FrameDelta:
+        """Returns difference between the original and the patched frames.
+
+        Runtime complexity is O(N).
+
+        :return: 'FrameDelta'
+            Removed point indices and inserted points.
+        """
+        ...
+
     @abstractmethod
     def patch_instance(self,
                        instance_id: str,
@@ -39,3 +53,55 @@ class FramePatcher(ABC):
             New point cloud.
         """
         ...
+
+    @abstractmethod
+    def patch_instances(self,
+                        instance_point_clouds: dict):
+        """Replaces point clouds of the instances in the frame at once.
+
+        Points inside any of the boxes are removed with a single mask and the frame
+        is assembled once, see assemble_patched_frame. Unlike patch_instance called
+        for every instance, inserted points are never removed by boxes of other instances.
+
+        Runtime complexity is O(N + k*m).
+
+        :param instance_point_clouds: dict[str, np.ndarray[float]]
+            Pairs of instance id to its new point cloud, point clouds are transformed in place.
+        """
+        ...
+
+
+def assemble_patched_frame(frame_point_cloud: np.ndarray,
+                           origin_indices: np.ndarray,
+                           removal_mask: np.ndarray,
+                           inserted_point_clouds: list) -> tuple:
+    """Writes kept points of the frame followed by the inserted points into a single buffer.
+
+    :param frame_point_cloud: np.ndarray[float]
+        Frame point cloud of shape dxn.
+    :param origin_indices: np.ndarray[int]
+        Index of every point of the frame in the original frame, -1 for inserted points.
+    :param removal_mask: np.ndarray[bool]
+        Mask of the points to remove.
+    :param inserted_point_clouds: list[np.ndarray[float]]
+        Point clouds of shape dxm to append.
+    :return: tuple[np.ndarray[float], np.ndarray[int]]
+        Patched frame point cloud and index of its points in the original frame.
+    """
+    kept_indices = np.flatnonzero(~removal_mask)
+    kept_count = kept_indices.shape[0]
+    inserted_count = sum(point_cloud.shape[1] for point_cloud in inserted_point_clouds)
+
+    patched_point_cloud = np.empty((frame_point_cloud.shape[0], kept_count + inserted_count),
+                                   dtype=frame_point_cloud.dtype)
+    patched_origin_indices = np.full(kept_count + inserted_count, -1, dtype=origin_indices.dtype)
+
+    np.take(frame_point_cloud, kept_indices, axis=1, out=patched_point_cloud[:, :kept_count], mode='clip')
+    np.take(origin_indices, kept_indices, out=patched_origin_indices[:kept_count], mode='clip')
+
+    offset = kept_count
+    for point_cloud in inserted_point_clouds:
+        patched_point_cloud[:, offset:offset + point_cloud.shape[1]] = point_cloud
+        offset += point_cloud.shape[1]
+
+    return patched_point_cloud, patched_origin_indices
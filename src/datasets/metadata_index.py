@@ -0,0 +1,476 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import numpy as np
+
+from pyquaternion import Quaternion
+from typing import Optional
+
+from src.datasets.dataset import Dataset
+from src.datasets.frame_delta import FrameDelta
+from src.datasets.frame_descriptor import FrameDescriptor
+from src.datasets.frame_patcher import FramePatcher, assemble_patched_frame
+from src.utils.bev_grid_index import BevGridIndex, get_patched_points_in_boxes_mask
+from src.utils.geometry_utils import extract_box_point_clouds, transform_matrix
+from src.utils.rigid_transform import apply_rigid_transforms
+
+INDEX_SCHEMA = """
+CREATE TABLE scenes (
+    scene_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL
+);
+CREATE TABLE frames (
+    scene_id TEXT NOT NULL,
+    frame_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (scene_id, frame_id)
+);
+CREATE TABLE boxes (
+    scene_id TEXT NOT NULL,
+    frame_id TEXT NOT NULL,
+    instance_id NOT NULL,
+    position INTEGER NOT NULL,
+    x REAL, y REAL, z REAL,
+    l REAL, w REAL, h REAL,
+    qw REAL, qx REAL, qy REAL, qz REAL,
+    PRIMARY KEY (scene_id, frame_id, instance_id)
+);
+CREATE TABLE metadata (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class MetadataIndex:
+    """Read-only SQLite index of scenes, frames, instances and their boxes.
+
+    Instance ids keep their type, e.g. integer ids of tracked ONCE instances.
+    Boxes are stored in the coordinates of the lidar frame as a center,
+    length, width, height and a rotation quaternion, so the same queries
+    answer for every dataset.
+
+    The database is opened lazily with mode=ro, so the index can be pickled
+    to workers and shared by all of them.
+    """
+
+    def __init__(self, path: str):
+        assert os.path.exists(path), \
+            f"Cannot find metadata index {path}"
+
+        self.__path = path
+        self.__lock = threading.Lock()
+        self.__connection = None
+
+    def __getstate__(self) -> dict:
+        return {'path': self.__path}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state['path'])
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def get_scene_ids(self) -> list:
+        rows = self.__query("SELECT scene_id FROM scenes ORDER BY position")
+        return [scene_id for scene_id, in rows]
+
+    def get_frames(self, scene_id: str) -> list:
+        """Returns frames of the scene in order with their instances.
+
+        Runtime complexity is O(frames + instances) with a single query.
+
+        :param scene_id: str
+            ID of a scene.
+        :return: list[tuple[str, list[str]]]
+            Pairs of frame id and instance ids of the frame.
+        """
+        rows = self.__query("SELECT f.frame_id, b.instance_id FROM frames f "
+                            "LEFT JOIN boxes b ON b.scene_id = f.scene_id AND b.frame_id = f.frame_id "
+                            "WHERE f.scene_id = ? ORDER BY f.position, b.position", (scene_id,))
+
+        frames = dict()
+        for frame_id, instance_id in rows:
+            instance_ids = frames.setdefault(frame_id, list())
+            if instance_id is not None:
+                instance_ids.append(instance_id)
+        return list(frames.items())
+
+    def get_frames_count(self, scene_id: str) -> int:
+        rows = self.__query("SELECT COUNT(*) FROM frames WHERE scene_id = ?", (scene_id,))
+        return rows[0][0]
+
+    def get_instance_box(self,
+                         scene_id: str,
+                         frame_id: str,
+                         instance_id: str) -> tuple:
+        """Returns box of the instance in the frame.
+
+        :return: tuple[np.ndarray, np.ndarray, Quaternion]
+            Center, length-width-height and rotation of the box in lidar coordinates.
+        """
+        rows = self.__query("SELECT x, y, z, l, w, h, qw, qx, qy, qz FROM boxes "
+                            "WHERE scene_id = ? AND frame_id = ? AND instance_id = ?",
+                            (scene_id, frame_id, instance_id))
+
+        assert len(rows) == 1, \
+            f"Frame {frame_id} of scene {scene_id} does not have instance {instance_id}"
+
+        values = rows[0]
+        return np.array(values[0:3]), np.array(values[3:6]), Quaternion(values[6:10])
+
+    def get_frame_boxes(self,
+                        scene_id: str,
+                        frame_id: str) -> dict:
+        """Returns boxes of all instances of the frame with a single query.
+
+        :return: dict[str, tuple[np.ndarray, np.ndarray, Quaternion]]
+            Pairs of instance id to center, length-width-height and rotation of its box in lidar coordinates.
+        """
+        rows = self.__query("SELECT instance_id, x, y, z, l, w, h, qw, qx, qy, qz FROM boxes "
+                            "WHERE scene_id = ? AND frame_id = ? ORDER BY position", (scene_id, frame_id))
+
+        return {values[0]: (np.array(values[1:4]), np.array(values[4:7]), Quaternion(values[7:11]))
+                for values in rows}
+
+    def get_metadata(self, key: str):
+        rows = self.__query("SELECT value FROM metadata WHERE key = ?", (key,))
+        return rows[0][0] if len(rows) > 0 else None
+
+    def check_metadata(self, expected_metadata: dict):
+        """Checks that the index was built for the requested dataset.
+
+        :param expected_metadata: dict
+            Pairs of key to the expected value, e.g. name and version of the dataset.
+        """
+        for key, value in expected_metadata.items():
+            indexed_value = self.get_metadata(key)
+            assert indexed_value == str(value), \
+                f"Metadata index {self.__path} is built for {key} {indexed_value}, but {value} is requested"
+
+    def close(self):
+        with self.__lock:
+            if self.__connection is not None:
+                self.__connection.close()
+                self.__connection = None
+
+    def __query(self,
+                sql: str,
+                parameters: tuple = ()) -> list:
+        with self.__lock:
+            if self.__connection is None:
+                self.__connection = sqlite3.connect(f"file:{self.__path}?mode=ro", uri=True,
+                                                    check_same_thread=False)
+            return self.__connection.execute(sql, parameters).fetchall()
+
+
+class MetadataIndexWriter:
+    """Writes a metadata index, see MetadataIndex.
+
+    The index is written to a temporary file and moved in place on close,
+    so readers never see a partially built index.
+    """
+
+    def __init__(self, path: str):
+        self.__path = path
+        self.__temp_path = path + '.tmp'
+
+        if os.path.exists(self.__temp_path):
+            os.remove(self.__temp_path)
+
+        dir_path = os.path.dirname(path)
+        if len(dir_path) > 0:
+            os.makedirs(dir_path, exist_ok=True)
+
+        self.__connection = sqlite3.connect(self.__temp_path)
+        self.__connection.executescript(INDEX_SCHEMA)
+        self.__scenes_count = 0
+
+    def __enter__(self) -> MetadataIndexWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.__connection.close()
+            os.remove(self.__temp_path)
+
+    def set_metadata(self, key: str, value: str):
+        self.__connection.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?)", (key, str(value)))
+
+    def add_scene(self,
+                  scene_id: str,
+                  frames: list):
+        """Adds a scene.
+
+        :param scene_id: str
+            ID of a scene.
+        :param frames: list[tuple[str, list[tuple[str, np.ndarray, np.ndarray, Quaternion]]]]
+            Ordered pairs of frame id and its boxes: instance id, center, length-width-height and rotation.
+        """
+        self.__connection.execute("INSERT INTO scenes VALUES (?, ?)", (scene_id, self.__scenes_count))
+        self.__scenes_count += 1
+
+        self.__connection.executemany("INSERT INTO frames VALUES (?, ?, ?)",
+                                      [(scene_id, frame_id, position)
+                                       for position, (frame_id, _) in enumerate(frames)])
+
+        box_rows = list()
+        for frame_id, boxes in frames:
+            for position, (instance_id, center_xyz, dimensions_lwh, rotation) in enumerate(boxes):
+                instance_id = instance_id.item() if isinstance(instance_id, np.generic) else instance_id
+                box_rows.append((scene_id, frame_id, instance_id, position,
+                                 *map(float, center_xyz), *map(float, dimensions_lwh),
+                                 *map(float, rotation.elements)))
+        self.__connection.executemany("INSERT INTO boxes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                      box_rows)
+        self.__connection.commit()
+
+    def close(self):
+        self.__connection.commit()
+        self.__connection.close()
+        os.replace(self.__temp_path, self.__path)
+
+
+class IndexedSceneIterator(Dataset.SceneIterator):
+    """Iterator over frames of a scene read from a metadata index.
+    """
+
+    def __init__(self, frames: list):
+        self.__frames = frames
+        self.__current_index = 0
+
+    def __iter__(self) -> IndexedSceneIterator:
+        self.__current_index = 0
+        return self
+
+    def __next__(self) -> tuple:
+        if self.__current_index >= len(self.__frames):
+            raise StopIteration()
+
+        frame_id, instance_ids = self.__frames[self.__current_index]
+        self.__current_index += 1
+
+        return frame_id, FrameDescriptor(frame_id=frame_id, instances_ids=instance_ids)
+
+
+class IndexedFramePatcher(FramePatcher):
+    """Patches frames with boxes read from a metadata index.
+
+    Boxes are in lidar coordinates of the frame, so the patcher does not need
+    any metadata of the dataset: points inside the boxes are removed and the
+    new point clouds are moved from the box coordinates to the frame.
+    """
+
+    def __init__(self,
+                 frame_id: str,
+                 frame_point_cloud: np.ndarray,
+                 boxes: dict,
+                 grid_index: Optional[BevGridIndex] = None):
+        """Creates the patcher.
+
+        :param frame_id: str
+            ID of a frame.
+        :param frame_point_cloud: np.ndarray[float]
+            Frame point cloud of shape dxn.
+        :param boxes: dict[str, tuple[np.ndarray, np.ndarray, Quaternion]]
+            Pairs of instance id to center, length-width-height and rotation of its box, see MetadataIndex.
+        :param grid_index: Optional[BevGridIndex]
+            Index of the given frame point cloud, built if not given.
+        """
+        self.__frame_id = frame_id
+        self.__frame_point_cloud = frame_point_cloud
+        self.__boxes = boxes
+
+        # Boxes are looked up in the index of the original frame.
+        self.__grid_index = grid_index if grid_index is not None else BevGridIndex(points_xyz=frame_point_cloud)
+        self.__original_frame_point_cloud = frame_point_cloud
+
+        # Index of every point in the original frame, -1 for inserted points.
+        self.__original_points_count = frame_point_cloud.shape[1]
+        self.__origin_indices = np.arange(self.__original_points_count)
+
+    @property
+    def frame_id(self) -> str:
+        return self.__frame_id
+
+    @property
+    def frame(self) -> np.ndarray:
+        return self.__frame_point_cloud
+
+    @property
+    def delta(self) -> FrameDelta:
+        return FrameDelta.from_patched_frame(original_points_count=self.__original_points_count,
+                                             origin_indices=self.__origin_indices,
+                                             frame_point_cloud=self.__frame_point_cloud)
+
+    def patch_instance(self,
+                       instance_id: str,
+                       point_cloud: np.ndarray):
+        self.patch_instances({instance_id: point_cloud})
+
+    def patch_instances(self,
+                        instance_point_clouds: dict):
+        for instance_id in instance_point_clouds.keys():
+            assert instance_id in self.__boxes, \
+                f"Frame {self.__frame_id} does not have instance {instance_id}"
+
+        boxes = [self.__boxes[instance_id] for instance_id in instance_point_clouds.keys()]
+        removal_mask = get_patched_points_in_boxes_mask(grid_index=self.__grid_index,
+                                                        original_point_cloud=self.__original_frame_point_cloud,
+                                                        point_cloud=self.__frame_point_cloud,
+                                                        origin_indices=self.__origin_indices,
+                                                        boxes=boxes)
+        transformation_matrices = [transform_matrix(center_xyz, rotation) for center_xyz, _, rotation in boxes]
+
+        # Put the objects back into the scene at once, inserted points take the dtype of the frame.
+        inserted_point_clouds = list()
+        if len(instance_point_clouds) > 0:
+            inserted_point_clouds.append(apply_rigid_transforms(point_clouds=list(instance_point_clouds.values()),
+                                                                transformation_matrices=transformation_matrices,
+                                                                dtype=self.__frame_point_cloud.dtype))
+
+        self.__frame_point_cloud, self.__origin_indices = \
+            assemble_patched_frame(frame_point_cloud=self.__frame_point_cloud,
+                                   origin_indices=self.__origin_indices,
+                                   removal_mask=removal_mask,
+                                   inserted_point_clouds=inserted_point_clouds)
+
+
+class IndexedDatasetMixin:
+    """Serves scenes, frames, instances and boxes of a dataset from a metadata index.
+
+    The mixin should precede the dataset class in bases, e.g.
+    class IndexedOnceDataset(IndexedDatasetMixin, OnceDataset).
+    Frames are patched with IndexedFramePatcher, so the dataset builds its
+    native metadata, e.g. the NuScenes facade, only when loading or writing
+    frames needs it, and never in a process that does not touch frames.
+    """
+
+    def __init__(self,
+                 metadata_index_path: str,
+                 index_metadata: dict,
+                 *args,
+                 **kwargs):
+        """Creates the dataset and opens the index.
+
+        :param metadata_index_path: str
+            Path to the index built by build_metadata_index.py.
+        :param index_metadata: dict
+            Metadata the index should be built with, e.g. name and version of the dataset.
+        """
+        super().__init__(*args, **kwargs)
+        self.__metadata_index = MetadataIndex(metadata_index_path)
+        self.__metadata_index.check_metadata(index_metadata)
+        self.__scene_ids = self.__metadata_index.get_scene_ids()
+
+    @property
+    def metadata_index(self) -> MetadataIndex:
+        return self.__metadata_index
+
+    @property
+    def scenes(self) -> list:
+        return list(self.__scene_ids)
+
+    def get_scene_iterator(self, scene_id: str) -> Dataset.SceneIterator:
+        return IndexedSceneIterator(frames=self.__metadata_index.get_frames(scene_id))
+
+    def get_frames_count(self, scene_id: str) -> int:
+        return self.__metadata_index.get_frames_count(scene_id)
+
+    def load_frame_patcher(self,
+                           scene_id: str,
+                           frame_id: str,
+                           frame_point_cloud: Optional[np.ndarray] = None,
+                           grid_index: Optional[BevGridIndex] = None) -> FramePatcher:
+        if frame_point_cloud is None:
+            frame_point_cloud = self.get_frame_point_cloud(scene_id=scene_id,
+                                                           frame_id=frame_id)
+
+        return IndexedFramePatcher(frame_id=frame_id,
+                                   frame_point_cloud=frame_point_cloud,
+                                   boxes=self.__metadata_index.get_frame_boxes(scene_id=scene_id, frame_id=frame_id),
+                                   grid_index=grid_index)
+
+    def get_instance_box(self,
+                         scene_id: str,
+                         frame_id: str,
+                         instance_id: str) -> tuple:
+        return self.__metadata_index.get_instance_box(scene_id=scene_id,
+                                                      frame_id=frame_id,
+                                                      instance_id=instance_id)
+
+    def get_frame_to_box_transform(self,
+                                   scene_id: str,
+                                   frame_id: str,
+                                   instance_id: str) -> np.ndarray:
+        """Returns 4x4 transformation from lidar coordinates of the frame to the box coordinates.
+        """
+        center_xyz, _, rotation = self.get_instance_box(scene_id=scene_id,
+                                                        frame_id=frame_id,
+                                                        instance_id=instance_id)
+        return transform_matrix(center_xyz, rotation, inverse=True)
+
+    def get_instance_point_cloud(self,
+                                 scene_id: str,
+                                 frame_id: str,
+                                 instance_id: str,
+                                 frame_point_cloud: np.ndarray) -> np.ndarray:
+        center_xyz, dimensions_lwh, rotation = self.get_instance_box(scene_id=scene_id,
+                                                                     frame_id=frame_id,
+                                                                     instance_id=instance_id)
+        frame_to_box = transform_matrix(center_xyz, rotation, inverse=True)
+
+        # Points inside the box are exactly the points within half of the size in box coordinates.
+        box_points = frame_to_box[:3, :3].dot(frame_point_cloud[:3, :]) + frame_to_box[:3, 3:4]
+        mask = np.all(np.abs(box_points) <= dimensions_lwh[:, np.newaxis] / 2, axis=0)
+        indices = np.where(mask)[0]
+
+        instance_point_cloud = frame_point_cloud[:, indices]
+        instance_point_cloud[:3, :] = box_points[:, indices]
+        return instance_point_cloud
+
+    def get_instance_point_clouds(self,
+                                  scene_id: str,
+                                  frame_id: str,
+                                  instance_ids: list,
+                                  frame_point_cloud: np.ndarray,
+                                  grid_index: Optional[BevGridIndex] = None) -> dict:
+        frame_boxes = self.__metadata_index.get_frame_boxes(scene_id=scene_id, frame_id=frame_id)
+        boxes = {instance_id: frame_boxes[instance_id] for instance_id in instance_ids}
+        return extract_box_point_clouds(frame_point_cloud=frame_point_cloud,
+                                        boxes=boxes,
+                                        grid_index=grid_index)
+
+
+def build_metadata_index(dataset: Dataset,
+                         path: str,
+                         metadata: dict = None):
+    """Builds the metadata index of the dataset.
+
+    Boxes are queried with Dataset.get_instance_box.
+
+    :param dataset: Dataset
+        Dataset to index.
+    :param path: str
+        Path of the index.
+    :param metadata: dict
+        Pairs of key to value stored with the index, e.g. name and version of the dataset.
+    """
+    with MetadataIndexWriter(path) as writer:
+        for key, value in (metadata or dict()).items():
+            writer.set_metadata(key, value)
+
+        for scene_id in dataset.scenes:
+            frames = list()
+            for frame_id, frame_descriptor in dataset.get_scene_iterator(scene_id=scene_id):
+                boxes = [(instance_id, *dataset.get_instance_box(scene_id=scene_id,
+                                                                 frame_id=frame_id,
+                                                                 instance_id=instance_id))
+                         for instance_id in frame_descriptor.instances_ids]
+                frames.append((frame_id, boxes))
+            writer.add_scene(scene_id=scene_id, frames=frames)
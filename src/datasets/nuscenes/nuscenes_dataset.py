@@ -7,29 +7,102 @@ from nuscenes import NuScenes
 from typing import Optional
 
 from src.datasets.dataset import Dataset
+from src.datasets.compact_frame import CompactFrameFormat, get_compact_path, load_compact_point_cloud
+from src.datasets.frame_delta import FrameDelta, get_delta_path
 from src.datasets.frame_patcher import FramePatcher
+from src.datasets.metadata_index import IndexedDatasetMixin
 from src.datasets.nuscenes.nuscenes_scene_iterator import NuScenesSceneIterator
 from src.datasets.nuscenes.nuscenes_frame_patcher import NuscenesFramePatcher
-from src.datasets.nuscenes.nuscenes_utils import get_frame_point_cloud, get_instance_point_cloud
+from src.datasets.nuscenes.nuscenes_snapshot import load_nuscenes
+from src.datasets.nuscenes.nuscenes_utils import get_frame_point_cloud, get_instance_box, get_instance_boxes, \
+    get_instance_point_cloud
+from src.utils.bev_grid_index import BevGridIndex
+from src.utils.dtype_policy import DEFAULT_POINT_CLOUD_DTYPE, as_point_cloud_dtype
+from src.utils.packed_archive import PackedArchiveCollection
+from src.utils.file_utils import filter_existing_files
+from src.utils.geometry_utils import extract_box_point_clouds
+from src.utils.point_cloud_io import load_bin_point_cloud
 
 
 class NuscenesDataset(Dataset):
     def __init__(self,
                  version='v1.0-mini',
-                 dataroot='./temp/nuscenes'):
-        self.__nuscenes = NuScenes(version=version, dataroot=dataroot, verbose=True)
+                 dataroot='./temp/nuscenes',
+                 use_mmap: bool = False,
+                 packed_root: Optional[str] = None,
+                 packed_output_root: Optional[str] = None,
+                 delta_output: bool = False,
+                 compact_output: Optional[CompactFrameFormat] = None,
+                 snapshot_path: Optional[str] = None,
+                 point_cloud_dtype: np.dtype = DEFAULT_POINT_CLOUD_DTYPE):
+        """Creates NuScenes dataset.
 
-        self.__scenes = self.__nuscenes.scene
-        self.__scenes_lookup = {str(i): scene for i, scene in enumerate(self.__scenes)}
+        :param version: str
+            Version of the dataset.
+        :param dataroot: str
+            Root of the dataset.
+        :param use_mmap: bool
+            Memory-map frame point clouds instead of reading them,
+            loaded frames are read-only views.
+        :param packed_root: Optional[str]
+            Folder with packed scene archives to read frames from, see pack_scenes.py.
+        :param packed_output_root: Optional[str]
+            Folder to write patched frames to as packed scene archives,
+            frames are stored with 4 dimensions as they are loaded.
+        :param delta_output: bool
+            Write only removed point indices and inserted points of patched frames,
+            see FrameDelta.
+        :param compact_output: Optional[CompactFrameFormat]
+            Write patched frames quantised in the given format.
+        :param snapshot_path: Optional[str]
+            Load tables from the snapshot at this path instead of parsing the JSON tables,
+            the snapshot is built on first use, see NuScenesSnapshot.
+        :param point_cloud_dtype: np.dtype
+            Dtype frames are converted to on loading, see src.utils.dtype_policy.
+        """
+        self.__version = version
+        self.__dataroot = dataroot
+        self.__snapshot_path = snapshot_path
+        self.__use_mmap = use_mmap
+        self.__packed_input = PackedArchiveCollection(packed_root) if packed_root is not None else None
+        self.__packed_output = PackedArchiveCollection(packed_output_root) if packed_output_root is not None else None
+        self.__delta_output = delta_output
+        self.__compact_output = compact_output
+        self.__point_cloud_dtype = np.dtype(point_cloud_dtype)
+
+        assert [delta_output, packed_output_root is not None, compact_output is not None].count(True) <= 1, \
+            "Only one of delta, packed and compact outputs can be used"
+
+        # Tables are loaded on first use, see __nuscenes.
+        self.__nuscenes_instance = None
+        self.__scenes_lookup_instance = None
+
+    @property
+    def __nuscenes(self) -> NuScenes:
+        if self.__nuscenes_instance is None:
+            self.__nuscenes_instance = load_nuscenes(version=self.__version,
+                                                     dataroot=self.__dataroot,
+                                                     snapshot_path=self.__snapshot_path)
+        return self.__nuscenes_instance
+
+    @property
+    def __scenes_lookup(self) -> dict:
+        if self.__scenes_lookup_instance is None:
+            self.__scenes_lookup_instance = {str(i): scene for i, scene in enumerate(self.__nuscenes.scene)}
+        return self.__scenes_lookup_instance
 
     @property
     def dataroot(self) -> str:
-        return self.__nuscenes.dataroot
+        return self.__dataroot
 
     @property
     def scenes(self) -> list:
         return list(self.__scenes_lookup.keys())
 
+    @property
+    def point_cloud_dtype(self) -> np.dtype:
+        return self.__point_cloud_dtype
+
     def get_scene_iterator(self, scene_id: str) -> Dataset.SceneIterator:
         assert scene_id in self.__scenes_lookup
 
@@ -38,22 +111,58 @@ class NuscenesDataset(Dataset):
 
     def load_frame_patcher(self,
                            scene_id: str,
-                           frame_id: str) -> FramePatcher:
+                           frame_id: str,
+                           frame_point_cloud: Optional[np.ndarray] = None,
+                           grid_index: Optional[BevGridIndex] = None) -> FramePatcher:
+        if frame_point_cloud is None:
+            frame_point_cloud = self.get_frame_point_cloud(scene_id=scene_id,
+                                                           frame_id=frame_id)
+
         return NuscenesFramePatcher.load(frame_id=frame_id,
-                                         nuscenes=self.__nuscenes)
+                                         nuscenes=self.__nuscenes,
+                                         use_mmap=self.__use_mmap,
+                                         frame_point_cloud=frame_point_cloud,
+                                         grid_index=grid_index)
 
     def can_serialise_frame_point_cloud(self,
                                         scene_id: str,
                                         frame_id: str) -> bool:
-        path_to_save = self.__get_lidarseg_patched_folder_and_filename(frame_id)
+        if self.__packed_output is not None:
+            return not self.__packed_output.has_frame(scene_id=scene_id, frame_id=frame_id)
+
+        path_to_save = self.__get_output_path(scene_id=scene_id, frame_id=frame_id)
 
         # We can serialise point cloud if there is no point cloud saved.
         return not os.path.exists(path_to_save)
 
+    def get_serialised_frame_ids(self, scene_id: str) -> set:
+        if self.__packed_output is not None:
+            return self.__packed_output.get_frame_ids(scene_id=scene_id)
+
+        frame_paths = {frame_id: self.__get_output_path(scene_id=scene_id, frame_id=frame_id)
+                       for frame_id, _ in self.get_scene_iterator(scene_id=scene_id)}
+        existing_paths = filter_existing_files(list(frame_paths.values()))
+        return {frame_id for frame_id, path in frame_paths.items() if path in existing_paths}
+
+    def get_frames_count(self, scene_id: str) -> int:
+        assert scene_id in self.__scenes_lookup
+
+        return self.__scenes_lookup[scene_id]['nbr_samples']
+
+    def flush_serialised_frames(self, scene_id: str):
+        if self.__packed_output is not None:
+            self.__packed_output.flush(scene_id=scene_id)
+
     def serialise_frame_point_clouds(self,
                                      scene_id: str,
                                      frame_id: str,
-                                     frame_point_cloud: np.ndarray) -> Optional[str]:
+                                     frame_point_cloud: np.ndarray,
+                                     frame_delta: Optional[FrameDelta] = None) -> Optional[str]:
+        if self.__packed_output is not None:
+            return self.__packed_output.append_frame(scene_id=scene_id,
+                                                     frame_id=frame_id,
+                                                     point_cloud=frame_point_cloud)
+
         path_to_save = self.__get_lidarseg_patched_folder_and_filename(frame_id)
 
         dir_path = os.path.dirname(path_to_save)
@@ -61,16 +170,68 @@ class NuscenesDataset(Dataset):
         if not os.path.exists(dir_path):
             os.makedirs(dir_path)
 
+        if self.__delta_output:
+            assert frame_delta is not None, \
+                f"Delta of frame {frame_id} is required for delta output"
+            path_to_save = get_delta_path(path_to_save)
+            frame_delta.serialise(path=path_to_save)
+            return path_to_save
+
+        if self.__compact_output is not None:
+            path_to_save = get_compact_path(path_to_save)
+            self.__compact_output.serialise(path=path_to_save,
+                                            point_cloud=frame_point_cloud)
+            return path_to_save
+
         NuscenesFramePatcher.serialise(path=path_to_save,
                                        point_cloud=frame_point_cloud)
 
         return path_to_save
 
+    def get_patched_frame_point_cloud(self,
+                                      scene_id: str,
+                                      frame_id: str) -> np.ndarray:
+        if self.__packed_output is not None:
+            return self.__packed_output.get_frame_point_cloud(scene_id=scene_id,
+                                                              frame_id=frame_id,
+                                                              use_mmap=self.__use_mmap)
+
+        patched_path = self.__get_lidarseg_patched_folder_and_filename(frame_id)
+
+        if self.__delta_output:
+            frame_delta = FrameDelta.load(get_delta_path(patched_path))
+            return frame_delta.apply(self.get_frame_point_cloud(scene_id=scene_id,
+                                                                frame_id=frame_id))
+
+        if self.__compact_output is not None:
+            return load_compact_point_cloud(get_compact_path(patched_path))
+
+        # Patched frames are written with the padding 5th dimension.
+        return load_bin_point_cloud(path=patched_path,
+                                    dimensions=5,
+                                    use_mmap=self.__use_mmap)[:4, :]
+
     def get_frame_point_cloud(self,
                               scene_id: str,
                               frame_id: str) -> np.ndarray:
-        return get_frame_point_cloud(frame_id=frame_id,
-                                     nuscenes=self.__nuscenes)
+        if self.__packed_input is not None:
+            frame_point_cloud = self.__packed_input.get_frame_point_cloud(scene_id=scene_id,
+                                                                          frame_id=frame_id,
+                                                                          use_mmap=self.__use_mmap)
+        else:
+            frame_point_cloud = get_frame_point_cloud(frame_id=frame_id,
+                                                      nuscenes=self.__nuscenes,
+                                                      use_mmap=self.__use_mmap)
+
+        return as_point_cloud_dtype(frame_point_cloud, dtype=self.__point_cloud_dtype)
+
+    def get_instance_box(self,
+                         scene_id: str,
+                         frame_id: str,
+                         instance_id: str) -> tuple:
+        return get_instance_box(frame_id=frame_id,
+                                instance_id=instance_id,
+                                nuscenes=self.__nuscenes)
 
     def get_instance_point_cloud(self,
                                  scene_id: str,
@@ -82,6 +243,29 @@ class NuscenesDataset(Dataset):
                                         instance_id=instance_id,
                                         nuscenes=self.__nuscenes)
 
+    def get_instance_point_clouds(self,
+                                  scene_id: str,
+                                  frame_id: str,
+                                  instance_ids: list,
+                                  frame_point_cloud: np.ndarray,
+                                  grid_index: Optional[BevGridIndex] = None) -> dict:
+        boxes = get_instance_boxes(frame_id=frame_id,
+                                   instance_ids=instance_ids,
+                                   nuscenes=self.__nuscenes)
+        return extract_box_point_clouds(frame_point_cloud=frame_point_cloud,
+                                        boxes=boxes,
+                                        grid_index=grid_index)
+
+    def __get_output_path(self,
+                          scene_id: str,
+                          frame_id: str) -> str:
+        path_to_save = self.__get_lidarseg_patched_folder_and_filename(frame_id)
+        if self.__delta_output:
+            return get_delta_path(path_to_save)
+        elif self.__compact_output is not None:
+            return get_compact_path(path_to_save)
+        return path_to_save
+
     def __get_lidarseg_patched_folder_and_filename(self, frame_id: str):
         frame = self.__nuscenes.get('sample', frame_id)
         lidarseg_token = frame['data']['LIDAR_TOP']
@@ -97,3 +281,19 @@ class NuscenesDataset(Dataset):
         dirname = os.path.dirname(os.path.dirname(full_path))
 
         return os.path.join(dirname, 'LIDAR_TOP_PATCHED', filename)
+
+
+class IndexedNuscenesDataset(IndexedDatasetMixin, NuscenesDataset):
+    """NuScenes dataset with scenes, instances and boxes served from a metadata index.
+
+    See build_metadata_index.py.
+    """
+
+    def __init__(self,
+                 metadata_index_path: str,
+                 version: str = 'v1.0-mini',
+                 **kwargs):
+        super().__init__(metadata_index_path,
+                         {'dataset': 'nuscenes', 'version': version},
+                         version=version,
+                         **kwargs)
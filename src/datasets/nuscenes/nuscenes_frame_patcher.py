@@ -3,10 +3,15 @@ from __future__ import annotations
 import numpy as np
 
 from nuscenes import NuScenes
+from typing import Optional
+from nuscenes.utils.data_classes import Box
 from nuscenes.utils.geometry_utils import points_in_box
 
-from src.datasets.frame_patcher import FramePatcher
+from src.datasets.frame_delta import FrameDelta
+from src.datasets.frame_patcher import FramePatcher, assemble_patched_frame
 from src.datasets.nuscenes.nuscenes_utils import get_frame_point_cloud, reapply_scene_transformation
+from src.utils.bev_grid_index import BevGridIndex, get_patched_points_in_box_mask, get_patched_points_in_boxes_mask
+from src.utils.dtype_policy import as_point_cloud_dtype
 
 
 class NuscenesFramePatcher(FramePatcher):
@@ -16,29 +21,50 @@ class NuscenesFramePatcher(FramePatcher):
     def __init__(self,
                  frame_id: str,
                  frame_point_cloud: np.ndarray,
-                 nuscenes: NuScenes):
+                 nuscenes: NuScenes,
+                 grid_index: Optional[BevGridIndex] = None):
         self.__frame_id = frame_id
         self.__frame_point_cloud = frame_point_cloud
         self.__nuscenes = nuscenes
 
+        # Boxes are looked up in the index of the original frame.
+        self.__grid_index = grid_index
+        self.__original_frame_point_cloud = frame_point_cloud
+
+        # Index of every point in the original frame, -1 for inserted points.
+        self.__original_points_count = frame_point_cloud.shape[1]
+        self.__origin_indices = np.arange(self.__original_points_count)
+
     @classmethod
     def load(cls,
              frame_id: str,
-             nuscenes: NuScenes) -> NuscenesFramePatcher:
+             nuscenes: NuScenes,
+             use_mmap: bool = False,
+             frame_point_cloud: Optional[np.ndarray] = None,
+             grid_index: Optional[BevGridIndex] = None) -> NuscenesFramePatcher:
         """Creates NuscenesFramePatcher instance.
 
         :param frame_id: str
             ID of a frame.
         :param nuscenes: 'NuScenes'
             Default NuScenes library facade.
+        :param use_mmap: bool
+            Memory-map the frame point cloud.
+        :param frame_point_cloud: Optional[np.ndarray]
+            Already loaded frame point cloud, loaded from NuScenes if None.
+        :param grid_index: Optional[BevGridIndex]
+            Index of the given frame point cloud.
         :return: 'NuscenesFramePatcher'
             A constructed instance.
         """
-        lidar_point_cloud = get_frame_point_cloud(frame_id=frame_id,
-                                                  nuscenes=nuscenes)
+        if frame_point_cloud is None:
+            frame_point_cloud = get_frame_point_cloud(frame_id=frame_id,
+                                                      nuscenes=nuscenes,
+                                                      use_mmap=use_mmap)
         return NuscenesFramePatcher(frame_id=frame_id,
-                                    frame_point_cloud=lidar_point_cloud,
-                                    nuscenes=nuscenes)
+                                    frame_point_cloud=frame_point_cloud,
+                                    nuscenes=nuscenes,
+                                    grid_index=grid_index)
 
     @classmethod
     def serialise(cls,
@@ -66,6 +92,12 @@ class NuscenesFramePatcher(FramePatcher):
     def frame(self) -> np.ndarray:
         return self.__frame_point_cloud
 
+    @property
+    def delta(self) -> FrameDelta:
+        return FrameDelta.from_patched_frame(original_points_count=self.__original_points_count,
+                                             origin_indices=self.__origin_indices,
+                                             frame_point_cloud=self.__frame_point_cloud)
+
     def patch_instance(self,
                        instance_id: str,
                        point_cloud: np.ndarray):
@@ -90,13 +122,15 @@ class NuscenesFramePatcher(FramePatcher):
         assert len(boxes) == 1
         box = boxes[0]
 
-        points = self.__frame_point_cloud[0:3, :]
-        mask = points_in_box(box, points)
+        mask = self.__get_box_mask(box)
 
         # Remove masked elements in frame.
-        self.__frame_point_cloud = self.__frame_point_cloud[:, np.where(~mask)[0]]
+        kept_indices = np.where(~mask)[0]
+        self.__frame_point_cloud = self.__frame_point_cloud[:, kept_indices]
+        self.__origin_indices = self.__origin_indices[kept_indices]
 
-        # Put the object back into the scene.
+        # Put the object back into the scene, inserted points take the dtype of the frame.
+        point_cloud = as_point_cloud_dtype(point_cloud, dtype=self.__frame_point_cloud.dtype)
         point_cloud = reapply_scene_transformation(annotation_token=annotation_token,
                                                    lidarseg_token=lidarseg_token,
                                                    point_cloud=point_cloud,
@@ -104,3 +138,64 @@ class NuscenesFramePatcher(FramePatcher):
 
         # Append instance patch: append should happen along
         self.__frame_point_cloud = np.concatenate((self.__frame_point_cloud, point_cloud), axis=1)
+        self.__origin_indices = np.concatenate((self.__origin_indices, np.full(point_cloud.shape[1], -1)))
+
+    def patch_instances(self,
+                        instance_point_clouds: dict):
+        frame = self.__nuscenes.get('sample', self.__frame_id)
+        lidarseg_token = frame['data']['LIDAR_TOP']
+
+        # Annotations are looked up through the frame instead of scanning all annotations for every instance.
+        instance_annotations = {self.__nuscenes.get('sample_annotation', annotation_token)['instance_token']:
+                                annotation_token for annotation_token in frame['anns']}
+
+        for instance_id in instance_point_clouds.keys():
+            assert instance_id in instance_annotations, \
+                f"Frame {self.__frame_id} should have the only instance of {instance_id}"
+
+        annotation_tokens = [instance_annotations[instance_id] for instance_id in instance_point_clouds.keys()]
+        _, boxes, _ = self.__nuscenes.get_sample_data(lidarseg_token, selected_anntokens=annotation_tokens)
+
+        removal_mask = self.__get_boxes_mask(boxes)
+        inserted_point_clouds = list()
+
+        for annotation_token, point_cloud in zip(annotation_tokens, instance_point_clouds.values()):
+            # Put the object back into the scene, inserted points take the dtype of the frame.
+            point_cloud = as_point_cloud_dtype(point_cloud, dtype=self.__frame_point_cloud.dtype)
+            inserted_point_clouds.append(reapply_scene_transformation(annotation_token=annotation_token,
+                                                                      lidarseg_token=lidarseg_token,
+                                                                      point_cloud=point_cloud,
+                                                                      nuscenes=self.__nuscenes))
+
+        self.__frame_point_cloud, self.__origin_indices = \
+            assemble_patched_frame(frame_point_cloud=self.__frame_point_cloud,
+                                   origin_indices=self.__origin_indices,
+                                   removal_mask=removal_mask,
+                                   inserted_point_clouds=inserted_point_clouds)
+
+    def __get_box_mask(self, box: Box) -> np.ndarray:
+        if self.__grid_index is not None:
+            width, length, height = box.wlh
+            return get_patched_points_in_box_mask(grid_index=self.__grid_index,
+                                                  original_point_cloud=self.__original_frame_point_cloud,
+                                                  point_cloud=self.__frame_point_cloud,
+                                                  origin_indices=self.__origin_indices,
+                                                  center_xyz=box.center,
+                                                  dimensions_lwh=np.array([length, width, height]),
+                                                  rotation=box.orientation)
+
+        return points_in_box(box, self.__frame_point_cloud[0:3, :])
+
+    def __get_boxes_mask(self, boxes: list) -> np.ndarray:
+        if self.__grid_index is not None:
+            return get_patched_points_in_boxes_mask(grid_index=self.__grid_index,
+                                                    original_point_cloud=self.__original_frame_point_cloud,
+                                                    point_cloud=self.__frame_point_cloud,
+                                                    origin_indices=self.__origin_indices,
+                                                    boxes=[(box.center, np.array([box.wlh[1], box.wlh[0], box.wlh[2]]),
+                                                            box.orientation) for box in boxes])
+
+        mask = np.zeros(self.__frame_point_cloud.shape[1], dtype=bool)
+        for box in boxes:
+            mask |= points_in_box(box, self.__frame_point_cloud[0:3, :])
+        return mask
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import os
+import pickle
+import numpy as np
+
+from functools import lru_cache
+from nuscenes import NuScenes
+from nuscenes.utils.data_classes import Box
+from pyquaternion import Quaternion
+from typing import Optional
+
+# Tables used by the project, other tables are not stored in the snapshot.
+SNAPSHOT_TABLES = ['scene', 'sample', 'sample_data', 'sample_annotation', 'ego_pose', 'calibrated_sensor']
+
+# JSON tables the snapshot is derived from, category names of annotations come from instance and category.
+SOURCE_TABLES = SNAPSHOT_TABLES + ['instance', 'category']
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+class NuScenesSnapshot:
+    """Read-only subset of NuScenes tables loaded from a snapshot file.
+
+    The snapshot mimics the part of the NuScenes facade used by the project:
+    get, field2token, get_sample_data with selected annotations, scene and dataroot.
+    Only lidar key frames are kept in sample_data and ego_pose.
+
+    Tables are loaded once per process and the snapshot is pickled by path,
+    so workers do not receive copies of the tables.
+    """
+
+    def __init__(self,
+                 path: str,
+                 dataroot: str):
+        """Opens a snapshot.
+
+        :param path: str
+            Path to the snapshot, see build_nuscenes_snapshot.
+        :param dataroot: str
+            Root of the dataset.
+        """
+        self.__path = path
+        self.__dataroot = dataroot
+
+        snapshot = load_snapshot_tables(path)
+        assert snapshot['format_version'] == SNAPSHOT_FORMAT_VERSION, \
+            f"Snapshot {path} has format {snapshot['format_version']}, expected {SNAPSHOT_FORMAT_VERSION}"
+
+        self.__version = snapshot['version']
+        self.__tables = snapshot['tables']
+        self.__field_lookups = dict()
+
+    def __getstate__(self) -> dict:
+        return {'path': self.__path, 'dataroot': self.__dataroot}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state['path'], state['dataroot'])
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def version(self) -> str:
+        return self.__version
+
+    @property
+    def dataroot(self) -> str:
+        return self.__dataroot
+
+    @property
+    def scene(self) -> list:
+        return list(self.__tables['scene'].values())
+
+    def get(self,
+            table_name: str,
+            token: str) -> dict:
+        assert table_name in self.__tables, \
+            f"Table {table_name} is not stored in the snapshot"
+
+        return self.__tables[table_name][token]
+
+    def field2token(self,
+                    table_name: str,
+                    field: str,
+                    query) -> list:
+        """Returns tokens of the records with the given value of the field.
+
+        Unlike NuScenes, which scans the table on every call, the lookup of
+        the field is built on first use and answers in O(1) afterwards.
+        """
+        key = (table_name, field)
+        if key not in self.__field_lookups:
+            lookup = dict()
+            for token, record in self.__tables[table_name].items():
+                lookup.setdefault(record[field], list()).append(token)
+            self.__field_lookups[key] = lookup
+
+        return list(self.__field_lookups[key].get(query, list()))
+
+    def get_box(self, sample_annotation_token: str) -> Box:
+        record = self.get('sample_annotation', sample_annotation_token)
+        return Box(record['translation'], record['size'], Quaternion(record['rotation']),
+                   name=record['category_name'], token=record['token'])
+
+    def get_sample_data(self,
+                        sample_data_token: str,
+                        selected_anntokens: list) -> tuple:
+        """Returns path of the lidar frame and the selected boxes in its sensor coordinates.
+
+        Same as NuScenes.get_sample_data for lidar frames.
+
+        :param sample_data_token: str
+            Token of lidar sample data.
+        :param selected_anntokens: list[str]
+            Tokens of annotations to return boxes of.
+        :return: tuple[str, list[Box], None]
+            Path of the frame, boxes and camera intrinsic, which is always None.
+        """
+        sample_data_record = self.get('sample_data', sample_data_token)
+        calibrated_sensor_record = self.get('calibrated_sensor', sample_data_record['calibrated_sensor_token'])
+        ego_pose_record = self.get('ego_pose', sample_data_record['ego_pose_token'])
+
+        boxes = list()
+        for annotation_token in selected_anntokens:
+            box = self.get_box(annotation_token)
+
+            # Move the box from global coordinates to the ego vehicle and then to the sensor.
+            box.translate(-np.array(ego_pose_record['translation']))
+            box.rotate(Quaternion(ego_pose_record['rotation']).inverse)
+            box.translate(-np.array(calibrated_sensor_record['translation']))
+            box.rotate(Quaternion(calibrated_sensor_record['rotation']).inverse)
+
+            boxes.append(box)
+
+        return os.path.join(self.__dataroot, sample_data_record['filename']), boxes, None
+
+
+def build_nuscenes_snapshot(nuscenes: NuScenes,
+                            path: str):
+    """Writes tables of the loaded dataset used by the project to a snapshot.
+
+    The snapshot is written to a temporary file and moved in place,
+    so concurrent readers never see a partial snapshot.
+
+    :param nuscenes: 'NuScenes'
+        Loaded NuScenes dataset facade.
+    :param path: str
+        Path of the snapshot.
+    """
+    samples = {record['token']: record for record in nuscenes.sample}
+    lidar_tokens = {sample['data']['LIDAR_TOP'] for sample in samples.values()}
+    sample_data = {token: nuscenes.get('sample_data', token) for token in lidar_tokens}
+    ego_pose_tokens = {record['ego_pose_token'] for record in sample_data.values()}
+
+    tables = {
+        'scene': {record['token']: record for record in nuscenes.scene},
+        'sample': samples,
+        'sample_data': sample_data,
+        # Records keep category_name added by NuScenes, get_box relies on it.
+        'sample_annotation': {record['token']: record for record in nuscenes.sample_annotation},
+        'ego_pose': {token: nuscenes.get('ego_pose', token) for token in ego_pose_tokens},
+        'calibrated_sensor': {record['token']: record for record in nuscenes.calibrated_sensor},
+    }
+
+    snapshot = {
+        'format_version': SNAPSHOT_FORMAT_VERSION,
+        'version': nuscenes.version,
+        'source_stat': get_source_stat(dataroot=nuscenes.dataroot, version=nuscenes.version),
+        'tables': tables,
+    }
+
+    dir_path = os.path.dirname(path)
+    if len(dir_path) > 0:
+        os.makedirs(dir_path, exist_ok=True)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as file:
+        pickle.dump(snapshot, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def load_nuscenes_snapshot(version: str,
+                           dataroot: str,
+                           path: str) -> NuScenesSnapshot:
+    """Opens the snapshot, building it from the JSON tables if it is missing or outdated.
+
+    A snapshot is outdated if any of its source tables has changed.
+    Snapshots are trusted as is when the JSON tables are not available.
+
+    :param version: str
+        Version of the dataset.
+    :param dataroot: str
+        Root of the dataset.
+    :param path: str
+        Path of the snapshot.
+    :return: NuScenesSnapshot
+        Opened snapshot.
+    """
+    if not __is_snapshot_valid(version=version, dataroot=dataroot, path=path):
+        nuscenes = NuScenes(version=version, dataroot=dataroot, verbose=True)
+        build_nuscenes_snapshot(nuscenes=nuscenes, path=path)
+
+    return NuScenesSnapshot(path=path, dataroot=dataroot)
+
+
+@lru_cache(maxsize=2)
+def load_nuscenes(version: str,
+                  dataroot: str,
+                  snapshot_path: Optional[str] = None) -> NuScenes:
+    """Returns NuScenes tables, they are loaded once per process.
+
+    Datasets sent to workers without their tables load them here on first use.
+
+    :param version: str
+        Version of the dataset.
+    :param dataroot: str
+        Root of the dataset.
+    :param snapshot_path: Optional[str]
+        Path of the snapshot, see load_nuscenes_snapshot, JSON tables are parsed if None.
+    :return: NuScenes
+        NuScenes or NuScenesSnapshot with the same interface.
+    """
+    if snapshot_path is not None:
+        return load_nuscenes_snapshot(version=version, dataroot=dataroot, path=snapshot_path)
+
+    return NuScenes(version=version, dataroot=dataroot, verbose=True)
+
+
+def load_snapshot_tables(path: str) -> dict:
+    """Returns the snapshot, it is read once per process unless the file changes.
+    """
+    return __read_snapshot(path, os.stat(path).st_mtime_ns)
+
+
+def get_source_stat(dataroot: str,
+                    version: str) -> dict:
+    stat = dict()
+    for table_name in SOURCE_TABLES:
+        table_path = os.path.join(dataroot, version, f"{table_name}.json")
+        if os.path.exists(table_path):
+            table_stat = os.stat(table_path)
+            stat[table_name] = (table_stat.st_size, table_stat.st_mtime_ns)
+    return stat
+
+
+@lru_cache(maxsize=2)
+def __read_snapshot(path: str,
+                    mtime_ns: int) -> dict:
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+def __is_snapshot_valid(version: str,
+                        dataroot: str,
+                        path: str) -> bool:
+    if not os.path.exists(path):
+        return False
+
+    snapshot = load_snapshot_tables(path)
+    if snapshot['format_version'] != SNAPSHOT_FORMAT_VERSION or snapshot['version'] != version:
+        return False
+
+    source_stat = get_source_stat(dataroot=dataroot, version=version)
+    return len(source_stat) == 0 or source_stat == snapshot['source_stat']
@@ -7,6 +7,9 @@ from nuscenes.utils.geometry_utils import points_in_box
 from pyquaternion import Quaternion
 from nuscenes.utils.geometry_utils import transform_matrix
 
+from src.utils.point_cloud_io import load_bin_point_cloud
+from src.utils.rigid_transform import apply_rigid_transform, compose_transforms
+
 
 def get_instance_point_cloud(frame_id: str,
                              frame_point_cloud: np.ndarray,
@@ -32,17 +35,9 @@ def get_instance_point_cloud(frame_id: str,
     frame = nuscenes.get('sample', frame_id)
     lidarseg_token = frame['data']['LIDAR_TOP']
 
-    frame_annotations_lookup: set = set(frame['anns'])
-
-    instance_annotations_lookup: set = \
-        set(nuscenes.field2token('sample_annotation', 'instance_token', instance_id))
-
-    intersection = list(set.intersection(frame_annotations_lookup, instance_annotations_lookup))
-
-    assert len(intersection) == 1, \
-        f"Frame {frame_id} should have the only instance of {instance_id}"
-
-    annotation_token = intersection[0]
+    annotation_token = __find_annotation_token(frame_id=frame_id,
+                                               instance_id=instance_id,
+                                               nuscenes=nuscenes)
 
     _, boxes, _ = nuscenes.get_sample_data(lidarseg_token, selected_anntokens=[annotation_token])
 
@@ -68,40 +63,121 @@ def get_instance_point_cloud(frame_id: str,
     point_cloud_to_ego_transformation = transform_matrix(np.array(calibrated_sensor_record['translation']),
                                                          Quaternion(calibrated_sensor_record['rotation']),
                                                          inverse=False)
-    instance_point_cloud = __apply_transformation_matrix(point_cloud=instance_point_cloud,
-                                                         transformation_matrix=point_cloud_to_ego_transformation)
 
     # Second step: transform from vehicle ego basis to the global basis.
     ego_pose_record = nuscenes.get('ego_pose', lidarseg_record['ego_pose_token'])
     ego_to_global_transformation = transform_matrix(np.array(ego_pose_record['translation']),
                                                     Quaternion(ego_pose_record['rotation']),
                                                     inverse=False)
-    instance_point_cloud = __apply_transformation_matrix(point_cloud=instance_point_cloud,
-                                                         transformation_matrix=ego_to_global_transformation)
 
     # Third step: reset object global transformation to identity rotation and translation.
     identity_transformation = transform_matrix(annotation['translation'],
                                                Quaternion(annotation['rotation']),
                                                inverse=True)
-    instance_point_cloud = __apply_transformation_matrix(point_cloud=instance_point_cloud,
-                                                         transformation_matrix=identity_transformation)
+
+    # Steps are composed in float64 and applied to the points at once.
+    instance_point_cloud = apply_rigid_transform(point_cloud=instance_point_cloud,
+                                                 transformation_matrix=compose_transforms(
+                                                     point_cloud_to_ego_transformation,
+                                                     ego_to_global_transformation,
+                                                     identity_transformation))
 
     return instance_point_cloud
 
 
-def get_frame_point_cloud(frame_id: str,
-                          nuscenes: NuScenes) -> np.ndarray:
+def get_instance_box(frame_id: str,
+                     instance_id: str,
+                     nuscenes: NuScenes) -> tuple:
+    """Returns box of the instance in lidar coordinates of the frame.
+
+    :param frame_id: str
+        ID of a frame (aka sample).
+    :param instance_id: str
+        ID of an instance.
+    :param nuscenes: 'NuScenes'
+        NuScenes dataset facade.
+    :return: tuple[np.ndarray, np.ndarray, Quaternion]
+        Center, length-width-height and rotation of the box.
+    """
+    frame = nuscenes.get('sample', frame_id)
+    lidarseg_token = frame['data']['LIDAR_TOP']
+
+    annotation_token = __find_annotation_token(frame_id=frame_id,
+                                               instance_id=instance_id,
+                                               nuscenes=nuscenes)
+
+    _, boxes, _ = nuscenes.get_sample_data(lidarseg_token, selected_anntokens=[annotation_token])
+
+    assert len(boxes) == 1
+    box = boxes[0]
+
+    width, length, height = box.wlh
+    return np.array(box.center), np.array([length, width, height]), box.orientation
+
+
+def get_instance_boxes(frame_id: str,
+                       instance_ids: list,
+                       nuscenes: NuScenes) -> dict:
+    """Returns boxes of the instances in lidar coordinates of the frame.
+
+    Annotations are looked up through the frame, so it does not scan
+    all annotations of the dataset for every instance.
+
+    :param frame_id: str
+        ID of a frame (aka sample).
+    :param instance_ids: list[str]
+        IDs of instances.
+    :param nuscenes: 'NuScenes'
+        NuScenes dataset facade.
+    :return: dict[str, tuple[np.ndarray, np.ndarray, Quaternion]]
+        Pairs of instance id to center, length-width-height and rotation of its box.
     """
+    frame = nuscenes.get('sample', frame_id)
+    lidarseg_token = frame['data']['LIDAR_TOP']
+
+    instance_annotations = {nuscenes.get('sample_annotation', annotation_token)['instance_token']: annotation_token
+                            for annotation_token in frame['anns']}
+
+    for instance_id in instance_ids:
+        assert instance_id in instance_annotations, \
+            f"Frame {frame_id} should have the only instance of {instance_id}"
+
+    _, boxes, _ = nuscenes.get_sample_data(lidarseg_token,
+                                           selected_anntokens=[instance_annotations[instance_id]
+                                                               for instance_id in instance_ids])
 
-    :param frame_id:
-    :param nuscenes:
-    :return:
+    instance_boxes = dict()
+    for instance_id, box in zip(instance_ids, boxes):
+        width, length, height = box.wlh
+        instance_boxes[instance_id] = np.array(box.center), np.array([length, width, height]), box.orientation
+    return instance_boxes
+
+
+def get_frame_point_cloud(frame_id: str,
+                          nuscenes: NuScenes,
+                          use_mmap: bool = False) -> np.ndarray:
+    """Loads lidar point cloud of the frame.
+
+    :param frame_id: str
+        ID of a frame (aka sample).
+    :param nuscenes: 'NuScenes'
+        NuScenes dataset facade.
+    :param use_mmap: bool
+        Memory-map the file, the result is a read-only view.
+    :return: np.ndarray[float]
+        Point cloud of shape 4xn.
     """
     frame = nuscenes.get('sample', frame_id)
     lidarseg_token = frame['data']['LIDAR_TOP']
     lidarseg = nuscenes.get('sample_data', lidarseg_token)
 
-    lidar_point_cloud = LidarPointCloud.from_file(os.path.join(nuscenes.dataroot, lidarseg['filename']))
+    lidar_path = os.path.join(nuscenes.dataroot, lidarseg['filename'])
+
+    if use_mmap:
+        # Same layout as LidarPointCloud.from_file: nx5 floats, the last one is dropped.
+        return load_bin_point_cloud(lidar_path, dimensions=5, use_mmap=True)[:LidarPointCloud.nbr_dims(), :]
+
+    lidar_point_cloud = LidarPointCloud.from_file(lidar_path)
     return lidar_point_cloud.points
 
 
@@ -116,40 +192,42 @@ def reapply_scene_transformation(annotation_token: str,
     identity_to_global_transformation = transform_matrix(annotation['translation'],
                                                          Quaternion(annotation['rotation']),
                                                          inverse=False)
-    instance_point_cloud = __apply_transformation_matrix(point_cloud=point_cloud,
-                                                         transformation_matrix=identity_to_global_transformation)
 
     # Second step: transform from global to vehicle ego basis.
     ego_pose_record = nuscenes.get('ego_pose', lidarseg_record['ego_pose_token'])
     global_to_ego_transformation = transform_matrix(np.array(ego_pose_record['translation']),
                                                     Quaternion(ego_pose_record['rotation']),
                                                     inverse=True)
-    instance_point_cloud = __apply_transformation_matrix(point_cloud=instance_point_cloud,
-                                                         transformation_matrix=global_to_ego_transformation)
 
     # Third step: transform ego vehicle to the sensor basis.
     calibrated_sensor_record = nuscenes.get('calibrated_sensor', lidarseg_record['calibrated_sensor_token'])
     ego_to_sensor_transformation = transform_matrix(np.array(calibrated_sensor_record['translation']),
                                                     Quaternion(calibrated_sensor_record['rotation']),
                                                     inverse=True)
-    instance_point_cloud = __apply_transformation_matrix(point_cloud=instance_point_cloud,
-                                                         transformation_matrix=ego_to_sensor_transformation)
+
+    # Steps are composed in float64 and applied to the points at once.
+    instance_point_cloud = apply_rigid_transform(point_cloud=point_cloud,
+                                                 transformation_matrix=compose_transforms(
+                                                     identity_to_global_transformation,
+                                                     global_to_ego_transformation,
+                                                     ego_to_sensor_transformation))
 
     return instance_point_cloud
 
 
-def __apply_transformation_matrix(point_cloud: np.ndarray,
-                                  transformation_matrix: np.ndarray) -> np.ndarray:
-    """Applies given transformation matrix to the given point cloud.
+def __find_annotation_token(frame_id: str,
+                            instance_id: str,
+                            nuscenes: NuScenes) -> str:
+    frame = nuscenes.get('sample', frame_id)
 
-    :param point_cloud: np.ndarray[float]
-        Point cloud to transform.
-    :param transformation_matrix: np.ndarray[float]
-        Transformation matrix that describes rotation and translation.
-    :return: np.ndarray[float]
-        Modified point cloud.
-    """
-    points_count = point_cloud.shape[1]
-    point_cloud[:3, :] = transformation_matrix.dot(
-        np.vstack((point_cloud[:3, :], np.ones(points_count))))[:3, :]
-    return point_cloud
+    frame_annotations_lookup: set = set(frame['anns'])
+
+    instance_annotations_lookup: set = \
+        set(nuscenes.field2token('sample_annotation', 'instance_token', instance_id))
+
+    intersection = list(set.intersection(frame_annotations_lookup, instance_annotations_lookup))
+
+    assert len(intersection) == 1, \
+        f"Frame {frame_id} should have the only instance of {instance_id}"
+
+    return intersection[0]
@@ -7,10 +7,20 @@ import numpy as np
 from typing import Optional
 
 from src.datasets.dataset import Dataset
+from src.datasets.compact_frame import CompactFrameFormat, get_compact_path, load_compact_point_cloud
+from src.datasets.frame_delta import FrameDelta, get_delta_path
 from src.datasets.frame_patcher import FramePatcher
 from src.datasets.once.once_scene_iterator import OnceSceneIterator
 from src.datasets.once.once_frame_patcher import OnceFramePatcher
-from src.datasets.once.once_utils import ONCE, get_instance_point_cloud
+from src.datasets.metadata_index import IndexedDatasetMixin
+from src.datasets.once.once_utils import ONCE, get_instance_box, get_instance_boxes, get_instance_point_cloud, \
+    get_frame_ids_for_scene
+from src.utils.bev_grid_index import BevGridIndex
+from src.utils.packed_archive import PackedArchiveCollection
+from src.utils.dtype_policy import DEFAULT_POINT_CLOUD_DTYPE, as_point_cloud_dtype
+from src.utils.file_utils import filter_existing_files
+from src.utils.geometry_utils import extract_box_point_clouds
+from src.utils.point_cloud_io import load_bin_point_cloud
 
 
 class OnceDataset(Dataset):
@@ -32,12 +42,69 @@ class OnceDataset(Dataset):
 
     def __init__(self,
                  dataset_root: str,
-                 split: str):
+                 split: str,
+                 use_mmap: bool = False,
+                 packed_root: Optional[str] = None,
+                 packed_output_root: Optional[str] = None,
+                 delta_output: bool = False,
+                 compact_output: Optional[CompactFrameFormat] = None,
+                 point_cloud_dtype: np.dtype = DEFAULT_POINT_CLOUD_DTYPE,
+                 track_instances: bool = False):
+        """Creates ONCE dataset.
+
+        :param dataset_root: str
+            Root of the dataset.
+        :param split: str
+            Split of the dataset.
+        :param use_mmap: bool
+            Memory-map frame point clouds instead of reading them,
+            loaded frames are read-only views.
+        :param packed_root: Optional[str]
+            Folder with packed scene archives to read frames from, see pack_scenes.py.
+        :param packed_output_root: Optional[str]
+            Folder to write patched frames to as packed scene archives.
+        :param delta_output: bool
+            Write only removed point indices and inserted points of patched frames,
+            see FrameDelta.
+        :param compact_output: Optional[CompactFrameFormat]
+            Write patched frames quantised in the given format.
+        :param point_cloud_dtype: np.dtype
+            Dtype frames are converted to on loading, see src.utils.dtype_policy.
+        :param track_instances: bool
+            Assign instance ids from the JSON annotations with the online tracker
+            instead of reading the pickles written by track_once.py.
+        """
         self.__dataset_root = dataset_root
         self.__scenes_root = os.path.join(self.__dataset_root, 'data')
+        self.__split = split
+        self.__track_instances = track_instances
+        self.__use_mmap = use_mmap
+        self.__packed_input = PackedArchiveCollection(packed_root) if packed_root is not None else None
+        self.__packed_output = PackedArchiveCollection(packed_output_root) if packed_output_root is not None else None
+        self.__delta_output = delta_output
+        self.__compact_output = compact_output
+        self.__point_cloud_dtype = np.dtype(point_cloud_dtype)
+
+        assert [delta_output, packed_output_root is not None, compact_output is not None].count(True) <= 1, \
+            "Only one of delta, packed and compact outputs can be used"
 
-        self.__once = ONCE(self.__dataset_root, self.__scenes_root, split)
-        self.__scene_ids = self.__once.get_scenes_in_split(split)
+        # Split lists are read on first use, see __once.
+        self.__once_instance = None
+        self.__split_scene_ids = None
+
+    @property
+    def __once(self) -> ONCE:
+        if self.__once_instance is None:
+            self.__once_instance = ONCE(self.__dataset_root, self.__scenes_root, self.__split,
+                                        use_mmap=self.__use_mmap,
+                                        track_instances=self.__track_instances)
+        return self.__once_instance
+
+    @property
+    def __scene_ids(self) -> list:
+        if self.__split_scene_ids is None:
+            self.__split_scene_ids = self.__once.get_scenes_in_split(self.__split)
+        return self.__split_scene_ids
 
     @property
     def dataroot(self) -> str:
@@ -47,6 +114,10 @@ class OnceDataset(Dataset):
     def scenes(self) -> list:
         return list(self.__scene_ids)
 
+    @property
+    def point_cloud_dtype(self) -> np.dtype:
+        return self.__point_cloud_dtype
+
     def get_scene_iterator(self, scene_id: str) -> Dataset.SceneIterator:
         assert scene_id in self.__scene_ids, \
             f"Unknown scene id {scene_id}"
@@ -56,26 +127,53 @@ class OnceDataset(Dataset):
 
     def load_frame_patcher(self,
                            scene_id: str,
-                           frame_id: str) -> FramePatcher:
+                           frame_id: str,
+                           frame_point_cloud: Optional[np.ndarray] = None,
+                           grid_index: Optional[BevGridIndex] = None) -> FramePatcher:
         assert scene_id in self.__scene_ids, \
             f"Unknown scene id {scene_id}"
 
+        if frame_point_cloud is None:
+            frame_point_cloud = self.get_frame_point_cloud(scene_id=scene_id,
+                                                           frame_id=frame_id)
+
         return OnceFramePatcher.load(scene_id=scene_id,
                                      frame_id=frame_id,
-                                     once=self.__once)
+                                     once=self.__once,
+                                     frame_point_cloud=frame_point_cloud,
+                                     grid_index=grid_index)
 
     def serialise_frame_point_clouds(self,
                                      scene_id: str,
                                      frame_id: str,
-                                     frame_point_cloud: np.ndarray) -> Optional[str]:
+                                     frame_point_cloud: np.ndarray,
+                                     frame_delta: Optional[FrameDelta] = None) -> Optional[str]:
         assert scene_id in self.__scene_ids, \
             f"Unknown scene id {scene_id}"
 
+        if self.__packed_output is not None:
+            return self.__packed_output.append_frame(scene_id=scene_id,
+                                                     frame_id=frame_id,
+                                                     point_cloud=frame_point_cloud)
+
         path_to_save = self.__get_patched_folder_and_filename(scene_id, frame_id)
 
         dir_path = os.path.dirname(path_to_save)
         os.makedirs(dir_path, exist_ok=True)
 
+        if self.__delta_output:
+            assert frame_delta is not None, \
+                f"Delta of frame {frame_id} is required for delta output"
+            path_to_save = get_delta_path(path_to_save)
+            frame_delta.serialise(path=path_to_save)
+            return path_to_save
+
+        if self.__compact_output is not None:
+            path_to_save = get_compact_path(path_to_save)
+            self.__compact_output.serialise(path=path_to_save,
+                                            point_cloud=frame_point_cloud)
+            return path_to_save
+
         OnceFramePatcher.serialise(path=path_to_save,
                                    point_cloud=frame_point_cloud)
 
@@ -87,19 +185,89 @@ class OnceDataset(Dataset):
         assert scene_id in self.__scene_ids, \
             f"Unknown scene id {scene_id}"
 
-        path_to_save = self.__get_patched_folder_and_filename(scene_id, frame_id)
+        if self.__packed_output is not None:
+            return not self.__packed_output.has_frame(scene_id=scene_id, frame_id=frame_id)
+
+        path_to_save = self.__get_output_path(scene_id=scene_id, frame_id=frame_id)
 
         # We can serialise point cloud if there is no point cloud saved.
         return not os.path.exists(path_to_save)
 
+    def get_serialised_frame_ids(self, scene_id: str) -> set:
+        assert scene_id in self.__scene_ids, \
+            f"Unknown scene id {scene_id}"
+
+        if self.__packed_output is not None:
+            return self.__packed_output.get_frame_ids(scene_id=scene_id)
+
+        frame_paths = {frame_id: self.__get_output_path(scene_id=scene_id, frame_id=frame_id)
+                       for frame_id, _ in self.get_scene_iterator(scene_id=scene_id)}
+        existing_paths = filter_existing_files(list(frame_paths.values()))
+        return {frame_id for frame_id, path in frame_paths.items() if path in existing_paths}
+
+    def get_frames_count(self, scene_id: str) -> int:
+        assert scene_id in self.__scene_ids, \
+            f"Unknown scene id {scene_id}"
+
+        # Frames are listed in the lidar folder without loading or tracking annotations.
+        return len(get_frame_ids_for_scene(once=self.__once, scene_id=scene_id))
+
+    def flush_serialised_frames(self, scene_id: str):
+        if self.__packed_output is not None:
+            self.__packed_output.flush(scene_id=scene_id)
+
+    def get_patched_frame_point_cloud(self,
+                                      scene_id: str,
+                                      frame_id: str) -> np.ndarray:
+        assert scene_id in self.__scene_ids, \
+            f"Unknown scene id {scene_id}"
+
+        if self.__packed_output is not None:
+            return self.__packed_output.get_frame_point_cloud(scene_id=scene_id,
+                                                              frame_id=frame_id,
+                                                              use_mmap=self.__use_mmap)
+
+        patched_path = self.__get_patched_folder_and_filename(scene_id, frame_id)
+
+        if self.__delta_output:
+            frame_delta = FrameDelta.load(get_delta_path(patched_path))
+            return frame_delta.apply(self.get_frame_point_cloud(scene_id=scene_id,
+                                                                frame_id=frame_id))
+
+        if self.__compact_output is not None:
+            return load_compact_point_cloud(get_compact_path(patched_path))
+
+        return load_bin_point_cloud(path=patched_path,
+                                    dimensions=4,
+                                    use_mmap=self.__use_mmap)
+
     def get_frame_point_cloud(self,
                               scene_id: str,
                               frame_id: str) -> np.ndarray:
         assert scene_id in self.__scene_ids, \
             f"Unknown scene id {scene_id}"
 
-        return self.__once.get_frame_point_cloud(scene_id=scene_id,
-                                                 frame_id=frame_id)
+        if self.__packed_input is not None:
+            frame_point_cloud = self.__packed_input.get_frame_point_cloud(scene_id=scene_id,
+                                                                          frame_id=frame_id,
+                                                                          use_mmap=self.__use_mmap)
+        else:
+            frame_point_cloud = self.__once.get_frame_point_cloud(scene_id=scene_id,
+                                                                  frame_id=frame_id)
+
+        return as_point_cloud_dtype(frame_point_cloud, dtype=self.__point_cloud_dtype)
+
+    def get_instance_box(self,
+                         scene_id: str,
+                         frame_id: str,
+                         instance_id: str) -> tuple:
+        assert scene_id in self.__scene_ids, \
+            f"Unknown scene id {scene_id}"
+
+        return get_instance_box(seq_id=scene_id,
+                                frame_id=frame_id,
+                                instance_id=instance_id,
+                                once=self.__once)
 
     def get_instance_point_cloud(self,
                                  scene_id: str,
@@ -115,7 +283,54 @@ class OnceDataset(Dataset):
                                         frame_point_cloud=frame_point_cloud,
                                         once=self.__once)
 
+    def get_instance_point_clouds(self,
+                                  scene_id: str,
+                                  frame_id: str,
+                                  instance_ids: list,
+                                  frame_point_cloud: np.ndarray,
+                                  grid_index: Optional[BevGridIndex] = None) -> dict:
+        assert scene_id in self.__scene_ids, \
+            f"Unknown scene id {scene_id}"
+
+        boxes = get_instance_boxes(seq_id=scene_id,
+                                   frame_id=frame_id,
+                                   instance_ids=instance_ids,
+                                   once=self.__once)
+        return extract_box_point_clouds(frame_point_cloud=frame_point_cloud,
+                                        boxes=boxes,
+                                        grid_index=grid_index)
+
+    def __get_output_path(self,
+                          scene_id: str,
+                          frame_id: str) -> str:
+        path_to_save = self.__get_patched_folder_and_filename(scene_id, frame_id)
+        if self.__delta_output:
+            return get_delta_path(path_to_save)
+        elif self.__compact_output is not None:
+            return get_compact_path(path_to_save)
+        return path_to_save
+
     def __get_patched_folder_and_filename(self, scene_id: str, frame_id: str):
         patched_filename = f"{frame_id}.bin"
         patched_folder = os.path.join(self.__dataset_root, 'data', 'patched', scene_id, 'lidar_roof')
         return os.path.join(patched_folder, patched_filename)
+
+
+class IndexedOnceDataset(IndexedDatasetMixin, OnceDataset):
+    """ONCE dataset with scenes, instances and boxes served from a metadata index.
+
+    See build_metadata_index.py.
+    """
+
+    def __init__(self,
+                 metadata_index_path: str,
+                 dataset_root: str,
+                 split: str,
+                 track_instances: bool = False,
+                 **kwargs):
+        super().__init__(metadata_index_path,
+                         {'dataset': 'once', 'split': split, 'track_instances': track_instances},
+                         dataset_root=dataset_root,
+                         split=split,
+                         track_instances=track_instances,
+                         **kwargs)
@@ -2,9 +2,15 @@ from __future__ import annotations
 
 import numpy as np
 
+from pyquaternion import Quaternion
+from typing import Optional
+
 from src.datasets.once.once_utils import ONCE
-from src.datasets.frame_patcher import FramePatcher
-from src.datasets.once.once_utils import reapply_frame_transformation, get_frame_instance_ids, get_pickle_data, build_frame_id_to_annotations_lookup
+from src.datasets.frame_delta import FrameDelta
+from src.datasets.frame_patcher import FramePatcher, assemble_patched_frame
+from src.datasets.once.once_utils import reapply_frame_transformation, get_frame_instance_ids
+from src.utils.bev_grid_index import BevGridIndex, get_patched_points_in_box_mask, get_patched_points_in_boxes_mask
+from src.utils.dtype_policy import as_point_cloud_dtype
 from src.utils.geometry_utils import points_in_box
 
 
@@ -16,20 +22,30 @@ class OnceFramePatcher(FramePatcher):
                  sсene_id: str,
                  frame_id: str,
                  frame_point_cloud: np.ndarray,
-                 once: ONCE):
+                 once: ONCE,
+                 grid_index: Optional[BevGridIndex] = None):
         self.__scene_id = sсene_id
         self.__frame_id = frame_id
         self.__frame_point_cloud = frame_point_cloud
         self.__once = once
 
-        self.__pickle_data = get_pickle_data(self.__once.dataset_root, self.__scene_id)
-        self.__frame_id_to_annotations_lookup = build_frame_id_to_annotations_lookup(self.__pickle_data)
+        # Boxes are looked up in the index of the original frame.
+        self.__grid_index = grid_index
+        self.__original_frame_point_cloud = frame_point_cloud
+
+        # Index of every point in the original frame, -1 for inserted points.
+        self.__original_points_count = frame_point_cloud.shape[1]
+        self.__origin_indices = np.arange(self.__original_points_count)
+
+        self.__frame_id_to_annotations_lookup = self.__once.get_frame_annotations_lookup(self.__scene_id)
 
     @classmethod
     def load(cls,
              scene_id: str,
              frame_id: str,
-             once: ONCE) -> OnceFramePatcher:
+             once: ONCE,
+             frame_point_cloud: Optional[np.ndarray] = None,
+             grid_index: Optional[BevGridIndex] = None) -> OnceFramePatcher:
         """Creates OnceFramePatcher instance.
         :param scene_id: str
             ID of a scene.
@@ -37,15 +53,21 @@ class OnceFramePatcher(FramePatcher):
             ID of a frame.
         :param once: 'ONCE'
             ONCE dataset class.
+        :param frame_point_cloud: Optional[np.ndarray]
+            Already loaded frame point cloud, loaded from ONCE if None.
+        :param grid_index: Optional[BevGridIndex]
+            Index of the given frame point cloud.
         :return: 'OnceFramePatcher'
             A constructed instance.
         """
-        frame_point_cloud = once.get_frame_point_cloud(scene_id=scene_id,
-                                                       frame_id=frame_id)
+        if frame_point_cloud is None:
+            frame_point_cloud = once.get_frame_point_cloud(scene_id=scene_id,
+                                                           frame_id=frame_id)
         return OnceFramePatcher(sсene_id=scene_id,
                                 frame_id=frame_id,
                                 frame_point_cloud=frame_point_cloud,
-                                once=once)
+                                once=once,
+                                grid_index=grid_index)
 
     @classmethod
     def serialise(cls,
@@ -57,7 +79,8 @@ class OnceFramePatcher(FramePatcher):
         if not path.endswith('.bin'):
             raise Exception(f"Supports only bin files, got: {path}")
 
-        point_cloud.T.astype(dtype=np.float32).tofile(path)
+        # Frames already in float32 are written without a copy.
+        np.asarray(point_cloud.T, dtype=np.float32).tofile(path)
 
     @property
     def frame_id(self) -> str:
@@ -67,6 +90,12 @@ class OnceFramePatcher(FramePatcher):
     def frame(self) -> np.ndarray:
         return self.__frame_point_cloud
 
+    @property
+    def delta(self) -> FrameDelta:
+        return FrameDelta.from_patched_frame(original_points_count=self.__original_points_count,
+                                             origin_indices=self.__origin_indices,
+                                             frame_point_cloud=self.__frame_point_cloud)
+
     def patch_instance(self,
                        instance_id: str,
                        point_cloud: np.ndarray):
@@ -82,17 +111,17 @@ class OnceFramePatcher(FramePatcher):
         dimensions_lwh = np.array([box[3], box[4], box[5]])
         heading_angle = box[6]
 
-        points = self.__frame_point_cloud[0:3, :]
-        mask = points_in_box(center_xyz=center_xyz,
-                             dimensions_lwh=dimensions_lwh,
-                             heading_angle=heading_angle,
-                             points=points)
+        mask = self.__get_box_mask(center_xyz=center_xyz,
+                                   dimensions_lwh=dimensions_lwh,
+                                   heading_angle=heading_angle)
 
         # Remove masked elements in frame.
-        self.__frame_point_cloud = self.__frame_point_cloud[:, np.where(~mask)[
-            0]]
+        kept_indices = np.where(~mask)[0]
+        self.__frame_point_cloud = self.__frame_point_cloud[:, kept_indices]
+        self.__origin_indices = self.__origin_indices[kept_indices]
 
-        # Put the object back into the scene.
+        # Put the object back into the scene, inserted points take the dtype of the frame.
+        point_cloud = as_point_cloud_dtype(point_cloud, dtype=self.__frame_point_cloud.dtype)
         point_cloud = reapply_frame_transformation(point_cloud=point_cloud,
                                                    frame_descriptor=frame_descriptor,
                                                    instance_id=instance_id,
@@ -102,3 +131,66 @@ class OnceFramePatcher(FramePatcher):
         if point_cloud.size != 0:
             self.__frame_point_cloud = np.concatenate(
                 (self.__frame_point_cloud, point_cloud), axis=1)
+            self.__origin_indices = np.concatenate(
+                (self.__origin_indices, np.full(point_cloud.shape[1], -1)))
+
+    def patch_instances(self,
+                        instance_point_clouds: dict):
+        frame_descriptor = self.__frame_id_to_annotations_lookup[self.__frame_id]
+        annotations = frame_descriptor['annos']
+
+        ids = annotations['instance_ids']
+        boxes = annotations['boxes_3d']
+
+        removal_mask = self.__get_boxes_mask([boxes[ids.index(instance_id)]
+                                              for instance_id in instance_point_clouds.keys()])
+        inserted_point_clouds = list()
+
+        for instance_id, point_cloud in instance_point_clouds.items():
+            # Put the object back into the scene, inserted points take the dtype of the frame.
+            point_cloud = as_point_cloud_dtype(point_cloud, dtype=self.__frame_point_cloud.dtype)
+            inserted_point_clouds.append(reapply_frame_transformation(point_cloud=point_cloud,
+                                                                      frame_descriptor=frame_descriptor,
+                                                                      instance_id=instance_id,
+                                                                      once=self.__once))
+
+        self.__frame_point_cloud, self.__origin_indices = \
+            assemble_patched_frame(frame_point_cloud=self.__frame_point_cloud,
+                                   origin_indices=self.__origin_indices,
+                                   removal_mask=removal_mask,
+                                   inserted_point_clouds=inserted_point_clouds)
+
+    def __get_box_mask(self,
+                       center_xyz: np.ndarray,
+                       dimensions_lwh: np.ndarray,
+                       heading_angle: float) -> np.ndarray:
+        if self.__grid_index is not None:
+            return get_patched_points_in_box_mask(grid_index=self.__grid_index,
+                                                  original_point_cloud=self.__original_frame_point_cloud,
+                                                  point_cloud=self.__frame_point_cloud,
+                                                  origin_indices=self.__origin_indices,
+                                                  center_xyz=center_xyz,
+                                                  dimensions_lwh=dimensions_lwh,
+                                                  rotation=Quaternion(angle=heading_angle, axis=[0, 0, 1]))
+
+        return points_in_box(center_xyz=center_xyz,
+                             dimensions_lwh=dimensions_lwh,
+                             heading_angle=heading_angle,
+                             points=self.__frame_point_cloud[0:3, :])
+
+    def __get_boxes_mask(self, boxes: list) -> np.ndarray:
+        if self.__grid_index is not None:
+            return get_patched_points_in_boxes_mask(grid_index=self.__grid_index,
+                                                    original_point_cloud=self.__original_frame_point_cloud,
+                                                    point_cloud=self.__frame_point_cloud,
+                                                    origin_indices=self.__origin_indices,
+                                                    boxes=[(box[0:3], np.array([box[3], box[4], box[5]]),
+                                                            Quaternion(angle=box[6], axis=[0, 0, 1])) for box in boxes])
+
+        mask = np.zeros(self.__frame_point_cloud.shape[1], dtype=bool)
+        for box in boxes:
+            mask |= self.__get_box_mask(center_xyz=box[0:3],
+                                        dimensions_lwh=np.array([box[3], box[4], box[5]]),
+                                        heading_angle=box[6])
+        return mask
+
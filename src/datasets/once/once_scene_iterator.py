@@ -3,8 +3,7 @@ from __future__ import annotations
 from src.datasets.dataset import Dataset
 from src.datasets.frame_descriptor import FrameDescriptor
 from src.datasets.once.once_utils import ONCE
-from src.datasets.once.once_utils import get_frame_ids_for_scene, get_pickle_data, aggregate_frames_in_sequences, \
-    build_frame_id_to_annotations_lookup
+from src.datasets.once.once_utils import get_frame_ids_for_scene
 
 
 class OnceSceneIterator(Dataset.SceneIterator):
@@ -19,10 +18,8 @@ class OnceSceneIterator(Dataset.SceneIterator):
         self.__frame_ids = get_frame_ids_for_scene(once=once,
                                                    scene_id=scene_id)
 
-        # TODO: replace with constant runtime operation.
-        self.__pickle_data = get_pickle_data(self.__once.dataset_root, self.__scene_id)
-        self.__sequences_to_frames_lookup = aggregate_frames_in_sequences(self.__pickle_data)
-        self.__frame_id_to_annotations_lookup = build_frame_id_to_annotations_lookup(self.__pickle_data)
+        # Annotations are loaded or tracked once per scene and cached by ONCE.
+        self.__frame_id_to_annotations_lookup = self.__once.get_frame_annotations_lookup(self.__scene_id)
 
         self.__current_index = 0
 
@@ -3,10 +3,12 @@ import os
 import pickle
 import numpy as np
 
-from collections import defaultdict
 from pyquaternion import Quaternion
 
+from src.tracking.online_tracker import OnlineTracker
 from src.utils.geometry_utils import points_in_box, transform_matrix
+from src.utils.point_cloud_io import load_bin_point_cloud
+from src.utils.rigid_transform import apply_rigid_transform
 
 
 class ONCE(object):
@@ -24,6 +26,13 @@ class ONCE(object):
                 - cam03
                 - ...
                 -
+
+    Metadata of a sequence is parsed from its JSON on first use,
+    see get_scene_info.
+
+    Instance ids of annotations come from the pickles written by track_once.py,
+    or with track_instances are assigned on the fly from the JSON annotations,
+    see get_frame_annotations_lookup.
     """
 
     supported_splits = [
@@ -58,13 +67,62 @@ class ONCE(object):
     def __init__(self,
                  dataset_root: str,
                  scenes_root: str,
-                 split: str):
+                 split: str,
+                 use_mmap: bool = False,
+                 track_instances: bool = False):
         self.dataset_root = dataset_root
         self.data_folder = scenes_root
+        self.use_mmap = use_mmap
+        self.track_instances = track_instances
 
         self.__scenes_by_split_lookup = {s: self.__load_scenes_in_split(s) for s in self.supported_splits}
-
-        self.__collect_basic_infos([split])
+        self.__split = split
+        self.__scene_infos = dict()
+        self.__frame_annotations_lookups = dict()
+
+    def __getstate__(self) -> dict:
+        # Parsed metadata is not sent to workers: every worker needs only its own scenes.
+        state = self.__dict__.copy()
+        state['_ONCE__scene_infos'] = dict()
+        state['_ONCE__frame_annotations_lookups'] = dict()
+        return state
+
+    def get_scene_info(self, scene_id: str) -> dict:
+        """Returns metadata of the sequence, parsing its JSON on first use.
+
+        :param scene_id: str
+            ID of a sequence.
+        :return: dict
+            Pairs of frame id to pose, calibration and annotations of the frame
+            and 'frame_list' with sorted frame ids. Calibration is shared by all frames.
+        """
+        if scene_id not in self.__scene_infos:
+            assert scene_id in self.get_scenes_in_split(self.__split), \
+                f"Unknown sequence {scene_id} in split {self.__split}"
+            self.__scene_infos[scene_id] = load_scene_info(data_folder=self.data_folder,
+                                                           scene_id=scene_id)
+        return self.__scene_infos[scene_id]
+
+    def get_frame_annotations_lookup(self, scene_id: str) -> dict:
+        """Returns annotated frames of the sequence with instance ids, building them on first use.
+
+        The frames are read from the pickle written by track_once.py,
+        or tracked from the JSON annotations with track_instances.
+
+        :param scene_id: str
+            ID of a sequence.
+        :return: dict[str, dict]
+            Pairs of frame id to the frame data, instance ids are in frame_data['annos']['instance_ids'].
+        """
+        if scene_id not in self.__frame_annotations_lookups:
+            if self.track_instances:
+                frame_annotations_lookup = track_scene_instances(scene_id=scene_id,
+                                                                 scene_info=self.get_scene_info(scene_id))
+            else:
+                frame_annotations_lookup = build_frame_id_to_annotations_lookup(
+                    get_pickle_data(self.dataset_root, scene_id))
+            self.__frame_annotations_lookups[scene_id] = frame_annotations_lookup
+        return self.__frame_annotations_lookups[scene_id]
 
     def get_scenes_in_split(self, split: str) -> set:
         assert split in self.supported_splits
@@ -90,47 +148,11 @@ class ONCE(object):
 
         raise Exception(f"sequence id {scene_id} corresponding to no split")
 
-    def __collect_basic_infos(self, splits: list):
-        self.train_info = defaultdict(dict)
-        self.val_info = defaultdict(dict)
-        self.test_info = defaultdict(dict)
-        self.raw_small_info = defaultdict(dict)
-        self.raw_medium_info = defaultdict(dict)
-        self.raw_large_info = defaultdict(dict)
-
-        for split in splits:
-            assert split in self.supported_splits, \
-                f"Unsupported split {split}"
-
-            split_list = self.get_scenes_in_split(split)
-            info_dict = getattr(self, f"{split}_info")
-            for seq in split_list:
-                anno_file_path = os.path.join(self.data_folder, seq, f"{seq}.json")
-                if not os.path.isfile(anno_file_path):
-                    raise FileNotFoundError(f"no annotation file for sequence {seq}, looked for {anno_file_path}")
-                anno_file = json.load(open(anno_file_path, 'r'))
-                frame_list = list()
-                for frame_anno in anno_file['frames']:
-                    frame_list.append(str(frame_anno['frame_id']))
-                    info_dict[seq][frame_anno['frame_id']] = {
-                        'pose': frame_anno['pose'],
-                    }
-                    info_dict[seq][frame_anno['frame_id']]['calib'] = dict()
-                    for cam_name in self.__class__.camera_names:
-                        info_dict[seq][frame_anno['frame_id']]['calib'][cam_name] = {
-                            'cam_to_velo': np.array(anno_file['calib'][cam_name]['cam_to_velo']),
-                            'cam_intrinsic': np.array(anno_file['calib'][cam_name]['cam_intrinsic']),
-                            'distortion': np.array(anno_file['calib'][cam_name]['distortion'])
-                        }
-                    if 'annos' in frame_anno.keys():
-                        info_dict[seq][frame_anno['frame_id']]['annos'] = frame_anno['annos']
-                info_dict[seq]['frame_list'] = sorted(frame_list)
-
     def get_frame_point_cloud(self,
                               scene_id: str,
                               frame_id: str):
         bin_path = os.path.join(self.data_folder, scene_id, 'lidar_roof', f"{frame_id}.bin")
-        return np.fromfile(bin_path, dtype=np.float32).reshape(-1, 4).T
+        return load_bin_point_cloud(bin_path, dimensions=4, use_mmap=self.use_mmap)
 
     def move_back_to_frame_coordinates(self, points, box):
         cx, cy, cz, l, w, h, theta = box
@@ -151,13 +173,88 @@ class ONCE(object):
         return transformed_points.T
 
 
+def load_scene_info(data_folder: str,
+                    scene_id: str) -> dict:
+    """Parses metadata of the sequence from its JSON.
+
+    Calibration of the cameras is the same for every frame of the sequence,
+    so it is parsed once and shared by all frames.
+    """
+    anno_file_path = os.path.join(data_folder, scene_id, f"{scene_id}.json")
+    if not os.path.isfile(anno_file_path):
+        raise FileNotFoundError(f"no annotation file for sequence {scene_id}, looked for {anno_file_path}")
+
+    with open(anno_file_path, 'r') as anno_file_stream:
+        anno_file = json.load(anno_file_stream)
+
+    calib = dict()
+    for cam_name in ONCE.camera_names:
+        calib[cam_name] = {
+            'cam_to_velo': np.array(anno_file['calib'][cam_name]['cam_to_velo']),
+            'cam_intrinsic': np.array(anno_file['calib'][cam_name]['cam_intrinsic']),
+            'distortion': np.array(anno_file['calib'][cam_name]['distortion'])
+        }
+
+    scene_info = dict()
+    frame_list = list()
+    for frame_anno in anno_file['frames']:
+        frame_list.append(str(frame_anno['frame_id']))
+        scene_info[frame_anno['frame_id']] = {
+            'pose': frame_anno['pose'],
+            'calib': calib,
+        }
+        if 'annos' in frame_anno.keys():
+            scene_info[frame_anno['frame_id']]['annos'] = frame_anno['annos']
+    scene_info['frame_list'] = sorted(frame_list)
+
+    return scene_info
+
+
+def track_scene_instances(scene_id: str,
+                          scene_info: dict) -> dict:
+    """Assigns instance ids to the annotations of the sequence with OnlineTracker.
+
+    Frames are tracked in the order of their ids, same as track_once.py with default settings.
+
+    :param scene_id: str
+        ID of a sequence.
+    :param scene_info: dict
+        Metadata of the sequence, see load_scene_info.
+    :return: dict[str, dict]
+        Pairs of frame id to the frame data in the format of the pickles of track_once.py.
+    """
+    tracker = OnlineTracker()
+
+    frame_annotations_lookup = dict()
+    for frame_id in scene_info['frame_list']:
+        if 'annos' not in scene_info[frame_id]:
+            continue
+
+        annotations = scene_info[frame_id]['annos']
+        # Pickled infos keep categories in 'name', raw JSON annotations in 'names'.
+        categories = annotations['name'] if 'name' in annotations else annotations['names']
+        boxes_3d = np.asarray(annotations['boxes_3d'], dtype=np.float64).reshape(-1, 7)
+
+        instance_ids = tracker.update(categories=categories, boxes_3d=boxes_3d)
+
+        frame_annotations_lookup[frame_id] = {
+            'sequence_id': scene_id,
+            'frame_id': frame_id,
+            'annos': {
+                'name': np.asarray(categories),
+                'boxes_3d': boxes_3d,
+                'instance_ids': instance_ids.tolist(),
+            },
+        }
+
+    return frame_annotations_lookup
+
+
 def get_frame_instance_ids(scene_id, frame_id, once, frame_id_to_annotations_lookup={}):
     instance_ids = []
 
-    pickle_data = get_pickle_data(once.dataset_root, scene_id)
-
     if frame_id_to_annotations_lookup == {}:
-        frame_id_to_annotations_lookup = build_frame_id_to_annotations_lookup(pickle_data)
+        frame_id_to_annotations_lookup = once.get_frame_annotations_lookup(scene_id)
 
     if frame_id in frame_id_to_annotations_lookup:
         if 'annos' in frame_id_to_annotations_lookup[frame_id]:
@@ -190,8 +287,7 @@ def get_instance_point_cloud(
             Returns point cloud for the given object.
         """
 
-    pickle_data = get_pickle_data(once.dataset_root, seq_id)
-    frame_id_to_annotations_lookup = build_frame_id_to_annotations_lookup(pickle_data)
+    frame_id_to_annotations_lookup = once.get_frame_annotations_lookup(seq_id)
 
     instance_ids = get_frame_instance_ids(seq_id, frame_id, once,
                                           frame_id_to_annotations_lookup=frame_id_to_annotations_lookup)
@@ -216,14 +312,77 @@ def get_instance_point_cloud(
                                                    Quaternion(angle=theta, axis=[0, 0, 1]),
                                                    inverse=True)
 
-        instance_point_cloud = __apply_transformation_matrix(point_cloud=instance_point_cloud,
-                                                             transformation_matrix=identity_transformation)
+        instance_point_cloud = apply_rigid_transform(point_cloud=instance_point_cloud,
+                                                     transformation_matrix=identity_transformation)
         return instance_point_cloud
     else:
         raise ValueError(
             f"Instance ID {instance_id} is not present in the instance_ids list.")
 
 
+def get_instance_box(seq_id,
+                     frame_id,
+                     instance_id,
+                     once) -> tuple:
+    """Returns box of the instance in lidar coordinates of the frame.
+
+    :param seq_id: str
+        ID of a scene (sequence).
+    :param frame_id: str
+        ID of a frame (aka sample).
+    :param instance_id: str
+        ID of an instance.
+    :param once:
+        Once dataset instance.
+    :return: tuple[np.ndarray, np.ndarray, Quaternion]
+        Center, length-width-height and rotation of the box.
+    """
+    frame_id_to_annotations_lookup = once.get_frame_annotations_lookup(seq_id)
+
+    instance_ids = get_frame_instance_ids(seq_id, frame_id, once,
+                                          frame_id_to_annotations_lookup=frame_id_to_annotations_lookup)
+
+    if instance_id not in instance_ids:
+        raise ValueError(
+            f"Instance ID {instance_id} is not present in the instance_ids list.")
+
+    box = frame_id_to_annotations_lookup[frame_id]['annos']['boxes_3d'][instance_ids.index(instance_id)]
+    cx, cy, cz, l, w, h, theta = box
+
+    return np.array([cx, cy, cz]), np.array([l, w, h]), Quaternion(angle=theta, axis=[0, 0, 1])
+
+
+def get_instance_boxes(seq_id,
+                       frame_id,
+                       instance_ids,
+                       once) -> dict:
+    """Returns boxes of the instances in lidar coordinates of the frame.
+
+    Annotations of the scene are loaded once for all instances.
+
+    :param instance_ids: list[str]
+        IDs of instances.
+    :return: dict[str, tuple[np.ndarray, np.ndarray, Quaternion]]
+        Pairs of instance id to center, length-width-height and rotation of its box.
+    """
+    frame_id_to_annotations_lookup = once.get_frame_annotations_lookup(seq_id)
+
+    frame_instance_ids = get_frame_instance_ids(seq_id, frame_id, once,
+                                                frame_id_to_annotations_lookup=frame_id_to_annotations_lookup)
+    frame_boxes = frame_id_to_annotations_lookup[frame_id]['annos']['boxes_3d'] if len(frame_instance_ids) > 0 else []
+
+    boxes = dict()
+    for instance_id in instance_ids:
+        if instance_id not in frame_instance_ids:
+            raise ValueError(
+                f"Instance ID {instance_id} is not present in the instance_ids list.")
+
+        cx, cy, cz, l, w, h, theta = frame_boxes[frame_instance_ids.index(instance_id)]
+        boxes[instance_id] = np.array([cx, cy, cz]), np.array([l, w, h]), Quaternion(angle=theta, axis=[0, 0, 1])
+
+    return boxes
+
+
 def reapply_frame_transformation(point_cloud: np.ndarray,
                                  frame_descriptor: dict,
                                  instance_id: str,
@@ -239,8 +398,8 @@ def reapply_frame_transformation(point_cloud: np.ndarray,
                                               Quaternion(angle=theta, axis=[0, 0, 1]),
                                               inverse=False)
 
-    instance_point_cloud = __apply_transformation_matrix(point_cloud=point_cloud,
-                                                         transformation_matrix=reverse_transformation)
+    instance_point_cloud = apply_rigid_transform(point_cloud=point_cloud,
+                                                 transformation_matrix=reverse_transformation)
 
     return instance_point_cloud
 
@@ -295,6 +454,32 @@ def build_frame_id_to_annotations_lookup(pickle_data,
     return id_to_annotations_lookup
 
 
+def partition_frames_by_sequence(pickle_data,
+                                 ignore_not_annotated=True) -> dict:
+    """Splits frames of the split into sequences.
+
+    Same as looking up every frame of aggregate_frames_in_sequences
+    in build_frame_id_to_annotations_lookup. The split is partitioned once,
+    so a sequence can be processed without the rest of the split.
+
+    Runtime complexity is O(frames).
+
+    :param pickle_data: list[dict]
+        Frames of the split info file.
+    :param ignore_not_annotated: bool
+        Skip frames without annotations.
+    :return: dict[str, list[dict]]
+        Pairs of sequence id to its frames in the order of the split.
+    """
+    id_to_annotations_lookup = build_frame_id_to_annotations_lookup(pickle_data,
+                                                                    ignore_not_annotated=ignore_not_annotated)
+    sequences_to_frames_lookup = aggregate_frames_in_sequences(pickle_data,
+                                                               ignore_not_annotated=ignore_not_annotated)
+
+    return {sequence_id: [id_to_annotations_lookup[frame_id] for frame_id in frame_ids]
+            for sequence_id, frame_ids in sequences_to_frames_lookup.items()}
+
+
 def get_frame_ids_for_scene(once: ONCE,
                             scene_id: str) -> list:
     frames_folder_path = os.path.join(once.data_folder, scene_id, 'lidar_roof')
@@ -302,20 +487,3 @@ def get_frame_ids_for_scene(once: ONCE,
 
     frame_ids = [os.path.basename(file).split('.')[0] for file in raw_frame_files]
     return sorted(frame_ids)
-
-
-def __apply_transformation_matrix(point_cloud: np.ndarray,
-                                  transformation_matrix: np.ndarray) -> np.ndarray:
-    """Applies given transformation matrix to the given point cloud.
-
-    :param point_cloud: np.ndarray[float]
-        Point cloud to transform of shape [3, n]
-    :param transformation_matrix: np.ndarray[float]
-        Transformation matrix that describes rotation and translation of shape [4, 4].
-    :return: np.ndarray[float]
-        Modified point cloud.
-    """
-    points_count = point_cloud.shape[1]
-    point_cloud[:3, :] = transformation_matrix.dot(
-        np.vstack((point_cloud[:3, :], np.ones(points_count))))[:3, :]
-    return point_cloud
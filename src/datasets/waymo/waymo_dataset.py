@@ -1,22 +1,79 @@
 import os
-from functools import lru_cache
 from typing import Optional
 
 import numpy as np
 
 from src.datasets.dataset import Dataset
+from src.datasets.compact_frame import CompactFrameFormat, get_compact_path, load_compact_point_cloud
+from src.datasets.frame_delta import FrameDelta, get_delta_path
 from src.datasets.frame_patcher import FramePatcher
+from src.datasets.metadata_index import IndexedDatasetMixin
+from src.datasets.waymo.waymo_descriptor_cache import load_scene_columns
 from src.datasets.waymo.waymo_frame_patcher import WaymoFramePatcher
 from src.datasets.waymo.waymo_scene_iterator import WaymoSceneIterator
-from src.datasets.waymo.waymo_utils import find_all_scenes, load_scene_descriptor, get_frame_point_cloud, \
-    get_instance_point_cloud, get_frame_index
+from src.datasets.waymo.waymo_utils import find_all_scenes, get_frame_point_cloud, get_instance_point_cloud, \
+    get_frame_index, get_instance_box, count_frames_in_scene
+from src.utils.bev_grid_index import BevGridIndex
+from src.utils.dtype_policy import DEFAULT_POINT_CLOUD_DTYPE, as_point_cloud_dtype
+from src.utils.packed_archive import PackedArchiveCollection
+from src.utils.file_utils import filter_existing_files
+from src.utils.geometry_utils import extract_box_point_clouds
+from src.utils.point_cloud_io import load_npy_point_cloud
 
 
 class WaymoDataset(Dataset):
     def __init__(self,
-                 dataset_root: str):
+                 dataset_root: str,
+                 use_mmap: bool = False,
+                 packed_root: Optional[str] = None,
+                 packed_output_root: Optional[str] = None,
+                 delta_output: bool = False,
+                 compact_output: Optional[CompactFrameFormat] = None,
+                 descriptor_cache_root: Optional[str] = None,
+                 point_cloud_dtype: np.dtype = DEFAULT_POINT_CLOUD_DTYPE):
+        """Creates Waymo dataset.
+
+        :param dataset_root: str
+            Root of the dataset.
+        :param use_mmap: bool
+            Memory-map frame point clouds instead of reading them,
+            loaded frames are read-only views.
+        :param packed_root: Optional[str]
+            Folder with packed scene archives to read frames from, see pack_scenes.py.
+        :param packed_output_root: Optional[str]
+            Folder to write patched frames to as packed scene archives.
+        :param delta_output: bool
+            Write only removed point indices and inserted points of patched frames,
+            see FrameDelta.
+        :param compact_output: Optional[CompactFrameFormat]
+            Write patched frames quantised in the given format.
+        :param descriptor_cache_root: Optional[str]
+            Folder for columnar scene descriptors built from the pickles on first use,
+            dataset_root/descriptor_cache by default.
+        :param point_cloud_dtype: np.dtype
+            Dtype frames are converted to on loading, see src.utils.dtype_policy.
+        """
         self.__dataset_root = dataset_root
-        self.__scene_ids = find_all_scenes(dataset_root=dataset_root)
+        self.__descriptor_cache_root = descriptor_cache_root if descriptor_cache_root is not None \
+            else os.path.join(dataset_root, 'descriptor_cache')
+        self.__use_mmap = use_mmap
+        self.__packed_input = PackedArchiveCollection(packed_root) if packed_root is not None else None
+        self.__packed_output = PackedArchiveCollection(packed_output_root) if packed_output_root is not None else None
+        self.__delta_output = delta_output
+        self.__compact_output = compact_output
+        self.__point_cloud_dtype = np.dtype(point_cloud_dtype)
+
+        assert [delta_output, packed_output_root is not None, compact_output is not None].count(True) <= 1, \
+            "Only one of delta, packed and compact outputs can be used"
+
+        # Scenes are listed on first use, see __scene_ids.
+        self.__found_scene_ids = None
+
+    @property
+    def __scene_ids(self) -> list:
+        if self.__found_scene_ids is None:
+            self.__found_scene_ids = find_all_scenes(dataset_root=self.__dataset_root)
+        return self.__found_scene_ids
 
     @property
     def dataroot(self) -> str:
@@ -26,50 +83,140 @@ class WaymoDataset(Dataset):
     def scenes(self) -> list:
         return list(self.__scene_ids)
 
+    @property
+    def point_cloud_dtype(self) -> np.dtype:
+        return self.__point_cloud_dtype
+
     def get_scene_iterator(self, scene_id: str) -> Dataset.SceneIterator:
         scene_descriptor = self.__load_scene_descriptor(scene_id=scene_id)
         return WaymoSceneIterator(scene_id=scene_id, scene_descriptor=scene_descriptor)
 
     def load_frame_patcher(self,
                            scene_id: str,
-                           frame_id: str) -> FramePatcher:
+                           frame_id: str,
+                           frame_point_cloud: Optional[np.ndarray] = None,
+                           grid_index: Optional[BevGridIndex] = None) -> FramePatcher:
         scene_descriptor = self.__load_scene_descriptor(scene_id=scene_id)
 
+        if frame_point_cloud is None:
+            frame_point_cloud = self.get_frame_point_cloud(scene_id=scene_id,
+                                                           frame_id=frame_id)
+
         return WaymoFramePatcher.load(dataset_root=self.__dataset_root,
                                       scene_id=scene_id,
                                       frame_id=frame_id,
-                                      scene_descriptor=scene_descriptor)
+                                      scene_descriptor=scene_descriptor,
+                                      use_mmap=self.__use_mmap,
+                                      frame_point_cloud=frame_point_cloud,
+                                      grid_index=grid_index)
 
     def can_serialise_frame_point_cloud(self,
                                         scene_id: str,
                                         frame_id: str) -> bool:
-        path_to_save = self.__get_patched_frame_path(scene_id=scene_id,
-                                                     frame_id=frame_id)
+        if self.__packed_output is not None:
+            return not self.__packed_output.has_frame(scene_id=scene_id, frame_id=frame_id)
+
+        path_to_save = self.__get_output_path(scene_id=scene_id, frame_id=frame_id)
 
         # We can serialise point cloud if there is no point cloud saved.
         return not os.path.exists(path_to_save)
 
+    def get_serialised_frame_ids(self, scene_id: str) -> set:
+        if self.__packed_output is not None:
+            return self.__packed_output.get_frame_ids(scene_id=scene_id)
+
+        frame_paths = {frame_id: self.__get_output_path(scene_id=scene_id, frame_id=frame_id)
+                       for frame_id, _ in self.get_scene_iterator(scene_id=scene_id)}
+        existing_paths = filter_existing_files(list(frame_paths.values()))
+        return {frame_id for frame_id, path in frame_paths.items() if path in existing_paths}
+
+    def get_frames_count(self, scene_id: str) -> int:
+        # Frames are counted in the scene folder without loading the descriptor.
+        return count_frames_in_scene(dataset_root=self.__dataset_root, scene_id=scene_id)
+
+    def flush_serialised_frames(self, scene_id: str):
+        if self.__packed_output is not None:
+            self.__packed_output.flush(scene_id=scene_id)
+
     def serialise_frame_point_clouds(self,
                                      scene_id: str,
                                      frame_id: str,
-                                     frame_point_cloud: np.ndarray) -> Optional[str]:
+                                     frame_point_cloud: np.ndarray,
+                                     frame_delta: Optional[FrameDelta] = None) -> Optional[str]:
+        if self.__packed_output is not None:
+            return self.__packed_output.append_frame(scene_id=scene_id,
+                                                     frame_id=frame_id,
+                                                     point_cloud=frame_point_cloud)
+
         path_to_save = self.__get_patched_frame_path(scene_id=scene_id,
                                                      frame_id=frame_id)
+        os.makedirs(os.path.dirname(path_to_save), exist_ok=True)
+
+        if self.__delta_output:
+            assert frame_delta is not None, \
+                f"Delta of frame {frame_id} is required for delta output"
+            path_to_save = get_delta_path(path_to_save)
+            frame_delta.serialise(path=path_to_save)
+            return path_to_save
+
+        if self.__compact_output is not None:
+            path_to_save = get_compact_path(path_to_save)
+            self.__compact_output.serialise(path=path_to_save,
+                                            point_cloud=frame_point_cloud)
+            return path_to_save
 
         WaymoFramePatcher.serialise(path=path_to_save,
                                     point_cloud=frame_point_cloud)
 
         return path_to_save
 
+    def get_patched_frame_point_cloud(self,
+                                      scene_id: str,
+                                      frame_id: str) -> np.ndarray:
+        if self.__packed_output is not None:
+            return self.__packed_output.get_frame_point_cloud(scene_id=scene_id,
+                                                              frame_id=frame_id,
+                                                              use_mmap=self.__use_mmap)
+
+        patched_path = self.__get_patched_frame_path(scene_id=scene_id,
+                                                     frame_id=frame_id)
+
+        if self.__delta_output:
+            frame_delta = FrameDelta.load(get_delta_path(patched_path))
+            return frame_delta.apply(self.get_frame_point_cloud(scene_id=scene_id,
+                                                                frame_id=frame_id))
+
+        if self.__compact_output is not None:
+            return load_compact_point_cloud(get_compact_path(patched_path))
+
+        return load_npy_point_cloud(path=patched_path,
+                                    use_mmap=self.__use_mmap)
+
     def get_frame_point_cloud(self,
                               scene_id: str,
                               frame_id: str) -> np.ndarray:
-        scene_descriptor = self.__load_scene_descriptor(scene_id=scene_id)
-        frame_descriptor = scene_descriptor[frame_id]
+        if self.__packed_input is not None:
+            frame_point_cloud = self.__packed_input.get_frame_point_cloud(scene_id=scene_id,
+                                                                          frame_id=frame_id,
+                                                                          use_mmap=self.__use_mmap)
+        else:
+            scene_descriptor = self.__load_scene_descriptor(scene_id=scene_id)
+            frame_descriptor = scene_descriptor[frame_id]
+
+            frame_point_cloud = get_frame_point_cloud(dataset_root=self.__dataset_root,
+                                                      scene_id=scene_id,
+                                                      frame_descriptor=frame_descriptor,
+                                                      use_mmap=self.__use_mmap)
 
-        return get_frame_point_cloud(dataset_root=self.__dataset_root,
-                                     scene_id=scene_id,
-                                     frame_descriptor=frame_descriptor)
+        return as_point_cloud_dtype(frame_point_cloud, dtype=self.__point_cloud_dtype)
+
+    def get_instance_box(self,
+                         scene_id: str,
+                         frame_id: str,
+                         instance_id: str) -> tuple:
+        scene_descriptor = self.__load_scene_descriptor(scene_id=scene_id)
+        return get_instance_box(instance_id=instance_id,
+                                frame_descriptor=scene_descriptor[frame_id])
 
     def get_instance_point_cloud(self,
                                  scene_id: str,
@@ -81,11 +228,36 @@ class WaymoDataset(Dataset):
                                         instance_id=instance_id,
                                         frame_descriptor=scene_descriptor[frame_id])
 
-    @lru_cache(maxsize=12)
+    def get_instance_point_clouds(self,
+                                  scene_id: str,
+                                  frame_id: str,
+                                  instance_ids: list,
+                                  frame_point_cloud: np.ndarray,
+                                  grid_index: Optional[BevGridIndex] = None) -> dict:
+        frame_descriptor = self.__load_scene_descriptor(scene_id=scene_id)[frame_id]
+        boxes = {instance_id: get_instance_box(instance_id=instance_id,
+                                               frame_descriptor=frame_descriptor)
+                 for instance_id in instance_ids}
+        return extract_box_point_clouds(frame_point_cloud=frame_point_cloud,
+                                        boxes=boxes,
+                                        grid_index=grid_index)
+
     def __load_scene_descriptor(self,
                                 scene_id: str) -> dict:
-        return load_scene_descriptor(dataset_root=self.__dataset_root,
-                                     scene_id=scene_id)
+        # Columns are cached per process by paths, so copies of the dataset in workers share them.
+        return load_scene_columns(dataset_root=self.__dataset_root,
+                                  scene_id=scene_id,
+                                  cache_root=self.__descriptor_cache_root)
+
+    def __get_output_path(self,
+                          scene_id: str,
+                          frame_id: str) -> str:
+        path_to_save = self.__get_patched_frame_path(scene_id=scene_id, frame_id=frame_id)
+        if self.__delta_output:
+            return get_delta_path(path_to_save)
+        elif self.__compact_output is not None:
+            return get_compact_path(path_to_save)
+        return path_to_save
 
     def __get_patched_frame_path(self,
                                  scene_id: str,
@@ -93,11 +265,23 @@ class WaymoDataset(Dataset):
         scene_descriptor = self.__load_scene_descriptor(scene_id=scene_id)
         frame_descriptor = scene_descriptor[frame_id]
 
-        patched_root_folder = os.path.join(self.__dataset_root, 'patched')
-        os.makedirs(patched_root_folder, exist_ok=True)
-
-        patched_scene_folder = os.path.join(patched_root_folder, scene_id)
-        os.makedirs(patched_scene_folder, exist_ok=True)
+        patched_scene_folder = os.path.join(self.__dataset_root, 'patched', scene_id)
 
         frame_index = get_frame_index(frame_descriptor)
         return os.path.join(patched_scene_folder, f"{frame_index:04d}.npy")
+
+
+class IndexedWaymoDataset(IndexedDatasetMixin, WaymoDataset):
+    """Waymo dataset with scenes, instances and boxes served from a metadata index.
+
+    See build_metadata_index.py.
+    """
+
+    def __init__(self,
+                 metadata_index_path: str,
+                 dataset_root: str,
+                 **kwargs):
+        super().__init__(metadata_index_path,
+                         {'dataset': 'waymo'},
+                         dataset_root=dataset_root,
+                         **kwargs)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from collections.abc import Mapping
+from functools import lru_cache
+
+from src.datasets.waymo.waymo_utils import load_scene_descriptor, get_frame_index
+
+# Annotation columns stored per scene, every column has a row per annotated object.
+ANNOTATION_COLUMNS = ['obj_ids', 'location', 'dimensions', 'heading_angles']
+
+__SOURCE_STAT_FILE = 'source_stat.npy'
+
+
+class WaymoSceneColumns(Mapping):
+    """Columnar descriptor of a Waymo scene.
+
+    Annotations of all frames are stored as contiguous memory-mapped columns,
+    rows of a frame are located by offsets. The class is a read-only mapping
+    of frame id to frame descriptor with the same layout as the pickled one,
+    so it can be used wherever a scene descriptor is expected.
+
+    Frame descriptors are created on first access in O(1) and
+    keep a lookup of instance id to annotation column.
+    """
+
+    def __init__(self, scene_cache_dir: str):
+        """Opens columns of a scene.
+
+        :param scene_cache_dir: str
+            Folder with the columns, see build_scene_columns.
+        """
+        self.__frame_ids = [str(frame_id) for frame_id in np.load(os.path.join(scene_cache_dir, 'frame_ids.npy'))]
+        self.__frame_indices = np.load(os.path.join(scene_cache_dir, 'frame_indices.npy'))
+        self.__offsets = np.load(os.path.join(scene_cache_dir, 'offsets.npy'))
+        self.__columns = {column: np.load(os.path.join(scene_cache_dir, f"{column}.npy"), mmap_mode='r')
+                          for column in ANNOTATION_COLUMNS}
+
+        self.__frame_rows = {frame_id: row for row, frame_id in enumerate(self.__frame_ids)}
+        self.__frame_descriptors = dict()
+
+    def __getitem__(self, frame_id: str) -> dict:
+        if frame_id not in self.__frame_descriptors:
+            self.__frame_descriptors[frame_id] = self.__create_frame_descriptor(frame_id)
+        return self.__frame_descriptors[frame_id]
+
+    def __iter__(self):
+        return iter(self.__frame_ids)
+
+    def __len__(self) -> int:
+        return len(self.__frame_ids)
+
+    def __contains__(self, frame_id) -> bool:
+        return frame_id in self.__frame_rows
+
+    def get_instance_ids(self, frame_id: str) -> np.ndarray:
+        row = self.__frame_rows[frame_id]
+        return self.__columns['obj_ids'][self.__offsets[row]:self.__offsets[row + 1]]
+
+    def __create_frame_descriptor(self, frame_id: str) -> dict:
+        row = self.__frame_rows[frame_id]
+        start, end = self.__offsets[row], self.__offsets[row + 1]
+
+        annotations = {column: values[start:end] for column, values in self.__columns.items()}
+        instance_columns = {str(instance_id): column for column, instance_id in enumerate(annotations['obj_ids'])}
+
+        return {
+            'frame_id': frame_id,
+            'point_cloud': {'frame_index': int(self.__frame_indices[row])},
+            'annos': annotations,
+            'instance_columns': instance_columns,
+        }
+
+
+def get_scene_cache_dir(cache_root: str,
+                        scene_id: str) -> str:
+    return os.path.join(cache_root, scene_id)
+
+
+def build_scene_columns(dataset_root: str,
+                        scene_id: str,
+                        cache_root: str) -> str:
+    """Converts the pickled descriptor of the scene into columns.
+
+    Columns are written to a temporary folder that is renamed once complete,
+    so concurrent builders of the same scene never expose partial columns.
+    Published columns are replaced only when they are outdated, current ones
+    may be loaded by other processes and are kept as they are.
+
+    :param dataset_root: str
+        Root of the dataset.
+    :param scene_id: str
+        ID of a scene.
+    :param cache_root: str
+        Folder to store columns of all scenes.
+    :return: str
+        Folder with the columns of the scene.
+    """
+    scene_descriptor = load_scene_descriptor(dataset_root=dataset_root, scene_id=scene_id)
+
+    frame_ids = sorted(scene_descriptor.keys())
+    annotations = [scene_descriptor[frame_id]['annos'] for frame_id in frame_ids]
+    counts = [len(frame_annotations['obj_ids']) for frame_annotations in annotations]
+
+    scene_cache_dir = get_scene_cache_dir(cache_root=cache_root, scene_id=scene_id)
+    os.makedirs(cache_root, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=f".{scene_id}_", dir=cache_root)
+
+    try:
+        np.save(os.path.join(temp_dir, 'frame_ids.npy'), np.array(frame_ids, dtype=str))
+        np.save(os.path.join(temp_dir, 'frame_indices.npy'),
+                np.array([get_frame_index(scene_descriptor[frame_id]) for frame_id in frame_ids], dtype=np.int64))
+        np.save(os.path.join(temp_dir, 'offsets.npy'), np.concatenate(([0], np.cumsum(counts))).astype(np.int64))
+
+        for column in ANNOTATION_COLUMNS:
+            values = [np.asarray(frame_annotations[column]) for frame_annotations in annotations]
+            np.save(os.path.join(temp_dir, f"{column}.npy"), __concatenate_column(column, values))
+
+        source_stat = __get_source_stat(dataset_root, scene_id)
+        np.save(os.path.join(temp_dir, __SOURCE_STAT_FILE), source_stat)
+
+        if __is_scene_columns_current(scene_cache_dir, source_stat):
+            # Another process has already published the same columns.
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return scene_cache_dir
+
+        if os.path.exists(scene_cache_dir):
+            shutil.rmtree(scene_cache_dir)
+        os.replace(temp_dir, scene_cache_dir)
+    except OSError:
+        # Another process has just published columns of the same scene.
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        if not os.path.exists(scene_cache_dir):
+            raise
+
+    return scene_cache_dir
+
+
+@lru_cache(maxsize=12)
+def load_scene_columns(dataset_root: str,
+                       scene_id: str,
+                       cache_root: str) -> WaymoSceneColumns:
+    """Returns columns of the scene, building them if they are missing or outdated.
+
+    The cache is kept per process and keyed on paths,
+    so every worker opens columns of a scene once.
+    """
+    scene_cache_dir = get_scene_cache_dir(cache_root=cache_root, scene_id=scene_id)
+
+    if not __is_scene_columns_current(scene_cache_dir, __get_source_stat(dataset_root, scene_id)):
+        build_scene_columns(dataset_root=dataset_root, scene_id=scene_id, cache_root=cache_root)
+
+    return WaymoSceneColumns(scene_cache_dir)
+
+
+def __concatenate_column(column: str,
+                         values: list) -> np.ndarray:
+    if column == 'obj_ids':
+        return np.array([str(instance_id) for frame_values in values for instance_id in frame_values], dtype=str)
+
+    non_empty_values = [frame_values for frame_values in values if frame_values.size > 0]
+    if len(non_empty_values) == 0:
+        return np.zeros((0, 3) if column in ['location', 'dimensions'] else (0,), dtype=np.float64)
+    return np.concatenate(non_empty_values, axis=0)
+
+
+def __is_scene_columns_current(scene_cache_dir: str,
+                               source_stat: np.ndarray) -> bool:
+    source_stat_path = os.path.join(scene_cache_dir, __SOURCE_STAT_FILE)
+
+    try:
+        return np.array_equal(np.load(source_stat_path), source_stat)
+    except OSError:
+        # Columns are missing or an outdated folder is being replaced.
+        return False
+
+
+def __get_source_stat(dataset_root: str,
+                      scene_id: str) -> np.ndarray:
+    stat = os.stat(os.path.join(dataset_root, f"{scene_id}.pkl"))
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
@@ -2,8 +2,15 @@ from __future__ import annotations
 
 import numpy as np
 
-from src.datasets.frame_patcher import FramePatcher
-from src.datasets.waymo.waymo_utils import get_frame_point_cloud, reapply_frame_transformation
+from pyquaternion import Quaternion
+from typing import Optional
+
+from src.datasets.frame_delta import FrameDelta
+from src.datasets.frame_patcher import FramePatcher, assemble_patched_frame
+from src.datasets.waymo.waymo_utils import get_frame_point_cloud, get_instance_column, \
+    reapply_frame_transformation
+from src.utils.bev_grid_index import BevGridIndex, get_patched_points_in_box_mask, get_patched_points_in_boxes_mask
+from src.utils.dtype_policy import as_point_cloud_dtype
 from src.utils.geometry_utils import points_in_box
 
 
@@ -15,26 +22,41 @@ class WaymoFramePatcher(FramePatcher):
                  scene_id: str,
                  frame_id: str,
                  frame_point_cloud: np.ndarray,
-                 frame_descriptor: dict):
+                 frame_descriptor: dict,
+                 grid_index: Optional[BevGridIndex] = None):
         self.__scene_id = scene_id
         self.__frame_id = frame_id
         self.__frame_point_cloud = frame_point_cloud
         self.__frame_descriptor = frame_descriptor
 
+        # Boxes are looked up in the index of the original frame.
+        self.__grid_index = grid_index
+        self.__original_frame_point_cloud = frame_point_cloud
+
+        # Index of every point in the original frame, -1 for inserted points.
+        self.__original_points_count = frame_point_cloud.shape[1]
+        self.__origin_indices = np.arange(self.__original_points_count)
+
     @classmethod
     def load(cls,
              dataset_root: str,
              scene_id: str,
              frame_id: str,
-             scene_descriptor: dict) -> WaymoFramePatcher:
-        lidar_point_cloud = get_frame_point_cloud(dataset_root=dataset_root,
-                                                  scene_id=scene_id,
-                                                  frame_descriptor=scene_descriptor[frame_id])
+             scene_descriptor: dict,
+             use_mmap: bool = False,
+             frame_point_cloud: Optional[np.ndarray] = None,
+             grid_index: Optional[BevGridIndex] = None) -> WaymoFramePatcher:
+        if frame_point_cloud is None:
+            frame_point_cloud = get_frame_point_cloud(dataset_root=dataset_root,
+                                                      scene_id=scene_id,
+                                                      frame_descriptor=scene_descriptor[frame_id],
+                                                      use_mmap=use_mmap)
 
         return WaymoFramePatcher(scene_id=scene_id,
                                  frame_id=frame_id,
-                                 frame_point_cloud=lidar_point_cloud,
-                                 frame_descriptor=scene_descriptor[frame_id])
+                                 frame_point_cloud=frame_point_cloud,
+                                 frame_descriptor=scene_descriptor[frame_id],
+                                 grid_index=grid_index)
 
     @classmethod
     def serialise(cls,
@@ -60,32 +82,98 @@ class WaymoFramePatcher(FramePatcher):
     def frame(self) -> np.ndarray:
         return self.__frame_point_cloud
 
+    @property
+    def delta(self) -> FrameDelta:
+        return FrameDelta.from_patched_frame(original_points_count=self.__original_points_count,
+                                             origin_indices=self.__origin_indices,
+                                             frame_point_cloud=self.__frame_point_cloud)
+
     def patch_instance(self,
                        instance_id: str,
                        point_cloud: np.ndarray):
         annotations = self.__frame_descriptor['annos']
-        ids = annotations['obj_ids']
-
-        instance_index = np.where(ids == instance_id)
-        instance_column = instance_index[0][0]
+        instance_column = get_instance_column(frame_descriptor=self.__frame_descriptor,
+                                              instance_id=instance_id)
 
         center_xyz = annotations['location'][instance_column, :]
         dimensions_lwh = annotations['dimensions'][instance_column, :]
         heading_angle = annotations['heading_angles'][instance_column]
 
-        points = self.__frame_point_cloud[0:3, :]
-        mask = points_in_box(center_xyz=center_xyz,
-                             dimensions_lwh=dimensions_lwh,
-                             heading_angle=heading_angle,
-                             points=points)
+        mask = self.__get_box_mask(center_xyz=center_xyz,
+                                   dimensions_lwh=dimensions_lwh,
+                                   heading_angle=heading_angle)
 
         # Remove masked elements in frame.
-        self.__frame_point_cloud = self.__frame_point_cloud[:, np.where(~mask)[0]]
+        kept_indices = np.where(~mask)[0]
+        self.__frame_point_cloud = self.__frame_point_cloud[:, kept_indices]
+        self.__origin_indices = self.__origin_indices[kept_indices]
 
-        # Put the object back into the scene.
+        # Put the object back into the scene, inserted points take the dtype of the frame.
+        point_cloud = as_point_cloud_dtype(point_cloud, dtype=self.__frame_point_cloud.dtype)
         point_cloud = reapply_frame_transformation(point_cloud=point_cloud,
                                                    instance_id=instance_id,
                                                    frame_descriptor=self.__frame_descriptor)
 
         # Append instance patch: append should happen along
         self.__frame_point_cloud = np.concatenate((self.__frame_point_cloud, point_cloud), axis=1)
+        self.__origin_indices = np.concatenate((self.__origin_indices, np.full(point_cloud.shape[1], -1)))
+
+    def patch_instances(self,
+                        instance_point_clouds: dict):
+        annotations = self.__frame_descriptor['annos']
+
+        instance_columns = [get_instance_column(frame_descriptor=self.__frame_descriptor, instance_id=instance_id)
+                            for instance_id in instance_point_clouds.keys()]
+        removal_mask = self.__get_boxes_mask([(annotations['location'][instance_column, :],
+                                               annotations['dimensions'][instance_column, :],
+                                               annotations['heading_angles'][instance_column])
+                                              for instance_column in instance_columns])
+        inserted_point_clouds = list()
+
+        for instance_id, point_cloud in instance_point_clouds.items():
+            # Put the object back into the scene, inserted points take the dtype of the frame.
+            point_cloud = as_point_cloud_dtype(point_cloud, dtype=self.__frame_point_cloud.dtype)
+            inserted_point_clouds.append(reapply_frame_transformation(point_cloud=point_cloud,
+                                                                      instance_id=instance_id,
+                                                                      frame_descriptor=self.__frame_descriptor))
+
+        self.__frame_point_cloud, self.__origin_indices = \
+            assemble_patched_frame(frame_point_cloud=self.__frame_point_cloud,
+                                   origin_indices=self.__origin_indices,
+                                   removal_mask=removal_mask,
+                                   inserted_point_clouds=inserted_point_clouds)
+
+    def __get_box_mask(self,
+                       center_xyz: np.ndarray,
+                       dimensions_lwh: np.ndarray,
+                       heading_angle: float) -> np.ndarray:
+        if self.__grid_index is not None:
+            return get_patched_points_in_box_mask(grid_index=self.__grid_index,
+                                                  original_point_cloud=self.__original_frame_point_cloud,
+                                                  point_cloud=self.__frame_point_cloud,
+                                                  origin_indices=self.__origin_indices,
+                                                  center_xyz=center_xyz,
+                                                  dimensions_lwh=dimensions_lwh,
+                                                  rotation=Quaternion(angle=heading_angle, axis=[0, 0, 1]))
+
+        return points_in_box(center_xyz=center_xyz,
+                             dimensions_lwh=dimensions_lwh,
+                             heading_angle=heading_angle,
+                             points=self.__frame_point_cloud[0:3, :])
+
+    def __get_boxes_mask(self, boxes: list) -> np.ndarray:
+        if self.__grid_index is not None:
+            return get_patched_points_in_boxes_mask(grid_index=self.__grid_index,
+                                                    original_point_cloud=self.__original_frame_point_cloud,
+                                                    point_cloud=self.__frame_point_cloud,
+                                                    origin_indices=self.__origin_indices,
+                                                    boxes=[(center_xyz, dimensions_lwh,
+                                                            Quaternion(angle=heading_angle, axis=[0, 0, 1]))
+                                                           for center_xyz, dimensions_lwh, heading_angle in boxes])
+
+        mask = np.zeros(self.__frame_point_cloud.shape[1], dtype=bool)
+        for center_xyz, dimensions_lwh, heading_angle in boxes:
+            mask |= self.__get_box_mask(center_xyz=center_xyz,
+                                        dimensions_lwh=dimensions_lwh,
+                                        heading_angle=heading_angle)
+        return mask
@@ -5,6 +5,8 @@ from pyquaternion import Quaternion
 
 from src.utils.file_utils import list_all_files_with_extension
 from src.utils.geometry_utils import points_in_box, transform_matrix
+from src.utils.point_cloud_io import load_npy_point_cloud
+from src.utils.rigid_transform import apply_rigid_transform
 
 
 def find_all_scenes(dataset_root: str) -> list:
@@ -28,20 +30,21 @@ def load_scene_descriptor(dataset_root: str,
 def count_frames_in_scene(dataset_root: str,
                           scene_id: str) -> int:
     frame_pcr_dir = os.path.join(dataset_root, scene_id)
-    pcr_list = list_all_files_with_extension(files=[frame_pcr_dir], extension='.npy', shallow=True)
-    return len(pcr_list)
+    with os.scandir(frame_pcr_dir) as entries:
+        return sum(1 for entry in entries if entry.is_file() and entry.name.endswith('.npy'))
 
 
 def get_frame_point_cloud(dataset_root: str,
                           scene_id: str,
-                          frame_descriptor: dict) -> np.ndarray:
+                          frame_descriptor: dict,
+                          use_mmap: bool = False) -> np.ndarray:
     frame_index = get_frame_index(frame_descriptor)
     frame_pcr_file = os.path.join(dataset_root, scene_id, f"{frame_index:04d}.npy")
 
     assert os.path.exists(frame_pcr_file), \
         f"Cannot find file {frame_pcr_file}"
 
-    return np.load(frame_pcr_file).T
+    return load_npy_point_cloud(frame_pcr_file, use_mmap=use_mmap)
 
 
 def get_instance_point_cloud(frame_point_cloud: np.ndarray,
@@ -62,11 +65,8 @@ def get_instance_point_cloud(frame_point_cloud: np.ndarray,
         Dimension of the array is 5xm.
     """
     annotations = frame_descriptor['annos']
-    ids = annotations['obj_ids']
-
-    # O(obj_ids)
-    instance_index = np.where(ids == instance_id)
-    instance_column = instance_index[0][0]
+    instance_column = get_instance_column(frame_descriptor=frame_descriptor,
+                                          instance_id=instance_id)
 
     center_xyz = annotations['location'][instance_column, :]
     dimensions_lwh = annotations['dimensions'][instance_column, :]
@@ -85,19 +85,39 @@ def get_instance_point_cloud(frame_point_cloud: np.ndarray,
                                                Quaternion(angle=heading_angle, axis=[0, 0, 1]),
                                                inverse=True)
 
-    instance_point_cloud = __apply_transformation_matrix(point_cloud=instance_point_cloud,
-                                                         transformation_matrix=identity_transformation)
+    instance_point_cloud = apply_rigid_transform(point_cloud=instance_point_cloud,
+                                                 transformation_matrix=identity_transformation)
     return instance_point_cloud
 
 
+def get_instance_box(instance_id: str,
+                     frame_descriptor: dict) -> tuple:
+    """Returns box of the instance in lidar coordinates of the frame.
+
+    :param instance_id: str
+        ID of an instance.
+    :param frame_descriptor: dict
+        Descriptor of the given frame.
+    :return: tuple[np.ndarray, np.ndarray, Quaternion]
+        Center, length-width-height and rotation of the box.
+    """
+    annotations = frame_descriptor['annos']
+    instance_column = get_instance_column(frame_descriptor=frame_descriptor,
+                                          instance_id=instance_id)
+
+    center_xyz = np.array(annotations['location'][instance_column, :])
+    dimensions_lwh = np.array(annotations['dimensions'][instance_column, :])
+    heading_angle = float(annotations['heading_angles'][instance_column])
+
+    return center_xyz, dimensions_lwh, Quaternion(angle=heading_angle, axis=[0, 0, 1])
+
+
 def reapply_frame_transformation(point_cloud: np.ndarray,
                                  instance_id: str,
                                  frame_descriptor: dict) -> np.ndarray:
     annotations = frame_descriptor['annos']
-    ids = annotations['obj_ids']
-
-    instance_index = np.where(ids == instance_id)
-    instance_column = instance_index[0][0]
+    instance_column = get_instance_column(frame_descriptor=frame_descriptor,
+                                          instance_id=instance_id)
 
     center_xyz = annotations['location'][instance_column, :]
     heading_angle = annotations['heading_angles'][instance_column]
@@ -106,12 +126,34 @@ def reapply_frame_transformation(point_cloud: np.ndarray,
                                               Quaternion(angle=heading_angle, axis=[0, 0, 1]),
                                               inverse=False)
 
-    instance_point_cloud = __apply_transformation_matrix(point_cloud=point_cloud,
-                                                         transformation_matrix=reverse_transformation)
+    instance_point_cloud = apply_rigid_transform(point_cloud=point_cloud,
+                                                 transformation_matrix=reverse_transformation)
 
     return instance_point_cloud
 
 
+def get_instance_column(frame_descriptor: dict,
+                        instance_id: str) -> int:
+    """Returns column of the instance in annotations of the frame.
+
+    Runtime complexity is O(1) for descriptors of the columnar cache
+    and O(obj_ids) for pickled descriptors.
+
+    :param frame_descriptor: dict
+        Descriptor of the frame.
+    :param instance_id: str
+        ID of an instance.
+    :return: int
+        Column of the instance in arrays of frame_descriptor['annos'].
+    """
+    if 'instance_columns' in frame_descriptor:
+        return frame_descriptor['instance_columns'][instance_id]
+
+    ids = frame_descriptor['annos']['obj_ids']
+    instance_index = np.where(ids == instance_id)
+    return instance_index[0][0]
+
+
 def get_frame_index(frame_descriptor: dict) -> int:
     # Some of converted waymo formats contain frame_index,
     # while others use sample_idx inside of point_cloud
@@ -125,20 +167,3 @@ def get_frame_index(frame_descriptor: dict) -> int:
         raise Exception(f"Frame descriptor does not have frame_index. Descriptor: {frame_descriptor}")
 
     return frame_index
-
-
-def __apply_transformation_matrix(point_cloud: np.ndarray,
-                                  transformation_matrix: np.ndarray) -> np.ndarray:
-    """Applies given transformation matrix to the given point cloud.
-
-    :param point_cloud: np.ndarray[float]
-        Point cloud to transform of shape [3, n]
-    :param transformation_matrix: np.ndarray[float]
-        Transformation matrix that describes rotation and translation of shape [4, 4].
-    :return: np.ndarray[float]
-        Modified point cloud.
-    """
-    points_count = point_cloud.shape[1]
-    point_cloud[:3, :] = transformation_matrix.dot(
-        np.vstack((point_cloud[:3, :], np.ones(points_count))))[:3, :]
-    return point_cloud
@@ -0,0 +1,148 @@
+import numpy as np
+
+ASSOCIATION_MATCHERS = ['greedy', 'hungarian']
+
+
+def compute_distance_matrix(track_centers: np.ndarray,
+                            detection_centers: np.ndarray) -> np.ndarray:
+    """Computes distances between every track and every detection.
+
+    Runtime complexity is O(k*m).
+
+    :param track_centers: np.ndarray[float]
+        Centers of tracks of shape kx3.
+    :param detection_centers: np.ndarray[float]
+        Centers of detections of shape mx3.
+    :return: np.ndarray[float]
+        Distances of shape kxm.
+    """
+    differences = track_centers[:, np.newaxis, :] - detection_centers[np.newaxis, :, :]
+    return np.sqrt(np.einsum('kmd,kmd->km', differences, differences))
+
+
+def greedy_assignment(costs: np.ndarray) -> tuple:
+    """Assigns rows to columns picking the cheapest of the remaining pairs first.
+
+    Pairs with infinite costs are never assigned.
+
+    Runtime complexity is O(p*log(p)), where p is the count of pairs with finite costs.
+
+    :param costs: np.ndarray[float]
+        Costs of shape kxm.
+    :return: tuple[np.ndarray[int], np.ndarray[int]]
+        Rows and columns of the assigned pairs.
+    """
+    rows, columns = np.nonzero(np.isfinite(costs))
+    order = np.argsort(costs[rows, columns], kind='stable')
+
+    assigned_rows = np.zeros(costs.shape[0], dtype=bool)
+    assigned_columns = np.zeros(costs.shape[1], dtype=bool)
+    matched_rows = list()
+    matched_columns = list()
+
+    for row, column in zip(rows[order], columns[order]):
+        if assigned_rows[row] or assigned_columns[column]:
+            continue
+
+        assigned_rows[row] = True
+        assigned_columns[column] = True
+        matched_rows.append(row)
+        matched_columns.append(column)
+
+    return np.array(matched_rows, dtype=np.int64), np.array(matched_columns, dtype=np.int64)
+
+
+def hungarian_assignment(costs: np.ndarray) -> tuple:
+    """Assigns rows to columns minimising the total cost.
+
+    Pairs with infinite costs are never assigned. Requires scipy.
+
+    Runtime complexity is O(n^3), where n is the larger side of the matrix.
+
+    :param costs: np.ndarray[float]
+        Costs of shape kxm.
+    :return: tuple[np.ndarray[int], np.ndarray[int]]
+        Rows and columns of the assigned pairs.
+    """
+    # scipy is needed only by this matcher, import it only when the matcher is actually used.
+    from scipy.optimize import linear_sum_assignment
+
+    feasible = np.isfinite(costs)
+    if not np.any(feasible):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Forbidden pairs cost more than any feasible assignment, so they are picked only when nothing else is left.
+    forbidden_cost = (np.abs(costs[feasible]).max() + 1) * (min(costs.shape) + 1)
+    rows, columns = linear_sum_assignment(np.where(feasible, costs, forbidden_cost))
+
+    assigned = feasible[rows, columns]
+    return rows[assigned].astype(np.int64), columns[assigned].astype(np.int64)
+
+
+def associate(track_centers: np.ndarray,
+              track_categories: np.ndarray,
+              detection_centers: np.ndarray,
+              detection_categories: np.ndarray,
+              max_distances: np.ndarray,
+              matcher: str = 'greedy') -> np.ndarray:
+    """Matches detections to tracks of the same category.
+
+    Distances are computed per category with a single matrix,
+    a detection is never matched farther than its max distance,
+    and every track is matched at most once.
+
+    Runtime complexity is O(k*m) plus the cost of the matcher.
+
+    :param track_centers: np.ndarray[float]
+        Centers of tracks of shape kx3.
+    :param track_categories: np.ndarray[str]
+        Categories of tracks of shape k.
+    :param detection_centers: np.ndarray[float]
+        Centers of detections of shape mx3.
+    :param detection_categories: np.ndarray[str]
+        Categories of detections of shape m.
+    :param max_distances: np.ndarray[float]
+        Max distance to a track for every detection of shape m.
+    :param matcher: str
+        Assignment algorithm, one of ASSOCIATION_MATCHERS.
+    :return: np.ndarray[int]
+        Index of the matched track for every detection, -1 for unmatched detections.
+    """
+    if matcher == 'greedy':
+        assignment = greedy_assignment
+    elif matcher == 'hungarian':
+        assignment = hungarian_assignment
+    else:
+        raise Exception(f"Unknown matcher {matcher}")
+
+    track_centers = np.asarray(track_centers, dtype=np.float64).reshape(-1, 3)
+    detection_centers = np.asarray(detection_centers, dtype=np.float64).reshape(-1, 3)
+    track_categories = np.asarray(track_categories)
+    detection_categories = np.asarray(detection_categories)
+
+    assert track_centers.shape[0] == track_categories.shape[0], \
+        f"Expected a category per track, got {track_categories.shape[0]} for {track_centers.shape[0]} tracks"
+    assert detection_centers.shape[0] == detection_categories.shape[0] == len(max_distances), \
+        f"Expected a category and a max distance per detection of {detection_centers.shape[0]}"
+
+    matched_tracks = np.full(detection_centers.shape[0], -1, dtype=np.int64)
+    if track_centers.shape[0] == 0 or detection_centers.shape[0] == 0:
+        return matched_tracks
+
+    max_distances = np.asarray(max_distances, dtype=np.float64)
+
+    for category in np.unique(detection_categories):
+        track_indices = np.nonzero(track_categories == category)[0]
+        if len(track_indices) == 0:
+            continue
+
+        detection_indices = np.nonzero(detection_categories == category)[0]
+
+        costs = compute_distance_matrix(track_centers=track_centers[track_indices],
+                                        detection_centers=detection_centers[detection_indices])
+        costs[costs >= max_distances[detection_indices][np.newaxis, :]] = np.inf
+
+        rows, columns = assignment(costs)
+        matched_tracks[detection_indices[columns]] = track_indices[rows]
+
+    return matched_tracks
@@ -0,0 +1,144 @@
+import time
+import numpy as np
+
+from src.tracking.association import associate
+
+
+class OnlineTracker:
+    """Assigns instance ids to boxes of a sequence consuming one frame at a time.
+
+    Tracks are matched to the boxes of the frame with src.tracking.association.
+    Tracks missed for more than max_age frames are dropped, so the state
+    is O(active tracks) whatever the length of the sequence.
+
+    With predict_motion tracks are predicted to the next frame with a constant
+    velocity model, velocities are measured in meters per frame. Otherwise
+    tracks are matched at their last centers: with max_age 0 this is the
+    frame-to-frame association of track_once.py before the tracker was added.
+    """
+
+    def __init__(self,
+                 matcher: str = 'greedy',
+                 max_age: int = 0,
+                 distance_factor: float = 2.0,
+                 predict_motion: bool = False):
+        """Creates a tracker.
+
+        :param matcher: str
+            Assignment algorithm of boxes to tracks, see src.tracking.association.
+        :param max_age: int
+            Count of consecutive frames a track can be missed before it is dropped,
+            0 keeps only the tracks of the previous frame.
+        :param distance_factor: float
+            A box is matched to tracks closer than the factor times its largest dimension.
+        :param predict_motion: bool
+            Predict tracks with their last velocity before matching.
+        """
+        assert max_age >= 0, \
+            f"Max age should not be negative, but got {max_age}"
+        assert distance_factor > 0, \
+            f"Distance factor should be greater than 0, but got {distance_factor}"
+
+        self.__matcher = matcher
+        self.__max_age = max_age
+        self.__distance_factor = distance_factor
+        self.__predict_motion = predict_motion
+        self.reset()
+
+    def reset(self):
+        """Drops all tracks, ids start from 0 again.
+        """
+        self.__track_ids = np.zeros(0, dtype=np.int64)
+        self.__categories = np.zeros(0, dtype=object)
+        self.__centers = np.zeros((0, 3))
+        self.__velocities = np.zeros((0, 3))
+        # Count of frames since the track was matched last time.
+        self.__ages = np.zeros(0, dtype=np.int64)
+
+        self.__tracks_count = 0
+        self.__frames_count = 0
+        self.__update_seconds = 0.0
+
+    @property
+    def active_tracks_count(self) -> int:
+        return len(self.__track_ids)
+
+    @property
+    def tracks_count(self) -> int:
+        return self.__tracks_count
+
+    @property
+    def frames_count(self) -> int:
+        return self.__frames_count
+
+    @property
+    def fps(self) -> float:
+        """Returns count of frames processed per second of update calls.
+        """
+        if self.__update_seconds == 0:
+            return 0.0
+        return self.__frames_count / self.__update_seconds
+
+    def update(self,
+               categories: list,
+               boxes_3d: np.ndarray) -> np.ndarray:
+        """Matches boxes of the next frame to the tracks.
+
+        Runtime complexity is O(k*m) plus the cost of the matcher,
+        where k is the count of active tracks and m is the count of boxes.
+
+        :param categories: list[str]
+            Category of every box.
+        :param boxes_3d: np.ndarray[float]
+            Boxes of the frame of shape mx7: center, length-width-height and heading angle.
+        :return: np.ndarray[int]
+            Instance id of every box.
+        """
+        start = time.perf_counter()
+
+        categories = np.asarray(categories, dtype=object)
+        boxes_3d = np.asarray(boxes_3d, dtype=np.float64).reshape(-1, 7)
+        centers = boxes_3d[:, 0:3]
+
+        assert len(categories) == boxes_3d.shape[0], \
+            f"Expected a category per box, got {len(categories)} categories for {boxes_3d.shape[0]} boxes"
+
+        # Constant velocity prediction: a track missed for a frames moved a + 1 steps since it was matched.
+        predicted_centers = self.__centers + self.__velocities * (self.__ages + 1)[:, np.newaxis] \
+            if self.__predict_motion else self.__centers
+
+        matched_tracks = associate(track_centers=predicted_centers,
+                                   track_categories=self.__categories,
+                                   detection_centers=centers,
+                                   detection_categories=categories,
+                                   max_distances=boxes_3d[:, 3:6].max(axis=1, initial=0) * self.__distance_factor,
+                                   matcher=self.__matcher)
+
+        matched = matched_tracks >= 0
+        instance_ids = np.empty(len(matched_tracks), dtype=np.int64)
+        instance_ids[matched] = self.__track_ids[matched_tracks[matched]]
+
+        unmatched_count = int(np.count_nonzero(~matched))
+        instance_ids[~matched] = np.arange(self.__tracks_count, self.__tracks_count + unmatched_count)
+        self.__tracks_count += unmatched_count
+
+        velocities = np.zeros_like(centers)
+        if self.__predict_motion:
+            velocities[matched] = (centers[matched] - self.__centers[matched_tracks[matched]]) / \
+                (self.__ages[matched_tracks[matched]] + 1)[:, np.newaxis]
+
+        # Missed tracks are kept until they exceed the max age.
+        missed_tracks = np.ones(len(self.__track_ids), dtype=bool)
+        missed_tracks[matched_tracks[matched]] = False
+        missed_tracks &= self.__ages < self.__max_age
+
+        self.__track_ids = np.concatenate((instance_ids, self.__track_ids[missed_tracks]))
+        self.__categories = np.concatenate((categories, self.__categories[missed_tracks]))
+        self.__centers = np.concatenate((centers, self.__centers[missed_tracks]))
+        self.__velocities = np.concatenate((velocities, self.__velocities[missed_tracks]))
+        self.__ages = np.concatenate((np.zeros(len(instance_ids), dtype=np.int64), self.__ages[missed_tracks] + 1))
+
+        self.__frames_count += 1
+        self.__update_seconds += time.perf_counter() - start
+
+        return instance_ids
@@ -0,0 +1,228 @@
+import numpy as np
+
+from pyquaternion import Quaternion
+
+# Larger grids are coarsened, so outliers far from the sensor do not blow up the count of cells.
+MAX_CELLS_COUNT = 2 ** 18
+
+
+class BevGridIndex:
+    """Points of a frame bucketed into a 2D grid over the x-y plane (bird's eye view).
+
+    Point indices are sorted by cell and every cell is a contiguous range of them,
+    i.e. the grid is stored in compressed sparse row layout: order and offsets.
+    Cells of a grid row are adjacent, so points of a box footprint are read
+    with a single slice per row of cells.
+
+    The index does not keep the points, queries take the point cloud the index
+    was built from, so cached indices do not hold frames in memory.
+    """
+
+    def __init__(self,
+                 points_xyz: np.ndarray,
+                 cell_size: float = 2.0):
+        """Builds the index.
+
+        Runtime complexity is O(N*log(N)).
+
+        :param points_xyz: np.ndarray[float]
+            Points of shape 3xn or dxn, only x and y are used.
+        :param cell_size: float
+            Size of a square cell in meters.
+        """
+        assert cell_size > 0, \
+            f"Cell size should be greater than 0, but got {cell_size}"
+
+        points_xy = np.asarray(points_xyz[:2, :], dtype=np.float64)
+        self.__points_count = points_xy.shape[1]
+
+        if self.__points_count == 0:
+            self.__origin = np.zeros(2)
+            self.__cell_size = cell_size
+            self.__shape = np.ones(2, dtype=np.int64)
+            self.__order = np.zeros(0, dtype=np.int32)
+            self.__offsets = np.zeros(2, dtype=np.int32)
+            return
+
+        self.__origin = points_xy.min(axis=1)
+        extent = points_xy.max(axis=1) - self.__origin
+        self.__cell_size = max(cell_size, float(np.sqrt(np.prod(extent + cell_size) / MAX_CELLS_COUNT)))
+
+        cells_xy = np.floor((points_xy - self.__origin[:, np.newaxis]) / self.__cell_size).astype(np.int64)
+        self.__shape = cells_xy.max(axis=1) + 1
+
+        cell_ids = cells_xy[0, :] * self.__shape[1] + cells_xy[1, :]
+        self.__order = np.argsort(cell_ids, kind='stable').astype(np.int32)
+
+        counts = np.bincount(cell_ids, minlength=int(np.prod(self.__shape)))
+        self.__offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int32)
+
+    @property
+    def points_count(self) -> int:
+        return self.__points_count
+
+    @property
+    def cell_size(self) -> float:
+        return self.__cell_size
+
+    @property
+    def nbytes(self) -> int:
+        return self.__order.nbytes + self.__offsets.nbytes
+
+    def get_candidates(self,
+                       lower_xy: np.ndarray,
+                       upper_xy: np.ndarray) -> np.ndarray:
+        """Returns indices of the points in cells overlapping the axis-aligned rectangle.
+
+        Runtime complexity is O(rows + m), where m is the count of returned points.
+
+        :param lower_xy: np.ndarray[float]
+            Lower x and y of the rectangle.
+        :param upper_xy: np.ndarray[float]
+            Upper x and y of the rectangle.
+        :return: np.ndarray[int]
+            Indices of points, in no particular order.
+        """
+        lower_cell = np.floor((np.asarray(lower_xy[:2]) - self.__origin) / self.__cell_size).astype(np.int64)
+        upper_cell = np.floor((np.asarray(upper_xy[:2]) - self.__origin) / self.__cell_size).astype(np.int64)
+
+        if np.any(upper_cell < 0) or np.any(lower_cell >= self.__shape):
+            return np.zeros(0, dtype=np.int32)
+
+        lower_cell = np.maximum(lower_cell, 0)
+        upper_cell = np.minimum(upper_cell, self.__shape - 1)
+
+        row_starts = np.arange(lower_cell[0], upper_cell[0] + 1) * self.__shape[1]
+        starts = self.__offsets[row_starts + lower_cell[1]]
+        ends = self.__offsets[row_starts + upper_cell[1] + 1]
+
+        return np.concatenate([self.__order[start:end] for start, end in zip(starts, ends)])
+
+    def get_points_in_box(self,
+                          points_xyz: np.ndarray,
+                          center_xyz: np.ndarray,
+                          dimensions_lwh: np.ndarray,
+                          rotation: Quaternion) -> tuple:
+        """Returns points inside the box.
+
+        Only points in cells overlapping the footprint of the box are tested.
+
+        :param points_xyz: np.ndarray[float]
+            Points the index was built from of shape 3xn or dxn.
+        :param center_xyz: np.ndarray[float]
+            Center of the box.
+        :param dimensions_lwh: np.ndarray[float]
+            Length, width and height of the box.
+        :param rotation: Quaternion
+            Rotation of the box.
+        :return: tuple[np.ndarray[int], np.ndarray[float]]
+            Sorted indices of the points and their coordinates in the box coordinates of shape 3xm.
+        """
+        assert points_xyz.shape[1] == self.__points_count, \
+            f"Index is built for {self.__points_count} points, but got {points_xyz.shape[1]} points"
+
+        center_xyz = np.asarray(center_xyz, dtype=np.float64)
+        half_dimensions = np.asarray(dimensions_lwh, dtype=np.float64) / 2
+        rotation_matrix = rotation.rotation_matrix
+
+        # Axis-aligned bounds of the rotated box with a margin for rounding of the points.
+        half_extent = np.abs(rotation_matrix).dot(half_dimensions) + 1e-6
+        lower_bound = center_xyz - half_extent
+        upper_bound = center_xyz + half_extent
+
+        candidates = np.sort(self.get_candidates(lower_xy=lower_bound, upper_xy=upper_bound))
+
+        candidate_points = points_xyz[:3, candidates]
+        within_bounds = np.all((candidate_points >= lower_bound[:, np.newaxis]) &
+                               (candidate_points <= upper_bound[:, np.newaxis]), axis=0)
+        candidates = candidates[within_bounds]
+
+        # Points inside the box are exactly the points within half of the size in box coordinates.
+        box_points = rotation_matrix.T.dot(points_xyz[:3, candidates] - center_xyz[:, np.newaxis])
+        mask = np.all(np.abs(box_points) <= half_dimensions[:, np.newaxis], axis=0)
+
+        return candidates[mask], box_points[:, mask]
+
+
+def get_patched_points_in_box_mask(grid_index: BevGridIndex,
+                                   original_point_cloud: np.ndarray,
+                                   point_cloud: np.ndarray,
+                                   origin_indices: np.ndarray,
+                                   center_xyz: np.ndarray,
+                                   dimensions_lwh: np.ndarray,
+                                   rotation: Quaternion) -> np.ndarray:
+    """Returns mask of the points of a patched frame inside the box.
+
+    See get_patched_points_in_boxes_mask.
+
+    :param grid_index: BevGridIndex
+        Index of the original frame.
+    :param original_point_cloud: np.ndarray[float]
+        Original frame point cloud.
+    :param point_cloud: np.ndarray[float]
+        Patched frame point cloud.
+    :param origin_indices: np.ndarray[int]
+        Index of every point of the patched frame in the original frame, -1 for inserted points.
+    :return: np.ndarray[bool]
+        Mask of the points of the patched frame.
+    """
+    return get_patched_points_in_boxes_mask(grid_index=grid_index,
+                                            original_point_cloud=original_point_cloud,
+                                            point_cloud=point_cloud,
+                                            origin_indices=origin_indices,
+                                            boxes=[(center_xyz, dimensions_lwh, rotation)])
+
+
+def get_patched_points_in_boxes_mask(grid_index: BevGridIndex,
+                                     original_point_cloud: np.ndarray,
+                                     point_cloud: np.ndarray,
+                                     origin_indices: np.ndarray,
+                                     boxes: list) -> np.ndarray:
+    """Returns mask of the points of a patched frame inside any of the boxes.
+
+    Points left from the original frame are looked up in the index of the original frame,
+    only inserted points are tested directly. Indices of all boxes are collected first,
+    so the mask of the frame is built once rather than once per box.
+
+    Runtime complexity is O(N + k*(m + I)), where k is the count of boxes,
+    m is the count of points near a box and I is the count of inserted points.
+
+    :param grid_index: BevGridIndex
+        Index of the original frame.
+    :param original_point_cloud: np.ndarray[float]
+        Original frame point cloud.
+    :param point_cloud: np.ndarray[float]
+        Patched frame point cloud.
+    :param origin_indices: np.ndarray[int]
+        Index of every point of the patched frame in the original frame, -1 for inserted points.
+    :param boxes: list[tuple[np.ndarray, np.ndarray, Quaternion]]
+        Center, length-width-height and rotation of every box.
+    :return: np.ndarray[bool]
+        Mask of the points of the patched frame.
+    """
+    in_boxes = np.zeros(grid_index.points_count, dtype=bool)
+    for center_xyz, dimensions_lwh, rotation in boxes:
+        original_indices, _ = grid_index.get_points_in_box(points_xyz=original_point_cloud,
+                                                           center_xyz=center_xyz,
+                                                           dimensions_lwh=dimensions_lwh,
+                                                           rotation=rotation)
+        in_boxes[original_indices] = True
+
+    inserted = origin_indices < 0
+    if not np.any(inserted) and point_cloud.shape[1] == grid_index.points_count:
+        # Nothing is patched yet, points are in the order of the original frame.
+        return in_boxes
+
+    mask = np.zeros(point_cloud.shape[1], dtype=bool)
+    mask[~inserted] = in_boxes[origin_indices[~inserted]]
+
+    if np.any(inserted):
+        inserted_points = point_cloud[:3, inserted].astype(np.float64)
+        inserted_mask = np.zeros(inserted_points.shape[1], dtype=bool)
+        for center_xyz, dimensions_lwh, rotation in boxes:
+            box_points = rotation.rotation_matrix.T.dot(inserted_points -
+                                                        np.asarray(center_xyz, dtype=np.float64)[:, np.newaxis])
+            inserted_mask |= np.all(np.abs(box_points) <= np.asarray(dimensions_lwh)[:, np.newaxis] / 2, axis=0)
+        mask[inserted] = inserted_mask
+
+    return mask
@@ -1,8 +1,11 @@
+from typing import Optional
+
 from src.datasets.dataset import Dataset
 
 
 def group_instances_across_frames(scene_id: str,
-                                  dataset: Dataset) -> dict:
+                                  dataset: Dataset,
+                                  instances_per_frame: Optional[dict] = None) -> dict:
     """ Returns a dictionary of instances associated with the frames which contain them.
 
     Runtime complexity is O(frames * instances).
@@ -11,17 +14,18 @@ def group_instances_across_frames(scene_id: str,
         ID of a scene where grouping is required.
     :param dataset: 'Dataset'
         Dataset.
+    :param instances_per_frame: Optional[dict[str, list[str]]]
+        Result of list_instances_per_frame if it is already known.
     :return: dict[str, list[str]]
         Returns a dict of pairs of instance id to the list of ids of frames.
     """
 
-    grouped_instances = dict()
-
-    scene_iterator = dataset.get_scene_iterator(scene_id=scene_id)
+    if instances_per_frame is None:
+        instances_per_frame = list_instances_per_frame(scene_id=scene_id, dataset=dataset)
 
-    for frame_id, frame in scene_iterator:
-        instances_ids = frame.instances_ids
+    grouped_instances = dict()
 
+    for frame_id, instances_ids in instances_per_frame.items():
         for instance_id in instances_ids:
             if instance_id not in grouped_instances:
                 grouped_instances[instance_id] = list()
@@ -31,9 +35,88 @@ def group_instances_across_frames(scene_id: str,
     return grouped_instances
 
 
+def list_instances_per_frame(scene_id: str,
+                             dataset: Dataset) -> dict:
+    """ Returns a dictionary of frames associated with the instances they contain.
+
+    Frames are ordered the same way as the scene iterator returns them.
+
+    Runtime complexity is O(frames * instances).
+
+    :param scene_id: int
+        ID of a scene.
+    :param dataset: 'Dataset'
+        Dataset.
+    :return: dict[str, list[str]]
+        Returns an ordered dict of pairs of frame id to the list of ids of instances.
+    """
+
+    instances_per_frame = dict()
+
+    scene_iterator = dataset.get_scene_iterator(scene_id=scene_id)
+
+    for frame_id, frame in scene_iterator:
+        instances_per_frame[frame_id] = list(frame.instances_ids)
+
+    return instances_per_frame
+
+
+def iterate_patched_frames(dataset: Dataset,
+                           scene_id: str):
+    """Iterates through patched point clouds of the scene in frame order.
+
+    Frames without a serialised patched point cloud are skipped,
+    deltas are reconstructed one frame at a time.
+
+    :param dataset: Dataset
+        Dataset to which the scene belongs to.
+    :param scene_id: str
+        Unique scene identifier.
+    :return:
+        Pairs of frame id and patched point cloud of shape dxn.
+    """
+    serialised_frame_ids = dataset.get_serialised_frame_ids(scene_id=scene_id)
+
+    scene_iterator = dataset.get_scene_iterator(scene_id=scene_id)
+    for frame_id, _ in scene_iterator:
+        if frame_id not in serialised_frame_ids:
+            continue
+
+        yield frame_id, dataset.get_patched_frame_point_cloud(scene_id=scene_id,
+                                                              frame_id=frame_id)
+
+
+def get_skippable_frame_ids(dataset: Dataset,
+                            scene_id: str,
+                            force_overwrite: bool) -> set:
+    """Returns frames of the scene that can be skipped.
+
+    Frames are skippable if there is a point cloud saved on disk
+    and force overwrite flag is False. Saved point clouds of the whole
+    scene are resolved at once with Dataset.get_serialised_frame_ids.
+
+    Runtime complexity is O(frames).
+
+    :param dataset: Dataset
+        Dataset to which the scene belongs to.
+    :param scene_id: str
+        Unique scene identifier.
+    :param force_overwrite: bool
+        Flag that forces all frames to be non-skippable if
+        True.
+    :return: set[str]
+        IDs of skippable frames.
+    """
+    if force_overwrite:
+        return set()
+
+    return dataset.get_serialised_frame_ids(scene_id=scene_id)
+
+
 def can_skip_scene(dataset: Dataset,
                    scene_id: str,
-                   force_overwrite: bool) -> bool:
+                   force_overwrite: bool,
+                   skippable_frame_ids: Optional[set] = None) -> bool:
     """Checks whether it is possible to skip a scene.
 
     Scene is considered as skippable if and only if
@@ -49,16 +132,19 @@ def can_skip_scene(dataset: Dataset,
     :param force_overwrite: bool
         Flag that forces a frame to be non-skippable if
         True.
+    :param skippable_frame_ids: Optional[set]
+        Result of get_skippable_frame_ids if it is already known.
     :return:
         True if can skip scene handling and False otherwise.
     """
+    if skippable_frame_ids is None:
+        skippable_frame_ids = get_skippable_frame_ids(dataset=dataset,
+                                                      scene_id=scene_id,
+                                                      force_overwrite=force_overwrite)
 
     scene_iterator = dataset.get_scene_iterator(scene_id=scene_id)
     for frame_id, frame in scene_iterator:
-        if not can_skip_frame(dataset=dataset,
-                              scene_id=scene_id,
-                              frame_id=frame_id,
-                              force_overwrite=force_overwrite):
+        if frame_id not in skippable_frame_ids:
             return False
     return True
 
@@ -0,0 +1,43 @@
+import numpy as np
+
+# Point clouds are stored as float32 by every dataset, wider types only double memory and bandwidth.
+DEFAULT_POINT_CLOUD_DTYPE = np.dtype(np.float32)
+
+POINT_CLOUD_DTYPES = {
+    'float32': np.dtype(np.float32),
+    'float64': np.dtype(np.float64),
+}
+
+
+def get_point_cloud_dtype(name: str) -> np.dtype:
+    """Returns the dtype of point clouds by its name.
+
+    :param name: str
+        Name of the dtype, one of POINT_CLOUD_DTYPES.
+    :return: np.dtype
+        Dtype of point clouds.
+    """
+    if name not in POINT_CLOUD_DTYPES:
+        raise Exception(f"Unknown point cloud dtype {name}, supported dtypes are {list(POINT_CLOUD_DTYPES)}")
+
+    return POINT_CLOUD_DTYPES[name]
+
+
+def as_point_cloud_dtype(point_cloud: np.ndarray,
+                         dtype: np.dtype = DEFAULT_POINT_CLOUD_DTYPE) -> np.ndarray:
+    """Returns the point cloud in the given dtype.
+
+    Point clouds already in the dtype are returned as is, including read-only views,
+    others are converted into a new array.
+
+    :param point_cloud: np.ndarray[float]
+        Point cloud of shape dxn.
+    :param dtype: np.dtype
+        Dtype of point clouds.
+    :return: np.ndarray[float]
+        Point cloud of shape dxn and the given dtype.
+    """
+    if point_cloud.dtype == dtype:
+        return point_cloud
+
+    return point_cloud.astype(dtype)
@@ -1,5 +1,7 @@
 import os
 
+from collections import defaultdict
+
 
 def list_all_files_with_extension(files: list,
                                   extension: str,
@@ -16,3 +18,33 @@ def list_all_files_with_extension(files: list,
                                                         shallow=shallow))
 
     return result
+
+
+def filter_existing_files(paths: list) -> set:
+    """Returns the given paths that exist.
+
+    Every parent folder is listed once with os.scandir
+    instead of checking every path with os.path.exists.
+
+    Runtime complexity is O(paths + files in the folders).
+
+    :param paths: list[str]
+        Paths to check.
+    :return: set[str]
+        Paths that exist.
+    """
+    paths_by_folder = defaultdict(list)
+    for path in paths:
+        paths_by_folder[os.path.dirname(path)].append(path)
+
+    existing_paths = set()
+    for folder, folder_paths in paths_by_folder.items():
+        try:
+            with os.scandir(folder if len(folder) > 0 else '.') as entries:
+                names = {entry.name for entry in entries}
+        except FileNotFoundError:
+            continue
+
+        existing_paths.update(path for path in folder_paths if os.path.basename(path) in names)
+
+    return existing_paths
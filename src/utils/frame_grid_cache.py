@@ -0,0 +1,90 @@
+import threading
+import numpy as np
+
+from collections import OrderedDict
+
+from src.utils.bev_grid_index import BevGridIndex
+
+
+class FrameGridCache:
+    """Least recently used cache of grid indices of frames.
+
+    Frames are visited many times while a scene is processed: once per accumulated
+    instance and once more when the frame is patched. The cache builds the index of
+    a frame on first use and shares it between extraction and patching.
+
+    Only indices are cached, frames are loaded by the dataset as usual.
+    The capacity should cover every frame of a scene: instances visit frames
+    in their own order, so a smaller cache misses and rebuilds indices.
+    """
+
+    def __init__(self,
+                 capacity: int,
+                 cell_size: float = 2.0):
+        """Creates a cache.
+
+        :param capacity: int
+            Max count of cached frames.
+        :param cell_size: float
+            Size of a grid cell in meters, see BevGridIndex.
+        """
+        assert capacity > 0, \
+            f"Capacity should be greater than 0, but got {capacity}"
+
+        self.__capacity = capacity
+        self.__cell_size = cell_size
+        self.__lock = threading.Lock()
+        self.__indices = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__indices)
+
+    @property
+    def nbytes(self) -> int:
+        with self.__lock:
+            return sum(grid_index.nbytes for grid_index in self.__indices.values())
+
+    def get_grid_index(self,
+                       scene_id: str,
+                       frame_id: str,
+                       frame_point_cloud: np.ndarray) -> BevGridIndex:
+        """Returns index of the frame, building it if the frame is not cached.
+
+        :param scene_id: str
+            ID of a scene.
+        :param frame_id: str
+            ID of a frame.
+        :param frame_point_cloud: np.ndarray[float]
+            Original point cloud of the frame.
+        :return: BevGridIndex
+            Index of the frame.
+        """
+        key = (scene_id, frame_id)
+
+        with self.__lock:
+            if key in self.__indices:
+                self.__indices.move_to_end(key)
+                return self.__indices[key]
+
+        grid_index = BevGridIndex(points_xyz=frame_point_cloud, cell_size=self.__cell_size)
+
+        with self.__lock:
+            self.__indices[key] = grid_index
+            self.__indices.move_to_end(key)
+            while len(self.__indices) > self.__capacity:
+                self.__indices.popitem(last=False)
+
+        return grid_index
+
+    def discard(self,
+                scene_id: str,
+                frame_id: str):
+        """Drops index of the frame, e.g. once the frame is patched.
+
+        :param scene_id: str
+            ID of a scene.
+        :param frame_id: str
+            ID of a frame.
+        """
+        with self.__lock:
+            self.__indices.pop((scene_id, frame_id), None)
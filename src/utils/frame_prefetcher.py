@@ -0,0 +1,87 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from src.datasets.dataset import Dataset
+
+
+class FramePrefetcher:
+    """Loads frames ahead of their use in a known order.
+
+    While the caller handles a frame, the next frames are read on a small thread pool.
+    At most lookahead frames are loaded and not yet consumed at any time, so memory
+    stays bounded by the size of lookahead frames.
+
+    Memory-mapped frames are views that are read on access,
+    prefetching them only saves opening the files.
+    """
+
+    def __init__(self,
+                 dataset: Dataset,
+                 frames: list,
+                 lookahead: int = 2,
+                 num_threads: int = 1):
+        """Creates a prefetcher.
+
+        :param dataset: Dataset
+            Dataset to load frames from.
+        :param frames: list[tuple[str, str]]
+            Ordered pairs of scene id and frame id.
+        :param lookahead: int
+            Count of frames loaded ahead, 0 loads every frame when it is requested.
+        :param num_threads: int
+            Count of loading threads.
+        """
+        assert lookahead >= 0, \
+            f"Lookahead should not be negative, but got {lookahead}"
+        assert num_threads > 0, \
+            f"Count of threads should be greater than 0, but got {num_threads}"
+
+        self.__dataset = dataset
+        self.__frames = frames
+        self.__lookahead = lookahead
+        self.__num_threads = num_threads
+
+    def __len__(self) -> int:
+        return len(self.__frames)
+
+    def __iter__(self):
+        """Iterates through frames in the given order.
+
+        :return:
+            Triplets of scene id, frame id and frame point cloud.
+        """
+        if self.__lookahead == 0:
+            for scene_id, frame_id in self.__frames:
+                yield scene_id, frame_id, self.__load_frame(scene_id, frame_id)
+            return
+
+        executor = ThreadPoolExecutor(max_workers=min(self.__num_threads, self.__lookahead))
+        frames_iterator = iter(self.__frames)
+        pending = deque()
+
+        def submit(scene_id: str, frame_id: str):
+            pending.append((scene_id, frame_id, executor.submit(self.__load_frame, scene_id, frame_id)))
+
+        try:
+            for scene_id, frame_id in islice(frames_iterator, self.__lookahead):
+                submit(scene_id, frame_id)
+
+            while len(pending) > 0:
+                scene_id, frame_id, future = pending.popleft()
+                frame_point_cloud = future.result()
+
+                next_frame = next(frames_iterator, None)
+                if next_frame is not None:
+                    submit(*next_frame)
+
+                yield scene_id, frame_id, frame_point_cloud
+        finally:
+            # Stopping early drops frames that have not been loaded yet.
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def __load_frame(self,
+                     scene_id: str,
+                     frame_id: str):
+        return self.__dataset.get_frame_point_cloud(scene_id=scene_id,
+                                                    frame_id=frame_id)
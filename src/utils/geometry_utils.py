@@ -1,5 +1,9 @@
 import numpy as np
 from pyquaternion import Quaternion
+from typing import Optional
+
+from src.utils.bev_grid_index import BevGridIndex
+from src.utils.rigid_transform import apply_rigid_transform
 
 
 def transform_matrix(translation: np.ndarray = np.array([0, 0, 0]),
@@ -114,7 +118,47 @@ def apply_transformation_matrix(point_cloud: np.ndarray,
     :return: np.ndarray[float]
         Modified point cloud.
     """
-    points_count = point_cloud.shape[1]
-    point_cloud[:3, :] = transformation_matrix.dot(
-        np.vstack((point_cloud[:3, :], np.ones(points_count))))[:3, :]
-    return point_cloud
+    return apply_rigid_transform(point_cloud=point_cloud,
+                                 transformation_matrix=transformation_matrix)
+
+
+def extract_box_point_clouds(frame_point_cloud: np.ndarray,
+                             boxes: dict,
+                             grid_index: Optional[BevGridIndex] = None) -> dict:
+    """Extracts points of every box and moves them to the box coordinates.
+
+    Points are looked up in the grid index of the frame, so only points in cells
+    overlapping the footprint of a box are transformed to the box coordinates
+    and tested against the box.
+
+    Runtime complexity is O(N*log(N) + k*m) with building the index and O(k*m) with a given index,
+    where k is the count of boxes and m is the count of points near a box.
+
+    :param frame_point_cloud: np.ndarray[float]
+        Point cloud of the frame of shape dxn.
+    :param boxes: dict[str, tuple[np.ndarray, np.ndarray, Quaternion]]
+        Pairs of instance id to center, length-width-height and rotation of its box.
+    :param grid_index: Optional[BevGridIndex]
+        Index of the frame, built if not given, see FrameGridCache.
+    :return: dict[str, np.ndarray[float]]
+        Pairs of instance id to the points of its box in the box coordinates,
+        points keep their order in the frame.
+    """
+    instance_point_clouds = dict()
+    if len(boxes) == 0:
+        return instance_point_clouds
+
+    if grid_index is None:
+        grid_index = BevGridIndex(points_xyz=frame_point_cloud)
+
+    for instance_id, (center_xyz, dimensions_lwh, rotation) in boxes.items():
+        indices, box_points = grid_index.get_points_in_box(points_xyz=frame_point_cloud,
+                                                           center_xyz=center_xyz,
+                                                           dimensions_lwh=dimensions_lwh,
+                                                           rotation=rotation)
+
+        instance_point_cloud = frame_point_cloud[:, indices]
+        instance_point_cloud[:3, :] = box_points
+        instance_point_clouds[instance_id] = instance_point_cloud
+
+    return instance_point_clouds
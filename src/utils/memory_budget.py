@@ -0,0 +1,115 @@
+from contextlib import contextmanager
+from multiprocessing.managers import SyncManager
+from typing import Optional
+
+
+class SceneMemoryReporter:
+    """Reports live memory of a single scene to the shared budget.
+    """
+
+    def __init__(self,
+                 scene_id: str,
+                 live_bytes_lookup):
+        self.__scene_id = scene_id
+        self.__live_bytes_lookup = live_bytes_lookup
+        self.__peak_bytes = 0
+
+    @property
+    def peak_bytes(self) -> int:
+        return self.__peak_bytes
+
+    def report(self, live_bytes: int):
+        """Updates live memory of the scene.
+
+        :param live_bytes: int
+            Bytes currently held by the scene, e.g. accumulated instance clouds.
+        """
+        self.__peak_bytes = max(self.__peak_bytes, live_bytes)
+        self.__live_bytes_lookup[self.__scene_id] = live_bytes
+
+
+class MemoryBudget:
+    """Admission control of scenes based on a global memory budget.
+
+    Every running scene reports its live bytes. A new scene is admitted
+    only if the projected total fits into the budget. The projection of
+    a running scene is the maximum of its live bytes and the expected peak,
+    the expected peak is the mean peak of already finished scenes.
+
+    Until the first scene finishes, the expected peak is the default peak.
+    Without a default peak scenes are admitted one at a time until
+    a peak is known, so the first wave of workers cannot overshoot the budget.
+
+    A scene is always admitted when nothing else is running,
+    so a single scene larger than the budget still makes progress.
+    """
+
+    def __init__(self,
+                 manager: SyncManager,
+                 budget_bytes: Optional[int],
+                 default_peak_bytes: Optional[int] = None):
+        """Creates the budget.
+
+        :param manager: 'SyncManager'
+            Manager that owns the shared state.
+        :param budget_bytes: Optional[int]
+            Budget in bytes, None disables admission control
+            but keeps reporting peaks.
+        :param default_peak_bytes: Optional[int]
+            Expected peak of a scene before any scene finishes,
+            None admits scenes one at a time until then.
+        """
+        assert budget_bytes is None or budget_bytes > 0, \
+            f"Memory budget should be positive, got {budget_bytes}"
+        assert default_peak_bytes is None or default_peak_bytes > 0, \
+            f"Default peak should be positive, got {default_peak_bytes}"
+
+        self.__budget_bytes = budget_bytes
+        self.__default_peak_bytes = default_peak_bytes
+        self.__live_bytes_lookup = manager.dict()
+        self.__finished_peaks = manager.list()
+        self.__condition = manager.Condition()
+
+    @contextmanager
+    def admit(self, scene_id: str):
+        """Blocks until the scene fits into the budget and tracks it until the context exits.
+
+        :param scene_id: str
+            Unique scene identifier.
+        :return: 'SceneMemoryReporter'
+            Reporter of the live memory of the scene.
+        """
+        with self.__condition:
+            while not self.__can_admit():
+                self.__condition.wait()
+            self.__live_bytes_lookup[scene_id] = 0
+
+        reporter = SceneMemoryReporter(scene_id=scene_id,
+                                       live_bytes_lookup=self.__live_bytes_lookup)
+        try:
+            yield reporter
+        finally:
+            with self.__condition:
+                del self.__live_bytes_lookup[scene_id]
+                self.__finished_peaks.append(reporter.peak_bytes)
+                self.__condition.notify_all()
+
+    def __can_admit(self) -> bool:
+        if self.__budget_bytes is None:
+            return True
+
+        live_bytes = list(self.__live_bytes_lookup.values())
+        if len(live_bytes) == 0:
+            return True
+
+        finished_peaks = list(self.__finished_peaks)
+        if len(finished_peaks) > 0:
+            expected_peak = sum(finished_peaks) / len(finished_peaks)
+        elif self.__default_peak_bytes is not None:
+            expected_peak = self.__default_peak_bytes
+        else:
+            # Nothing is known about the size of a scene yet.
+            return False
+
+        projected_bytes = sum(max(b, expected_peak) for b in live_bytes) + expected_peak
+        return projected_bytes <= self.__budget_bytes
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import numpy as np
+import open3d as o3d
+
+from typing import Optional
+
+# Edges of a box between corners in the order of get_boxes_corners.
+BOX_EDGES = np.array([[0, 1], [1, 2], [2, 3], [3, 0],
+                      [4, 5], [5, 6], [6, 7], [7, 4],
+                      [0, 4], [1, 5], [2, 6], [3, 7]])
+
+BOX_COLOR = [255.0 / 255.0, 215.0 / 255.0, 0.0 / 255.0]
+
+
+def get_boxes_corners(boxes_3d: np.ndarray) -> np.ndarray:
+    """Returns corners of the boxes.
+
+    The first four corners of a box are the ones facing forward.
+
+    Runtime complexity is O(m).
+
+    :param boxes_3d: np.ndarray[float]
+        Boxes of shape mx7 in [cx, cy, cz, dx, dy, dz, heading] format.
+    :return: np.ndarray[float]
+        Corners of shape mx8x3.
+    """
+    boxes_3d = np.asarray(boxes_3d, dtype=np.float64).reshape(-1, 7)
+
+    signs = np.array([[1, 1, 1], [1, -1, 1], [1, -1, -1], [1, 1, -1],
+                      [-1, 1, 1], [-1, -1, 1], [-1, -1, -1], [-1, 1, -1]])
+    corners = signs[np.newaxis, :, :] * boxes_3d[:, np.newaxis, 3:6] / 2
+
+    cos, sin = np.cos(boxes_3d[:, 6]), np.sin(boxes_3d[:, 6])
+    rotated_x = corners[:, :, 0] * cos[:, np.newaxis] - corners[:, :, 1] * sin[:, np.newaxis]
+    rotated_y = corners[:, :, 0] * sin[:, np.newaxis] + corners[:, :, 1] * cos[:, np.newaxis]
+
+    return np.stack((rotated_x, rotated_y, corners[:, :, 2]), axis=2) + boxes_3d[:, np.newaxis, 0:3]
+
+
+class OffscreenRenderer:
+    """Renders frames to images with a single hidden open3d window.
+
+    The window, the camera and the geometry are created once: every frame
+    replaces points of the point cloud and of the boxes in place, so rendering
+    a sequence costs a redraw per frame instead of a new window per frame.
+    """
+
+    def __init__(self,
+                 camera_position: Optional[str] = None,
+                 point_size: float = 2,
+                 width: int = 1920,
+                 height: int = 1080):
+        """Creates the window.
+
+        :param camera_position: Optional[str]
+            Position of a camera obtained by pressing P in o3d window, read once.
+        :param point_size: float
+            Size of a single point in the image.
+        :param width: int
+            Width of the images.
+        :param height: int
+            Height of the images.
+        """
+        self.__camera_parameters = o3d.io.read_pinhole_camera_parameters(camera_position) \
+            if camera_position is not None else None
+
+        self.__visualiser = o3d.visualization.Visualizer()
+        self.__visualiser.create_window(visible=False, width=width, height=height)
+        self.__visualiser.get_render_option().point_size = point_size
+
+        self.__point_cloud = o3d.geometry.PointCloud()
+        self.__boxes = o3d.geometry.LineSet()
+        self.__has_geometry = False
+
+    def __enter__(self) -> OffscreenRenderer:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def render(self,
+               points: np.ndarray,
+               boxes_3d: np.ndarray,
+               image_path: str):
+        """Renders the frame and saves the image.
+
+        :param points: np.ndarray[float]
+            Point cloud as a mxk float numpy array.
+        :param boxes_3d: np.ndarray[float]
+            Boxes of shape mx7 in [cx, cy, cz, dx, dy, dz, heading] format.
+        :param image_path: str
+            Path of the image.
+        """
+        points_count = points.shape[0]
+        self.__point_cloud.points = o3d.utility.Vector3dVector(np.asarray(points[:, 0:3], dtype=np.float64))
+        self.__point_cloud.colors = o3d.utility.Vector3dVector(np.zeros((points_count, 3)))
+
+        corners = get_boxes_corners(boxes_3d)
+        lines = (BOX_EDGES[np.newaxis, :, :] + 8 * np.arange(corners.shape[0])[:, np.newaxis, np.newaxis])
+        self.__boxes.points = o3d.utility.Vector3dVector(corners.reshape(-1, 3))
+        self.__boxes.lines = o3d.utility.Vector2iVector(lines.reshape(-1, 2))
+        self.__boxes.colors = o3d.utility.Vector3dVector(np.tile(BOX_COLOR, (lines.shape[0] * lines.shape[1], 1)))
+
+        if not self.__has_geometry:
+            # Adding geometry resets the view, so the camera is set right after the first frame is added.
+            self.__visualiser.add_geometry(self.__point_cloud)
+            self.__visualiser.add_geometry(self.__boxes)
+            if self.__camera_parameters is not None:
+                self.__visualiser.get_view_control().convert_from_pinhole_camera_parameters(self.__camera_parameters)
+            self.__has_geometry = True
+        else:
+            self.__visualiser.update_geometry(self.__point_cloud)
+            self.__visualiser.update_geometry(self.__boxes)
+
+        self.__visualiser.poll_events()
+        self.__visualiser.update_renderer()
+        self.__visualiser.capture_screen_image(image_path, do_render=True)
+
+    def close(self):
+        self.__visualiser.destroy_window()
@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import os
+import threading
+import numpy as np
+
+from typing import Optional
+
+INDEX_SUFFIX = '.index.npz'
+
+
+class PackedSceneArchive:
+    """Frames of a scene packed into a single contiguous float32 file.
+
+    Every frame is stored as nxd float32 values, exactly like a .bin frame file.
+    The index file next to the archive keeps frame ids, offsets and counts of points.
+    Reading a frame is a single pread or a slice of the memory-mapped archive.
+
+    The archive opens the file lazily and can be pickled to worker processes.
+    """
+
+    def __init__(self, path: str):
+        """Opens an archive.
+
+        :param path: str
+            Path to the archive, the index is expected at path + '.index.npz'.
+        """
+        self.__path = path
+        self.__lock = threading.Lock()
+        self.__file = None
+        self.__mmap = None
+
+        self.__dimensions, self.__frames_lookup = load_archive_index(path)
+
+    def __getstate__(self) -> dict:
+        return {'path': self.__path}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state['path'])
+
+    def __contains__(self, frame_id: str) -> bool:
+        return str(frame_id) in self.__frames_lookup
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def dimensions(self) -> int:
+        return self.__dimensions
+
+    @property
+    def frame_ids(self) -> list:
+        return list(self.__frames_lookup.keys())
+
+    def get_frame_point_cloud(self,
+                              frame_id: str,
+                              use_mmap: bool = False) -> np.ndarray:
+        """Reads a frame.
+
+        :param frame_id: str
+            ID of a frame.
+        :param use_mmap: bool
+            Return a read-only view of the memory-mapped archive.
+        :return: np.ndarray[float]
+            Point cloud of shape dxn.
+        """
+        offset, count = self.__frames_lookup[str(frame_id)]
+
+        if use_mmap:
+            with self.__lock:
+                if self.__mmap is None:
+                    self.__mmap = np.memmap(self.__path, dtype=np.float32, mode='r')
+            return self.__mmap[offset * self.__dimensions:(offset + count) * self.__dimensions] \
+                .reshape(-1, self.__dimensions).T
+
+        points = np.empty((count, self.__dimensions), dtype=np.float32)
+        buffer = memoryview(points).cast('B')
+        offset_bytes = offset * self.__dimensions * points.itemsize
+
+        with self.__lock:
+            if self.__file is None:
+                self.__file = open(self.__path, 'rb', buffering=0)
+
+        if hasattr(os, 'preadv'):
+            read_bytes = os.preadv(self.__file.fileno(), [buffer], offset_bytes)
+        else:
+            with self.__lock:
+                self.__file.seek(offset_bytes)
+                read_bytes = self.__file.readinto(buffer)
+
+        if read_bytes != buffer.nbytes:
+            raise IOError(f"Expected {buffer.nbytes} bytes of frame {frame_id}, read {read_bytes} from {self.__path}")
+
+        return points.T
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        self.__mmap = None
+
+
+class PackedSceneArchiveWriter:
+    """Appends frames to a packed scene archive.
+
+    The index is kept in memory and atomically replaced on flush or close,
+    so appending a frame is O(points of the frame) whatever the size of the scene.
+    Points of a frame are appended before the index is replaced, so an interrupted
+    write never corrupts frames that are already in the index: frames appended
+    after the last flush are dropped when the archive is opened again.
+    Writing a frame that is already in the archive appends a new copy and
+    points the index to it.
+    """
+
+    def __init__(self,
+                 path: str,
+                 dimensions: int):
+        """Opens an archive for writing, existing frames are kept.
+
+        :param path: str
+            Path to the archive.
+        :param dimensions: int
+            Count of values per point.
+        """
+        self.__path = path
+        self.__dimensions = dimensions
+        self.__frames_lookup = dict()
+        self.__has_unsaved_frames = False
+
+        dir_path = os.path.dirname(path)
+        if len(dir_path) > 0:
+            os.makedirs(dir_path, exist_ok=True)
+
+        if os.path.exists(path + INDEX_SUFFIX):
+            existing_dimensions, self.__frames_lookup = load_archive_index(path)
+            assert existing_dimensions == dimensions, \
+                f"Archive {path} has {existing_dimensions} dimensions, expected {dimensions}"
+
+        # Drops a partially written frame that did not make it to the index.
+        end = max((offset + count for offset, count in self.__frames_lookup.values()), default=0)
+        with open(path, 'ab') as file:
+            file.truncate(end * dimensions * np.dtype(np.float32).itemsize)
+
+    def __enter__(self) -> PackedSceneArchiveWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __contains__(self, frame_id: str) -> bool:
+        return str(frame_id) in self.__frames_lookup
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def frame_ids(self) -> list:
+        return list(self.__frames_lookup.keys())
+
+    def append(self,
+               frame_id: str,
+               point_cloud: np.ndarray):
+        """Appends a frame to the archive.
+
+        :param frame_id: str
+            ID of a frame.
+        :param point_cloud: np.ndarray[float]
+            Point cloud of shape dxn.
+        """
+        assert point_cloud.shape[0] == self.__dimensions, \
+            f"Expected {self.__dimensions} dimensions, got {point_cloud.shape[0]}"
+
+        points = np.ascontiguousarray(point_cloud.T, dtype=np.float32)
+        bytes_per_point = self.__dimensions * points.itemsize
+
+        with open(self.__path, 'ab') as file:
+            offset = file.tell() // bytes_per_point
+            file.write(points.tobytes())
+
+        self.__frames_lookup[str(frame_id)] = (offset, points.shape[0])
+        self.__has_unsaved_frames = True
+
+    def flush(self):
+        """Saves the index, so readers see all appended frames.
+        """
+        if self.__has_unsaved_frames:
+            save_archive_index(self.__path, self.__dimensions, self.__frames_lookup)
+            self.__has_unsaved_frames = False
+
+    def close(self):
+        self.flush()
+
+
+class PackedArchiveCollection:
+    """Packed archives of all scenes of a dataset, one archive per scene under the root folder.
+    """
+
+    def __init__(self, root: str):
+        self.__root = root
+        self.__archives = dict()
+        self.__writers = dict()
+
+    def __getstate__(self) -> dict:
+        return {'root': self.__root}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state['root'])
+
+    @property
+    def root(self) -> str:
+        return self.__root
+
+    def get_archive_path(self, scene_id: str) -> str:
+        return os.path.join(self.__root, f"{scene_id}.bin")
+
+    def get_archive(self, scene_id: str) -> Optional[PackedSceneArchive]:
+        """Returns archive of the scene or None if the scene was not packed.
+        """
+        # Frames appended since the last flush are not in the index on disk yet.
+        self.flush(scene_id)
+
+        if scene_id not in self.__archives:
+            path = self.get_archive_path(scene_id)
+            self.__archives[scene_id] = PackedSceneArchive(path) if os.path.exists(path + INDEX_SUFFIX) else None
+        return self.__archives[scene_id]
+
+    def get_frame_point_cloud(self,
+                              scene_id: str,
+                              frame_id: str,
+                              use_mmap: bool = False) -> np.ndarray:
+        archive = self.get_archive(scene_id)
+
+        assert archive is not None, \
+            f"Cannot find packed archive of scene {scene_id} at {self.get_archive_path(scene_id)}"
+
+        return archive.get_frame_point_cloud(frame_id=frame_id, use_mmap=use_mmap)
+
+    def has_frame(self,
+                  scene_id: str,
+                  frame_id: str) -> bool:
+        if scene_id in self.__writers:
+            return frame_id in self.__writers[scene_id]
+
+        archive = self.get_archive(scene_id)
+        return archive is not None and frame_id in archive
+
+    def get_frame_ids(self, scene_id: str) -> set:
+        if scene_id in self.__writers:
+            return set(self.__writers[scene_id].frame_ids)
+
+        archive = self.get_archive(scene_id)
+        return set(archive.frame_ids) if archive is not None else set()
+
+    def append_frame(self,
+                     scene_id: str,
+                     frame_id: str,
+                     point_cloud: np.ndarray) -> str:
+        """Appends a frame to the archive of the scene.
+
+        :return: str
+            Path to the archive.
+        """
+        if scene_id not in self.__writers:
+            self.__writers[scene_id] = PackedSceneArchiveWriter(path=self.get_archive_path(scene_id),
+                                                                dimensions=point_cloud.shape[0])
+            # Readers should re-read the index once the archive changes.
+            self.__archives.pop(scene_id, None)
+
+        writer = self.__writers[scene_id]
+        writer.append(frame_id=frame_id, point_cloud=point_cloud)
+        return writer.path
+
+    def flush(self, scene_id: str):
+        """Saves the index of the archive of the scene and closes its writer.
+
+        Frames appended with append_frame are visible to other processes only after the flush.
+        """
+        writer = self.__writers.pop(scene_id, None)
+        if writer is not None:
+            writer.close()
+            # Readers should re-read the index once the archive changes.
+            self.__archives.pop(scene_id, None)
+
+    def close(self):
+        for scene_id in list(self.__writers.keys()):
+            self.flush(scene_id)
+
+
+def load_archive_index(path: str) -> tuple:
+    """Loads index of the archive.
+
+    :param path: str
+        Path to the archive.
+    :return: tuple[int, dict[str, tuple[int, int]]]
+        Count of dimensions and pairs of frame id to offset and count of points.
+    """
+    with np.load(path + INDEX_SUFFIX) as index:
+        dimensions = int(index['dimensions'])
+        frames_lookup = {str(frame_id): (int(offset), int(count))
+                         for frame_id, offset, count in zip(index['frame_ids'], index['offsets'], index['counts'])}
+    return dimensions, frames_lookup
+
+
+def save_archive_index(path: str,
+                       dimensions: int,
+                       frames_lookup: dict):
+    frame_ids = list(frames_lookup.keys())
+    offsets = np.array([frames_lookup[frame_id][0] for frame_id in frame_ids], dtype=np.int64)
+    counts = np.array([frames_lookup[frame_id][1] for frame_id in frame_ids], dtype=np.int64)
+
+    # np.savez appends .npz to names without it.
+    temp_path = path + '.index.tmp.npz'
+    np.savez(temp_path,
+             dimensions=np.array(dimensions, dtype=np.int64),
+             frame_ids=np.array(frame_ids, dtype=str),
+             offsets=offsets,
+             counts=counts)
+    os.replace(temp_path, path + INDEX_SUFFIX)
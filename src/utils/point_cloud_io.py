@@ -0,0 +1,46 @@
+import numpy as np
+
+
+def load_bin_point_cloud(path: str,
+                         dimensions: int,
+                         use_mmap: bool = False,
+                         dtype=np.float32) -> np.ndarray:
+    """Loads a point cloud stored as a flat binary file of nxd values.
+
+    With use_mmap the file is memory-mapped and the result is a read-only view:
+    pages are shared between processes through the OS page cache and are read
+    only when touched. Callers must copy the points before modifying them.
+
+    :param path: str
+        Path to the file.
+    :param dimensions: int
+        Count of values per point, e.g. 4 for x, y, z, intensity.
+    :param use_mmap: bool
+        Memory-map the file instead of reading it.
+    :param dtype:
+        Type of stored values.
+    :return: np.ndarray[float]
+        Point cloud of shape dxn.
+    """
+    if use_mmap:
+        raw_point_cloud = np.memmap(path, dtype=dtype, mode='r')
+    else:
+        raw_point_cloud = np.fromfile(path, dtype=dtype)
+
+    return raw_point_cloud.reshape(-1, dimensions).T
+
+
+def load_npy_point_cloud(path: str,
+                         use_mmap: bool = False) -> np.ndarray:
+    """Loads a point cloud stored as an .npy array of nxd values.
+
+    See load_bin_point_cloud for the details of memory-mapped loading.
+
+    :param path: str
+        Path to the file.
+    :param use_mmap: bool
+        Memory-map the file instead of reading it.
+    :return: np.ndarray[float]
+        Point cloud of shape dxn.
+    """
+    return np.load(path, mmap_mode='r' if use_mmap else None).T
@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+from multiprocessing.managers import SyncManager
+
+# Pool of CUDA devices, every token is a device index.
+CUDA_DEVICE_POOL = 'cuda'
+
+# Pool of CPU memory tokens, every token stands for one memory-hungry job.
+CPU_MEMORY_POOL = 'cpu_memory'
+
+
+class ResourceSlots:
+    """Named pools of resource slots shared across worker processes.
+
+    Every pool holds a fixed set of tokens in a manager queue.
+    A token is an arbitrary picklable value, e.g. a CUDA device index
+    for device slots or a slot number for CPU memory slots.
+
+    Acquiring blocks on the queue until enough tokens are released,
+    therefore workers never poll. Tokens of a pool are taken under
+    a pool lock and pools are visited in a fixed order, so requests
+    for several tokens cannot deadlock each other.
+    """
+
+    def __init__(self,
+                 manager: SyncManager,
+                 pools: dict):
+        """Creates resource pools.
+
+        :param manager: 'SyncManager'
+            Manager that owns the shared queues and locks.
+        :param pools: dict[str, list]
+            Pairs of a pool name to the list of tokens in the pool.
+        """
+        self.__queues = dict()
+        self.__locks = dict()
+        self.__capacities = dict()
+
+        for name, tokens in pools.items():
+            queue = manager.Queue()
+            for token in tokens:
+                queue.put(token)
+
+            self.__queues[name] = queue
+            self.__locks[name] = manager.Lock()
+            self.__capacities[name] = len(tokens)
+
+    @property
+    def capacities(self) -> dict:
+        return dict(self.__capacities)
+
+    @contextmanager
+    def acquire(self, requirements: dict):
+        """Blocks until all required slots are available and holds them until the context exits.
+
+        :param requirements: dict[str, int]
+            Pairs of a pool name to the count of required slots.
+        :raises:
+            ValueError if the requirements can never be satisfied.
+        :return: dict[str, list]
+            Pairs of a pool name to the list of acquired tokens.
+        """
+        for name, count in requirements.items():
+            capacity = self.__capacities.get(name, 0)
+            if count > capacity:
+                raise ValueError(f"Requested {count} slots from pool '{name}', but its capacity is {capacity}")
+
+        acquired = dict()
+        try:
+            for name in sorted(requirements.keys()):
+                tokens = list()
+                acquired[name] = tokens
+
+                with self.__locks[name]:
+                    for _ in range(requirements[name]):
+                        tokens.append(self.__queues[name].get())
+
+            yield acquired
+        finally:
+            for name, tokens in acquired.items():
+                for token in tokens:
+                    self.__queues[name].put(token)
+
+
+def create_device_tokens(devices_count: int,
+                         slots_per_device: int) -> list:
+    """Returns device tokens interleaved across the devices.
+
+    Interleaving makes consecutive acquisitions land on different devices.
+
+    :param devices_count: int
+        Count of available devices.
+    :param slots_per_device: int
+        Count of jobs allowed to run on a single device at once.
+    :return: list[int]
+        List of device indices.
+    """
+    return [device for _ in range(slots_per_device) for device in range(devices_count)]
@@ -0,0 +1,122 @@
+import numpy as np
+
+from typing import Optional
+
+
+def compose_transforms(*transformation_matrices: np.ndarray) -> np.ndarray:
+    """Composes rigid transformations into one.
+
+    Matrices are multiplied in float64, so large intermediate translations,
+    e.g. global coordinates, do not lose precision of the composed transformation.
+
+    :param transformation_matrices: np.ndarray[float]
+        4x4 transformations in order of application.
+    :return: np.ndarray[float]
+        4x4 transformation equal to applying the given ones in order.
+    """
+    composed = np.eye(4)
+    for transformation_matrix in transformation_matrices:
+        composed = np.asarray(transformation_matrix, dtype=np.float64).dot(composed)
+    return composed
+
+
+def apply_rigid_transform(point_cloud: np.ndarray,
+                          transformation_matrix: np.ndarray,
+                          out: Optional[np.ndarray] = None,
+                          buffer: Optional[np.ndarray] = None) -> np.ndarray:
+    """Applies R·p + t to the first 3 dimensions of the point cloud.
+
+    The computation runs in the dtype of the point cloud without homogeneous copies.
+    The point cloud is transformed in place unless out is given. Transforming
+    in place needs a 3xn scratch buffer, it is allocated if not given.
+
+    Runtime complexity is O(n).
+
+    :param point_cloud: np.ndarray[float]
+        Point cloud of shape dxn, d >= 3.
+    :param transformation_matrix: np.ndarray[float]
+        Transformation matrix that describes rotation and translation of shape [4, 4].
+    :param out: Optional[np.ndarray[float]]
+        Array of the same shape and dtype to write the result to,
+        remaining dimensions are copied.
+    :param buffer: Optional[np.ndarray[float]]
+        Scratch array of shape 3xm, m >= n, and dtype of the point cloud.
+    :return: np.ndarray[float]
+        Transformed point cloud, either out or the given point cloud.
+    """
+    assert np.issubdtype(point_cloud.dtype, np.floating), \
+        f"Point cloud should be of a floating dtype, but got {point_cloud.dtype}"
+
+    dtype = point_cloud.dtype
+    points_count = point_cloud.shape[1]
+    rotation = np.asarray(transformation_matrix[:3, :3], dtype=dtype)
+    translation = np.asarray(transformation_matrix[:3, 3:4], dtype=dtype)
+
+    if out is not None and out is not point_cloud:
+        assert out.shape == point_cloud.shape and out.dtype == dtype, \
+            f"Output should be of shape {point_cloud.shape} and dtype {dtype}, but got {out.shape} and {out.dtype}"
+
+        np.matmul(rotation, point_cloud[:3, :], out=out[:3, :])
+        out[:3, :] += translation
+        out[3:, :] = point_cloud[3:, :]
+        return out
+
+    if buffer is None:
+        buffer = np.empty((3, points_count), dtype=dtype)
+
+    assert buffer.dtype == dtype and buffer.shape[0] == 3 and buffer.shape[1] >= points_count, \
+        f"Buffer should be of shape 3x{points_count} or wider and dtype {dtype}, " \
+        f"but got {buffer.shape} and {buffer.dtype}"
+
+    scratch = buffer[:, :points_count]
+    np.matmul(rotation, point_cloud[:3, :], out=scratch)
+    scratch += translation
+    point_cloud[:3, :] = scratch
+    return point_cloud
+
+
+def apply_rigid_transforms(point_clouds: list,
+                           transformation_matrices: list,
+                           dtype: np.dtype) -> np.ndarray:
+    """Applies a transformation to every point cloud and concatenates the results.
+
+    Point clouds are converted to the dtype while they are copied into a single
+    output array, which is then transformed segment by segment through one shared
+    scratch buffer. Given point clouds are not modified, and there are no
+    per-cloud copies to concatenate afterwards.
+
+    Runtime complexity is O(n), where n is the total count of points.
+
+    :param point_clouds: list[np.ndarray[float]]
+        Point clouds of shape dxn_i with the same d.
+    :param transformation_matrices: list[np.ndarray[float]]
+        4x4 transformation for every point cloud, e.g. an array of shape kx4x4.
+    :param dtype: np.dtype
+        Floating dtype of the result.
+    :return: np.ndarray[float]
+        Transformed point clouds concatenated in order, of shape dx(n_1 + ... + n_k).
+    """
+    assert len(point_clouds) == len(transformation_matrices), \
+        f"Expected a transformation per point cloud, got {len(transformation_matrices)} " \
+        f"transformations for {len(point_clouds)} point clouds"
+    assert len(point_clouds) > 0, \
+        "Expected at least one point cloud"
+
+    dimensions = point_clouds[0].shape[0]
+    assert all(point_cloud.shape[0] == dimensions for point_cloud in point_clouds), \
+        f"Point clouds should have {dimensions} dimensions"
+
+    points_counts = [point_cloud.shape[1] for point_cloud in point_clouds]
+    result = np.empty((dimensions, sum(points_counts)), dtype=dtype)
+    buffer = np.empty((3, max(points_counts)), dtype=dtype)
+
+    start = 0
+    for point_cloud, transformation_matrix, points_count in zip(point_clouds, transformation_matrices, points_counts):
+        segment = result[:, start:start + points_count]
+        segment[...] = point_cloud
+        apply_rigid_transform(point_cloud=segment,
+                              transformation_matrix=transformation_matrix,
+                              buffer=buffer)
+        start += points_count
+
+    return result
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+
+
+def stable_scene_hash(scene_id: str) -> int:
+    """Returns a hash of the scene id that is stable across processes and machines.
+
+    Built-in hash is salted per process, therefore it cannot be used to split work between nodes.
+
+    :param scene_id: str
+        Unique scene identifier.
+    :return: int
+        Non-negative hash value.
+    """
+    return int.from_bytes(hashlib.md5(str(scene_id).encode('utf-8')).digest()[:8], byteorder='big')
+
+
+def get_scenes_digest(scene_ids: list) -> str:
+    """Returns a digest of the set of scenes.
+
+    :param scene_ids: list[str]
+        IDs of scenes, the order does not matter.
+    :return: str
+        Hex digest.
+    """
+    scenes_hash = hashlib.sha1()
+    for scene_id in sorted(map(str, scene_ids)):
+        scenes_hash.update(scene_id.encode('utf-8'))
+        scenes_hash.update(b'\n')
+    return scenes_hash.hexdigest()
+
+
+def shard_scenes_by_hash(scene_ids: list,
+                         shard_index: int,
+                         num_shards: int) -> list:
+    """Returns scenes of the shard using stable hashing of scene ids.
+
+    Runtime complexity is O(scenes).
+
+    :param scene_ids: list[str]
+        IDs of all scenes in the dataset.
+    :param shard_index: int
+        Index of the shard in [0, num_shards).
+    :param num_shards: int
+        Overall count of shards.
+    :return: list[str]
+        Sorted IDs of scenes assigned to the shard.
+    """
+    __check_shard(shard_index=shard_index, num_shards=num_shards)
+    return sorted(scene_id for scene_id in scene_ids if stable_scene_hash(scene_id) % num_shards == shard_index)
+
+
+def shard_scenes_by_cost(scene_costs: dict,
+                         shard_index: int,
+                         num_shards: int) -> list:
+    """Returns scenes of the shard balancing the overall cost between shards.
+
+    Scenes are assigned greedily from the most expensive one to the shard
+    with the lowest cost so far. Ties are broken by scene id and shard index,
+    so every node computes the same partitioning.
+
+    Runtime complexity is O(scenes * log(scenes) + scenes * shards).
+
+    :param scene_costs: dict[str, float]
+        Pairs of scene id to the cost of the scene, e.g. count of frames.
+    :param shard_index: int
+        Index of the shard in [0, num_shards).
+    :param num_shards: int
+        Overall count of shards.
+    :return: list[str]
+        Sorted IDs of scenes assigned to the shard.
+    """
+    __check_shard(shard_index=shard_index, num_shards=num_shards)
+
+    shard_costs = [0] * num_shards
+    shard_scenes = [[] for _ in range(num_shards)]
+
+    for scene_id, cost in sorted(scene_costs.items(), key=lambda item: (-item[1], str(item[0]))):
+        cheapest_shard = min(range(num_shards), key=lambda i: (shard_costs[i], i))
+        shard_costs[cheapest_shard] += cost
+        shard_scenes[cheapest_shard].append(scene_id)
+
+    return sorted(shard_scenes[shard_index])
+
+
+def get_shard_summary_path(summary_dir: str,
+                           shard_index: int,
+                           num_shards: int) -> str:
+    return os.path.join(summary_dir, f"shard_{shard_index:04d}_of_{num_shards:04d}.json")
+
+
+def write_shard_summary(path: str,
+                        summary: dict):
+    """Writes shard summary as a json file.
+
+    :param path: str
+        Path to the summary file.
+    :param summary: dict
+        Summary, see create_shard_summary.
+    """
+    dir_path = os.path.dirname(path)
+    if len(dir_path) > 0:
+        os.makedirs(dir_path, exist_ok=True)
+
+    with open(path, 'w') as file:
+        json.dump(summary, file, indent=2)
+
+
+def create_shard_summary(dataset_name: str,
+                         all_scene_ids: list,
+                         shard_index: int,
+                         num_shards: int,
+                         sharding_strategy: str,
+                         expected_frames_per_scene: dict,
+                         serialised_frames_per_scene: dict) -> dict:
+    """Creates a summary of the processed shard.
+
+    :param dataset_name: str
+        Name of the dataset.
+    :param all_scene_ids: list[str]
+        IDs of all scenes of the dataset, not only the shard.
+    :param shard_index: int
+        Index of the shard.
+    :param num_shards: int
+        Overall count of shards.
+    :param sharding_strategy: str
+        Strategy used to split the scenes.
+    :param expected_frames_per_scene: dict[str, list[str]]
+        Pairs of scene id of the shard to the list of frame ids that should be patched.
+    :param serialised_frames_per_scene: dict[str, list[str]]
+        Pairs of scene id of the shard to the list of frame ids found in the output after processing.
+    :return: dict
+        Json-serialisable summary.
+    """
+    return {
+        'dataset': dataset_name,
+        'shard_index': shard_index,
+        'num_shards': num_shards,
+        'sharding_strategy': sharding_strategy,
+        'all_scenes_count': len(all_scene_ids),
+        'all_scenes_digest': get_scenes_digest(all_scene_ids),
+        'scenes': {str(scene_id): {
+            'expected_frames': sorted(map(str, frame_ids)),
+            'serialised_frames': sorted(map(str, serialised_frames_per_scene.get(scene_id, []))),
+        } for scene_id, frame_ids in expected_frames_per_scene.items()},
+    }
+
+
+def merge_shard_summaries(summaries: list) -> dict:
+    """Merges summaries of all shards and verifies that every frame was covered exactly once.
+
+    A frame is covered if its scene belongs to exactly one shard and the shard
+    found the frame in the output, so crashed or incomplete shards fail the check.
+
+    :param summaries: list[dict]
+        Summaries of all shards.
+    :raises:
+        ValueError if shards are inconsistent, missing or overlapping.
+    :return: dict
+        Merged summary.
+    """
+    if len(summaries) == 0:
+        raise ValueError("No shard summaries to merge")
+
+    reference = summaries[0]
+    for key in ['dataset', 'num_shards', 'sharding_strategy', 'all_scenes_count', 'all_scenes_digest']:
+        values = set(summary[key] for summary in summaries)
+        if len(values) != 1:
+            raise ValueError(f"Shards disagree on {key}: {sorted(map(str, values))}")
+
+    num_shards = reference['num_shards']
+    shard_indices = sorted(summary['shard_index'] for summary in summaries)
+    if shard_indices != list(range(num_shards)):
+        missing = sorted(set(range(num_shards)) - set(shard_indices))
+        raise ValueError(f"Expected shards 0..{num_shards - 1}, missing {missing}, got {shard_indices}")
+
+    scene_to_shard_lookup = dict()
+    frames_count = 0
+
+    for summary in summaries:
+        for scene_id, scene_frames in summary['scenes'].items():
+            if scene_id in scene_to_shard_lookup:
+                raise ValueError(f"Scene {scene_id} is covered by shards "
+                                 f"{scene_to_shard_lookup[scene_id]} and {summary['shard_index']}")
+            scene_to_shard_lookup[scene_id] = summary['shard_index']
+
+            expected_frames = set(scene_frames['expected_frames'])
+            missing_frames = expected_frames - set(scene_frames['serialised_frames'])
+            if len(missing_frames) > 0:
+                raise ValueError(f"Shard {summary['shard_index']} did not write {len(missing_frames)} of "
+                                 f"{len(expected_frames)} frames of scene {scene_id}, "
+                                 f"e.g. {sorted(missing_frames)[:5]}")
+
+            frames_count += len(expected_frames)
+
+    covered_scenes = list(scene_to_shard_lookup.keys())
+    if len(covered_scenes) != reference['all_scenes_count'] or \
+            get_scenes_digest(covered_scenes) != reference['all_scenes_digest']:
+        raise ValueError(f"Shards cover {len(covered_scenes)} scenes, "
+                         f"expected {reference['all_scenes_count']} scenes of the dataset")
+
+    return {
+        'dataset': reference['dataset'],
+        'num_shards': num_shards,
+        'sharding_strategy': reference['sharding_strategy'],
+        'scenes_count': len(covered_scenes),
+        'frames_count': frames_count,
+        'scene_to_shard': scene_to_shard_lookup,
+    }
+
+
+def __check_shard(shard_index: int,
+                  num_shards: int):
+    assert num_shards > 0, \
+        f"num_shards should be positive, got {num_shards}"
+    assert 0 <= shard_index < num_shards, \
+        f"shard_index should be in [0, {num_shards}), got {shard_index}"
@@ -1,131 +1,63 @@
 import argparse
 import os
-import numpy as np
 import multiprocessing
 import pickle
 
 from tqdm import tqdm
 from functools import partial
 
-from src.datasets.once.once_utils import aggregate_frames_in_sequences, build_frame_id_to_annotations_lookup
-
-
-class Instance:
-    def __init__(self, instance_id, tracking, category, scene_id, frame_ids, boxes_3d):
-        self.instance_id = instance_id
-        self.tracking = tracking
-        self.category = category
-        self.scene_id = scene_id
-        self.frame_ids = []
-        self.boxes_3d = []
+from src.datasets.once.once_utils import partition_frames_by_sequence
+from src.tracking.association import ASSOCIATION_MATCHERS
+from src.tracking.online_tracker import OnlineTracker
 
 
 def track_instances(scene_id: str,
-                    path_to_infos: str,
+                    frames_data: list,
                     save_dir: str,
-                    force_overwrite: bool):
-    with open(path_to_infos, 'rb') as file:
-        split_infos_pickle = pickle.load(file)
-
-    sequences_to_frames_lookup = aggregate_frames_in_sequences(split_infos_pickle)
-    frame_id_to_annotations_lookup = build_frame_id_to_annotations_lookup(split_infos_pickle)
-
-    instances_dict = {}
+                    force_overwrite: bool,
+                    matcher: str = 'greedy',
+                    max_age: int = 0,
+                    predict_motion: bool = False):
+    """Assigns instance ids to the annotations of the sequence and saves them.
+
+    :param scene_id: str
+        ID of a sequence.
+    :param frames_data: list[dict]
+        Annotated frames of the sequence in order, see partition_frames_by_sequence.
+    :param save_dir: str
+        Directory to save tracked files.
+    :param force_overwrite: bool
+        Overwrite saved files.
+    :param matcher: str
+        Assignment algorithm of detections to tracks, see src.tracking.association.
+    :param max_age: int
+        Count of consecutive frames a track can be missed before it is dropped.
+    :param predict_motion: bool
+        Predict tracks with their last velocity before matching, see OnlineTracker.
+    """
     output_file_path = os.path.normpath(os.path.join(save_dir, f"once_raw_small_{scene_id}.pkl"))
 
     if not force_overwrite and os.path.exists(output_file_path):
         print(f"Skipping sequence: {scene_id}")
         return
 
-    frames = sequences_to_frames_lookup[scene_id]
-    current_and_next_iterator = zip(frames, frames[1:])
-
-    scene_annotations = []
-    next_frame_data = []
-
-    for frame_id, next_frame_id in tqdm(current_and_next_iterator, desc=f"Sequence {scene_id}", total=len(frames)):
-        current_frame_data = frame_id_to_annotations_lookup[frame_id]
-        current_annotations = current_frame_data['annos']
-
-        current_categories = current_annotations['name']
-        current_boxes_3d = current_annotations['boxes_3d']
-
-        next_frame_data = frame_id_to_annotations_lookup[next_frame_id]
-        next_annotations = next_frame_data.get('annos', None)
-
-        next_categories = next_annotations['name']
-        next_boxes_3d = next_annotations['boxes_3d']
-
-        if not instances_dict:
-            # first frame
-            first_instance_ids = []
-
-            for idx, category in enumerate(current_categories):
-                first_instance_ids.append(len(instances_dict))
-                instance = Instance(instance_id=len(instances_dict),
-                                    tracking=[],
-                                    category=category,
-                                    scene_id=scene_id,
-                                    frame_ids=[],
-                                    boxes_3d=[])
-                instance.frame_ids.append(frame_id)
-                box = current_boxes_3d[idx]
-                instance.boxes_3d.append(box)
-                instances_dict[len(instances_dict)] = instance
-
-            # fill instance ids for the first frame with annotations
-            current_frame_data["annos"]["instance_ids"] = first_instance_ids
-
-        next_instance_ids = []
-
-        for idx, next_category in enumerate(next_categories):
-            next_box_3d = next_boxes_3d[idx]
-            next_center = [next_box_3d[0], next_box_3d[1], next_box_3d[2]]
-            matched_instance_id = None
-            min_distance = max(next_box_3d[3:6]) * 2
-
-            for instance_id, instance in instances_dict.items():
-                if frame_id in instance.frame_ids and instance.category == next_category:
-                    current_box_3d = instance.boxes_3d[-1]
-                    current_center = [
-                        current_box_3d[0],
-                        current_box_3d[1],
-                        current_box_3d[2]]
-                    distance = np.linalg.norm(
-                        np.array(current_center) - np.array(next_center))
-
-                    if distance < min_distance:
-                        min_distance = distance
-                        matched_instance_id = instance_id
-
-            if matched_instance_id is not None:
-                # matched
-                next_instance_ids.append(matched_instance_id)
-                instances_dict[matched_instance_id].frame_ids.append(
-                    next_frame_id)
-                instances_dict[matched_instance_id].boxes_3d.append(
-                    next_box_3d)
-
-            else:
-                # unmatched object
-                next_instance_ids.append(len(instances_dict))
-                new_instance = Instance(instance_id=len(instances_dict),
-                                        tracking=[],
-                                        category=next_category,
-                                        scene_id=scene_id,
-                                        frame_ids=[],
-                                        boxes_3d=[])
-
-                instances_dict[len(instances_dict)] = new_instance
-                new_instance.frame_ids.append(next_frame_id)
-                box = next_boxes_3d[idx]
-                new_instance.boxes_3d.append(box)
-                instances_dict[len(instances_dict)] = new_instance
-
-        next_frame_data["annos"]["instance_ids"] = next_instance_ids
-        scene_annotations.append(current_frame_data)
-
-    scene_annotations.append(next_frame_data)
+    if len(frames_data) == 0:
+        print(f"No annotated frames in sequence: {scene_id}")
+        return
+
+    # Frames are consumed one at a time, the tracker keeps only active tracks.
+    tracker = OnlineTracker(matcher=matcher, max_age=max_age, predict_motion=predict_motion)
+
+    for frame_data in tqdm(frames_data, desc=f"Sequence {scene_id}"):
+        annotations = frame_data['annos']
+        instance_ids = tracker.update(categories=annotations['name'],
+                                      boxes_3d=annotations['boxes_3d'])
+        annotations['instance_ids'] = instance_ids.tolist()
+
+    print(f"Sequence {scene_id}: {tracker.frames_count} frames, {tracker.tracks_count} tracks, "
+          f"{tracker.fps:.0f} frames/s")
+
+    scene_annotations = list(frames_data)
 
     try:
         with open(output_file_path, 'wb') as destination_file:
@@ -134,22 +66,52 @@ def track_instances(scene_id: str,
         print(f"Source file not found.")
 
 
+def __track_sequence(sequence: tuple,
+                     save_dir: str,
+                     force_overwrite: bool,
+                     matcher: str,
+                     max_age: int,
+                     predict_motion: bool):
+    scene_id, frames_data = sequence
+    track_instances(scene_id=scene_id,
+                    frames_data=frames_data,
+                    save_dir=save_dir,
+                    force_overwrite=force_overwrite,
+                    matcher=matcher,
+                    max_age=max_age,
+                    predict_motion=predict_motion)
+
+
 def __parallel_process(scenes,
                        path_to_infos,
                        save_dir,
                        force_overwrite,
-                       num_workers):
+                       num_workers,
+                       matcher,
+                       max_age,
+                       predict_motion):
     print(f"Using {num_workers} CPUs.")
 
+    # The split is unpickled and partitioned once, every task receives only the frames of its sequence.
+    with open(path_to_infos, 'rb') as file:
+        split_infos_pickle = pickle.load(file)
+
+    sequences_to_frames_data = partition_frames_by_sequence(split_infos_pickle)
+    del split_infos_pickle
+
+    sequences = [(scene_id, sequences_to_frames_data.get(scene_id, [])) for scene_id in scenes]
+
     process_single_sequence = partial(
-        track_instances,
-        path_to_infos=path_to_infos,
+        __track_sequence,
         save_dir=save_dir,
-        force_overwrite=force_overwrite
+        force_overwrite=force_overwrite,
+        matcher=matcher,
+        max_age=max_age,
+        predict_motion=predict_motion
     )
 
     with multiprocessing.Pool(num_workers) as p:
-        list(tqdm(p.imap_unordered(process_single_sequence, scenes), total=len(scenes)))
+        list(tqdm(p.imap_unordered(process_single_sequence, sequences), total=len(sequences)))
 
 
 def parse_arguments():
@@ -162,6 +124,13 @@ def parse_arguments():
     parser.add_argument('--force_overwrite', action='store_true', help='Overwrite saved files.')
     parser.add_argument('--num_workers', type=int, default=multiprocessing.cpu_count(),
                         help='Count of parallel workers.')
+    parser.add_argument('--matcher', type=str, choices=ASSOCIATION_MATCHERS, default='greedy',
+                        help='Assignment of detections to tracks, hungarian requires scipy.')
+    parser.add_argument('--max_age', type=int, default=0,
+                        help='Count of consecutive frames a track can be missed before it is dropped.')
+    parser.add_argument('--predict_motion', action='store_true',
+                        help='Predict tracks with constant velocity before matching. Instance ids differ '
+                             'from the ones assigned on the fly by patch_scene.py --track_once_instances.')
     return parser.parse_args()
 
 
@@ -191,4 +160,7 @@ if __name__ == '__main__':
                        pickled_infos_path,
                        save_dir_path,
                        overwrite,
-                       args.num_workers)
+                       args.num_workers,
+                       args.matcher,
+                       args.max_age,
+                       args.predict_motion)